@@ -0,0 +1,168 @@
+"""
+Offline end-to-end benchmark of the research pipeline.
+
+Runs main.run_pipeline for N topics against a fake LLM provider (configurable
+latency distribution and 429 injection) and a local HTTP server that serves
+both the Custom Search API and a generated HTML/PDF corpus. No API keys or
+internet access are used, so concurrency and caching changes can be measured
+reproducibly.
+
+    python -m benchmarks.bench_pipeline --topics 4 --concurrency 2 --stream
+    python -m benchmarks.bench_pipeline --topics 2 --repeat 2   # cold vs. warm caches
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_provider import FakeProvider
+from benchmarks.fake_web import FakeWeb
+
+BASE_TOPICS = [
+    "Efficient transformer inference on edge devices",
+    "Federated learning for medical imaging",
+    "Graph neural networks for traffic forecasting",
+    "Energy consumption of large language models",
+    "Retrieval augmented generation evaluation",
+    "Robustness of speech recognition models",
+]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline pipeline benchmark")
+    parser.add_argument("--topics", type=int, default=3, help="Number of topics per repetition")
+    parser.add_argument("--concurrency", type=int, default=1, help="Topics run concurrently")
+    parser.add_argument("--repeat", type=int, default=1, help="Repetitions over the same topics (caches persist)")
+    parser.add_argument("--stream", action="store_true", help="Use the streaming Stage 2-4 executor")
+    parser.add_argument("--latency-ms", type=float, default=300, help="Median fake LLM latency")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="Log-normal sigma of fake LLM latency")
+    parser.add_argument("--rate-limit-prob", type=float, default=0.0, help="Probability a fake LLM call returns 429")
+    parser.add_argument("--results-per-query", type=int, default=6, help="Search results per fake query")
+    parser.add_argument("--pdf-share", type=float, default=0.5, help="Share of fake documents served as PDF")
+    parser.add_argument("--pdf-pages", type=int, default=8, help="Pages per fake PDF")
+    parser.add_argument("--no-cache", action="store_true", help="Disable LLM/fetch/search caches")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON summary to this path")
+    parser.add_argument("--verbose", action="store_true", help="Show pipeline output")
+    return parser.parse_args()
+
+def configure_environment(workdir, web, args):
+    """
+    Points every cache, checkpoint and endpoint at the sandbox. Must run
+    before any pipeline module is imported, since they read config at import.
+    """
+    cache_dir = os.path.join(workdir, "cache")
+    os.environ.update({
+        "GOOGLE_API_KEY": "bench",
+        "GOOGLE_CSE_ID": "bench",
+        "GOOGLE_SEARCH_URL": f"{web.base_url}/customsearch/v1",
+        "CSE_QUOTA_CEILING": "1000000",
+        "LLM_CACHE_PATH": os.path.join(cache_dir, "llm_cache.sqlite"),
+        "FETCH_CACHE_PATH": os.path.join(cache_dir, "fetch_cache.sqlite"),
+        "SEARCH_CACHE_PATH": os.path.join(cache_dir, "search_cache.sqlite"),
+        "RUNS_DIR": os.path.join(workdir, "runs"),
+        "ENABLE_OFFLINE_FALLBACK": "False",
+        # Keep the fake provider from being throttled by real-provider budgets
+        "FAKE_RPM": "0",
+        "FAKE_TPM": "0",
+    })
+    if args.no_cache:
+        os.environ.update({
+            "LLM_CACHE_DISABLED": "True",
+            "FETCH_CACHE_DISABLED": "True",
+            "SEARCH_CACHE_DISABLED": "True",
+        })
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix="research-bench-")
+    web = FakeWeb(args.results_per_query, args.pdf_share, args.pdf_pages, seed=args.seed).start()
+    configure_environment(workdir, web, args)
+
+    # Imported only now so module-level configuration sees the sandbox
+    from utils import llm
+    from utils import tracing
+    from utils import concurrency
+    from utils.checkpoint import RunStore
+    from main import run_pipeline
+
+    provider = FakeProvider(args.latency_ms, args.latency_sigma, args.rate_limit_prob, seed=args.seed)
+    # Two prefixes get separate circuit breakers, so injected 429s exercise failover
+    llm.register_provider("fake", provider.factory)
+    llm.register_provider("fakebackup", provider.factory)
+    for stage in llm.STAGE_CONFIG:
+        llm.STAGE_CONFIG[stage] = ["fake", "fakebackup"]
+
+    topics = [BASE_TOPICS[i % len(BASE_TOPICS)] + (f" ({i // len(BASE_TOPICS)})" if i >= len(BASE_TOPICS) else "")
+              for i in range(args.topics)]
+
+    def run_topic(topic):
+        started = time.time()
+        store = RunStore.create(topic, options={"stream": args.stream})
+        try:
+            paper = run_pipeline(topic, store, stream=args.stream)
+            error = None
+        except Exception as e:
+            paper, error = None, str(e)[:200]
+        return {"topic": topic, "ok": paper is not None, "error": error,
+                "latency_s": round(time.time() - started, 2)}
+
+    repetitions = []
+    sink = None if args.verbose else open(os.devnull, "w")
+    try:
+        for rep in range(args.repeat):
+            calls_before = provider.calls
+            started = time.time()
+            with contextlib.redirect_stdout(sink) if sink else contextlib.nullcontext():
+                with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as executor:
+                    results = list(executor.map(run_topic, topics))
+            wall = time.time() - started
+            repetitions.append({
+                "repetition": rep + 1,
+                "wall_time_s": round(wall, 2),
+                "topics_per_min": round(len(topics) / wall * 60, 2) if wall else 0.0,
+                "llm_calls": provider.calls - calls_before,
+                "topics": results,
+            })
+            print(f"Repetition {rep + 1}: {len(topics)} topics in {wall:.1f}s "
+                  f"({repetitions[-1]['topics_per_min']} topics/min, {repetitions[-1]['llm_calls']} LLM calls, "
+                  f"{sum(r['ok'] for r in results)} succeeded)")
+    finally:
+        if sink:
+            sink.close()
+        web.stop()
+
+    report = tracing.build_report()
+    summary = {
+        "config": vars(args),
+        "repetitions": repetitions,
+        "stages": report["stages"],
+        "providers": report["providers"],
+        "llm_by_stage": report["llm_by_stage"],
+        "network": report["network"],
+        "fake_provider": {"calls": provider.calls, "rate_limited": provider.rate_limited},
+        "fake_web": dict(web.requests),
+        "concurrency": concurrency.concurrency_status(),
+        "workdir": workdir,
+    }
+
+    print("\nPer-stage latency (all repetitions):")
+    print(f"  {'stage':<22}{'calls':>6}{'mean s':>9}{'max s':>9}")
+    for name, entry in sorted(summary["stages"].items(), key=lambda kv: -kv[1]["wall_time_s"]):
+        mean = entry["wall_time_s"] / entry["calls"] if entry["calls"] else 0.0
+        print(f"  {name:<22}{entry['calls']:>6}{mean:>9.2f}{entry['max_time_s']:>9.2f}")
+    print(f"\nFake web: {summary['fake_web']}  Fake LLM: {summary['fake_provider']}")
+    concurrency.print_concurrency_status()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+        print(f"Summary written to {args.output}")
+
+if __name__ == "__main__":
+    main()
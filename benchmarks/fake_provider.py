@@ -0,0 +1,154 @@
+import re
+import json
+import time
+import random
+import threading
+
+class FakeRateLimitError(Exception):
+    pass
+
+class FakeProvider:
+    """
+    Offline stand-in for an LLM provider. Answers every pipeline prompt with
+    canned, well-formed output after a simulated latency, and can inject
+    429-style failures at a configurable rate.
+
+    Latency is log-normal: median_ms sets the typical call, sigma the tail.
+    """
+
+    def __init__(self, median_ms=300, sigma=0.5, rate_limit_prob=0.0, retry_after=0.5, seed=0):
+        self.median = median_ms / 1000.0
+        self.sigma = sigma
+        self.rate_limit_prob = rate_limit_prob
+        self.retry_after = retry_after
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.rate_limited = 0
+
+    def _draw(self):
+        with self._lock:
+            self.calls += 1
+            latency = self.median * self._rng.lognormvariate(0, self.sigma)
+            limited = self._rng.random() < self.rate_limit_prob
+            if limited:
+                self.rate_limited += 1
+        return latency, limited
+
+    def __call__(self, prompt):
+        latency, limited = self._draw()
+        if limited:
+            # Rate limits answer fast, like the real APIs
+            time.sleep(min(latency, 0.05))
+            raise FakeRateLimitError(f"Error code: 429 - Rate limit reached. Please try again in {self.retry_after}s.")
+        time.sleep(latency)
+        return respond(prompt)
+
+    def factory(self, model_id):
+        return self
+
+PAPER_SECTIONS = ["Abstract", "Keywords", "Introduction", "Literature Review", "Research Gap & Objectives",
+                  "Methodology", "Results", "Discussion", "Conclusion & Future Work", "References"]
+
+def _topic(prompt):
+    match = re.search(r'(?:Topic|User Topic|Target Research Topic|topic):?\s*"?([^"\n]+)"?', prompt)
+    return match.group(1).strip() if match else "the research topic"
+
+def respond(prompt):
+    """
+    Canned response matching the prompt of each pipeline stage.
+    """
+    topic = _topic(prompt)
+
+    if "expert research planner" in prompt:
+        words = [w for w in re.findall(r"[A-Za-z]+", topic) if len(w) > 3] or ["research"]
+        subtopics = []
+        for i, aspect in enumerate(["methods", "evaluation", "applications"]):
+            name = f"{words[i % len(words)]} {aspect}"
+            subtopics.append({
+                "name": name,
+                "keywords": [words[i % len(words)].lower(), aspect],
+                "search_queries": [f"{topic} {aspect}", f"{name} survey"],
+            })
+        return json.dumps({"domain": "Computer Science", "subtopics": subtopics})
+
+    if "Analyze this segment" in prompt:
+        return ("- Problem: scaling the studied method\n- Methodology: controlled experiments on public data\n"
+                "- Findings: 12% improvement over baseline\n- Limitations: single domain")
+
+    if "Analyze the following research document" in prompt:
+        return json.dumps({
+            "research_problem": "Improving efficiency of the studied approach.",
+            "methodology": "Transformer baseline compared against a pruned variant on three datasets.",
+            "key_findings": "Pruned model keeps 98% accuracy at 40% lower latency.",
+            "limitations": "Evaluation limited to English corpora.",
+            "research_gaps": "No study of energy consumption.",
+            "novelty_assessment": "Moderate",
+            "technical_depth_score": 7,
+            "missing_entities": "Hardware configuration, energy figures",
+        })
+
+    if "Deep Knowledge" in prompt:
+        # Vary with the already-searched list so later deepening rounds get new queries
+        searched = len(re.findall(r"^\s*- ", prompt.split("Already searched", 1)[1], re.M)) if "Already searched" in prompt else 0
+        return json.dumps({"queries": [f"{topic} energy consumption benchmark {searched}",
+                                       f"{topic} hardware configuration {searched}"]})
+
+    if "Score EACH" in prompt:
+        ids = re.findall(r"\[Document (D\d+)\]", prompt)
+        return json.dumps({"scores": [
+            {"id": doc_id, "score": 8, "strengths": "Clear method", "weaknesses": "Narrow scope"}
+            for doc_id in ids
+        ]})
+
+    if "Strict Academic Reviewer" in prompt:
+        return json.dumps({"score": 8, "strengths": "Clear method", "weaknesses": "Narrow scope"})
+
+    if "Author Model" in prompt:
+        return json.dumps({
+            "research_gap": "Energy cost of efficient inference is unmeasured.",
+            "proposed_contribution": "An energy-aware pruning framework.",
+            "synthesis_of_related_work": "Prior work optimizes latency but not energy.",
+            "methodology_plan": "Simulate pruning schedules and estimate energy per query.",
+            "simulated_results_description": "Simulated results show 30% lower energy.",
+            "conclusion_plan": "Summarize trade-offs and future hardware studies.",
+        })
+
+    if "Senior Editor" in prompt:
+        if "Revised Sections" in prompt:
+            block = prompt.split("Revised Sections", 1)[1].split("Task:", 1)[0]
+            revised = re.findall(r"^\s*## ([^\n]+)\n(.*?)(?=^\s*## |\Z)", block, re.M | re.S)
+            # Results needs a second revision, so a partial round that still fails is exercised
+            return json.dumps({"sections": [
+                {"section": name, "score": 5, "critique": "Still lacks detail."}
+                if name == "Results" and "Further revised" not in text else
+                {"section": name, "score": 8, "critique": "Much improved."}
+                for name, text in revised
+            ]})
+        if "Revised academic prose" in prompt:
+            # Full confirmation review of a revised paper
+            return json.dumps({"score": 8, "critique": "Ready for submission.", "sections": [
+                {"section": name, "score": 8, "critique": "Fine."} for name in PAPER_SECTIONS
+            ]})
+        # First full review rejects two sections, so the revision loop is exercised
+        return json.dumps({
+            "score": 6,
+            "critique": "Literature review is thin and results lack detail.",
+            "sections": [
+                {"section": name, "score": 5 if name in ("Literature Review", "Results") else 8,
+                 "critique": "Needs more depth." if name in ("Literature Review", "Results") else "Fine."}
+                for name in PAPER_SECTIONS
+            ],
+        })
+
+    if "revising one section" in prompt:
+        match = re.search(r'CURRENT TEXT OF THE SECTION "([^"]+)":(.*?)EDITOR CRITIQUE', prompt, re.S)
+        name, current = match.group(1), match.group(2)
+        prose = "Further revised academic prose. " if "Revised academic prose" in current else "Revised academic prose. "
+        return f"## {name}\n\n" + (prose * 40)
+
+    if "expert academic author" in prompt:
+        body = "\n\n".join(f"## {name}\n\n" + ("Simulated academic prose. " * 40) for name in PAPER_SECTIONS)
+        return f"# {topic}\n\n{body}"
+
+    return "Acknowledged."
@@ -0,0 +1,162 @@
+import json
+import random
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+_WORDS = ("model data method result accuracy latency training dataset evaluation baseline "
+          "pruning transformer energy efficiency benchmark analysis system approach network").split()
+
+def _paragraphs(rng, count, words=80):
+    return ["".join(
+        " ".join(rng.choice(_WORDS) for _ in range(12)).capitalize() + ". "
+        for _ in range(words // 12)
+    ) for _ in range(count)]
+
+def make_html(title, rng, paragraphs=30):
+    body = "".join(f"<p>{p}</p>" for p in _paragraphs(rng, paragraphs))
+    return (f"<html><head><title>{title}</title><script>var x=1;</script></head>"
+            f"<body><h1>{title}</h1><h2>Abstract</h2>{body}</body></html>").encode("utf-8")
+
+def _pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def make_pdf(title, rng, pages=8, lines_per_page=40):
+    """
+    Builds a minimal multi-page text PDF by hand (no PDF library needed),
+    readable by PyPDF2's text extraction.
+    """
+    objects = []
+    page_ids = []
+    font_id = 3
+    next_id = 4
+    page_objects = []
+    for page_no in range(pages):
+        lines = [title if page_no == 0 else f"Section {page_no}"]
+        lines += [" ".join(rng.choice(_WORDS) for _ in range(10)) + "." for _ in range(lines_per_page)]
+        stream = "BT /F1 10 Tf 50 800 Td 12 TL " + " ".join(f"({_pdf_escape(l)}) '" for l in lines) + " ET"
+        content_id, page_id = next_id, next_id + 1
+        next_id += 2
+        page_ids.append(page_id)
+        page_objects.append((content_id, f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream"))
+        page_objects.append((page_id, f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+                                      f"/Contents {content_id} 0 R /Resources << /Font << /F1 {font_id} 0 R >> >> >>"))
+    objects.append((1, "<< /Type /Catalog /Pages 2 0 R >>"))
+    kids = " ".join(f"{pid} 0 R" for pid in page_ids)
+    objects.append((2, f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>"))
+    objects.append((3, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"))
+    objects.extend(page_objects)
+    objects.sort()
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for obj_id, body in objects:
+        offsets[obj_id] = len(out)
+        out += f"{obj_id} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref_at = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    for obj_id, _ in objects:
+        out += f"{offsets[obj_id]:010d} 00000 n \n".encode("latin-1")
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_at}\n%%EOF\n".encode("latin-1")
+    return bytes(out)
+
+class FakeWeb:
+    """
+    Local HTTP server standing in for both the Custom Search API and the
+    document hosts. Each distinct query gets results_per_query documents;
+    a share of them are PDFs, the rest HTML. Documents are generated once
+    and served with ETag headers so cache revalidation can be exercised.
+    """
+
+    def __init__(self, results_per_query=6, pdf_share=0.5, pdf_pages=8, seed=0):
+        self.results_per_query = results_per_query
+        self.pdf_share = pdf_share
+        self.pdf_pages = pdf_pages
+        self.seed = seed
+        self.documents = {}
+        self.requests = {"search": 0, "document": 0, "not_modified": 0}
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _document(self, doc_id):
+        with self._lock:
+            if doc_id not in self.documents:
+                rng = random.Random(f"{self.seed}-{doc_id}")
+                title = f"Study {doc_id} on " + " ".join(rng.choice(_WORDS) for _ in range(3))
+                if doc_id.endswith(".pdf"):
+                    self.documents[doc_id] = ("application/pdf", make_pdf(title, rng, pages=self.pdf_pages))
+                else:
+                    self.documents[doc_id] = ("text/html; charset=utf-8", make_html(title, rng))
+            return self.documents[doc_id]
+
+    def search_items(self, query, num):
+        rng = random.Random(f"{self.seed}-{query}")
+        items = []
+        for i in range(min(num, self.results_per_query)):
+            doc_no = rng.randrange(10000)
+            ext = ".pdf" if rng.random() < self.pdf_share else ".html"
+            doc_id = f"{doc_no}{ext}"
+            items.append({
+                "title": f"Research paper {doc_no}: {query[:60]}",
+                "link": f"{self.base_url}/docs/{doc_id}",
+                # Echo the query so Stage 2's subtopic relevance check passes
+                "snippet": f"We study {query}. Results and methodology for {query}.",
+            })
+        return items
+
+    def start(self):
+        web = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, content_type, body, headers=None):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                if parts.path == "/customsearch/v1":
+                    params = parse_qs(parts.query)
+                    query = params.get("q", [""])[0]
+                    num = int(params.get("num", ["5"])[0])
+                    with web._lock:
+                        web.requests["search"] += 1
+                    body = json.dumps({"items": web.search_items(query, num)}).encode("utf-8")
+                    self._send(200, "application/json", body)
+                elif parts.path.startswith("/docs/"):
+                    doc_id = parts.path[len("/docs/"):]
+                    content_type, body = web._document(doc_id)
+                    etag = f'"{doc_id}"'
+                    if self.headers.get("If-None-Match") == etag:
+                        with web._lock:
+                            web.requests["not_modified"] += 1
+                        self.send_response(304)
+                        self.end_headers()
+                        return
+                    with web._lock:
+                        web.requests["document"] += 1
+                    self._send(200, content_type, body, {"ETag": etag})
+                else:
+                    self._send(404, "text/plain", b"not found")
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
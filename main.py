@@ -1,92 +1,323 @@
 import sys
 import os
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 
 # Import stages
-from stages.stage1_topic import stage1_topic_decomposition
+from stages.stage1_topic import stage1_topic_decomposition, decomposition_keywords
 from stages.stage2_discovery import stage2_document_discovery
 from stages.stage3_analysis import stage3_document_analysis
 from stages.stage3b_deepen import stage3b_deepen_research
 from stages.stage4_scoring import stage4_academic_scoring
 from stages.stage5_filtering import stage5_selection_filtering
 from stages.stage6_synthesis import stage6_research_synthesis
-from stages.stage7_generation import stage7_paper_generation
-from stages.stage8_review import stage8_review_paper
+from stages.stage7_generation import stage7_paper_generation, stage7_revise_sections
+from stages.stage8_review import stage8_review_paper, failing_sections
+from stages.streaming_pipeline import stream_scored_documents
+from utils import llm_cache
+from utils import cassette
+from utils.llm import use_replay
+from utils.circuit_breaker import print_provider_status
+from utils.concurrency import concurrency_status, print_concurrency_status
+from utils.search_cache import quota_status
+from utils.checkpoint import RunStore, CheckpointList, is_empty_result
+from utils import fetch_cache
+from utils import tracing
+from utils.circuit_breaker import provider_status
 
-def main():
-    load_dotenv()
-    
-    # Check for API keys or Offline Mode
-    # ... (existing checks implicitly fine)
+def run_pipeline(topic, store, stream=False, echo=False):
+    """
+    Runs Stages 1-8 for one topic. Every stage output is checkpointed to
+    store, and stages already present in it (on --resume) are loaded
+    instead of recomputed. Returns the final paper, or None if the pipeline
+    stopped early. With echo, drafts are printed as they are generated.
+    """
+    # Stage 1
+    decomposition = store.stage("decomposition", lambda: stage1_topic_decomposition(topic))
+    if not decomposition: return None
+    keywords = decomposition_keywords(decomposition)
 
-    # Input
-    if len(sys.argv) > 1:
-        topic = " ".join(sys.argv[1:])
-    else:
-        topic = input("Enter Research Topic: ")
-        
-    if not topic:
-        print("Topic required.")
-        return
+    if store.has("knowledge_base"):
+        knowledge_base = store.load("knowledge_base")
+    elif stream and not store.has("scored_docs"):
+        # Stages 2-4 as one per-document stream; Stage 5 consumes it directly.
+        # Each document is checkpointed as it is analyzed and scored, and a
+        # resumed stream picks up after the documents already done.
+        analyzed_docs = CheckpointList(store, "analyzed_stream")
+        scored_docs = CheckpointList(store, "scored_stream")
+        resumed_scored = list(scored_docs)
 
-    # Pipeline Execution
-    
-    # Stage 1
-    decomposition = stage1_topic_decomposition(topic)
-    if not decomposition: return
+        def checkpoint_tee(scored_stream):
+            yield from resumed_scored
+            for doc in scored_stream:
+                scored_docs.append(doc)
+                yield doc
 
-    # Stage 2
-    raw_docs = stage2_document_discovery(decomposition)
-    if not raw_docs:
-        print("No documents found.")
-        return
+        scored_stream = stream_scored_documents(decomposition, topic, keywords, analyzed_sink=analyzed_docs,
+                                                scored_urls={doc['url'] for doc in resumed_scored})
+        knowledge_base = stage5_selection_filtering(checkpoint_tee(scored_stream))
+        for name, data in (("analyzed_docs", analyzed_docs), ("scored_docs", scored_docs), ("knowledge_base", knowledge_base)):
+            if not is_empty_result(data):
+                store.save(name, data)
+    else:
+        if store.has("scored_docs"):
+            scored_docs = store.load("scored_docs")
+        else:
+            # Stage 2
+            raw_docs = store.stage("raw_docs", lambda: stage2_document_discovery(decomposition))
+            if not raw_docs:
+                print("No documents found.")
+                return None
 
-    # Stage 3
-    analyzed_docs = stage3_document_analysis(raw_docs)
-    
-    # Stage 3b: Deep Knowledge Recursion (New Feature)
-    deep_docs = stage3b_deepen_research(analyzed_docs, topic)
-    if deep_docs:
-        analyzed_docs.extend(deep_docs)
-    
-    # Stage 4
-    scored_docs = stage4_academic_scoring(analyzed_docs, topic)
-    
-    # Stage 5
-    knowledge_base = stage5_selection_filtering(scored_docs)
+            # Stage 3
+            analyzed_docs = store.stage("analyzed_docs", lambda: stage3_document_analysis(raw_docs, topic, keywords))
+            
+            # Stage 3b: Deep Knowledge Recursion (New Feature)
+            deep_docs = store.stage("deep_docs", lambda: stage3b_deepen_research(analyzed_docs, topic))
+            if deep_docs:
+                analyzed_docs.extend(deep_docs)
+            
+            # Stage 4
+            scored_docs = store.stage("scored_docs", lambda: stage4_academic_scoring(analyzed_docs, topic))
+        
+        # Stage 5
+        knowledge_base = store.stage("knowledge_base", lambda: stage5_selection_filtering(scored_docs))
     
     if not knowledge_base:
         print("No high-quality documents retained necessary to proceed.")
-        return
+        return None
 
     # Stage 6
-    synthesis = stage6_research_synthesis(knowledge_base, topic)
-    if not synthesis: return
+    synthesis = store.stage("synthesis", lambda: stage6_research_synthesis(knowledge_base, topic))
+    if not synthesis: return None
 
-    # Stage 7 & 8 Loop
+    # Stage 7 & 8 Loop: the first draft is written and reviewed in full; after
+    # a rejection only the sections scored below the bar are rewritten and
+    # re-reviewed. Without usable section scores the whole paper is redone.
     loop_count = 0
     max_loops = 5 # Increased retry limit for quality assurance
     feedback = ""
+    final_paper = None
+    review = None
     
     while loop_count < max_loops:
-        final_paper = stage7_paper_generation(synthesis, knowledge_base, topic, feedback=feedback)
-        
-        # Review
-        review = stage8_review_paper(final_paper, topic)
+        draft_no = loop_count + 1
+        failing = failing_sections(review) if review else []
+        if final_paper and failing:
+            final_paper = store.stage(f"draft_{draft_no}", lambda: stage7_revise_sections(final_paper, failing, synthesis, knowledge_base, topic))
+            review = store.stage(f"review_{draft_no}", lambda: stage8_review_paper(
+                final_paper, topic, only_sections=[s['section'] for s in failing], previous_review=review))
+            if not failing_sections(review):
+                # Section scores only estimate the overall score: confirm with a full review
+                print("  All revised sections pass. Confirming with a full review...")
+                review = store.stage(f"review_{draft_no}_full", lambda: stage8_review_paper(final_paper, topic))
+        else:
+            final_paper = store.stage(f"draft_{draft_no}", lambda: stage7_paper_generation(
+                synthesis, knowledge_base, topic, feedback=feedback,
+                output_path=store.artifact_path(f"draft_{draft_no}"), echo=echo))
+            
+            # Review
+            review = store.stage(f"review_{draft_no}", lambda: stage8_review_paper(final_paper, topic))
         score = review.get('score', 0)
         
-        if score >= 7:
+        if score >= 7 and not review.get('partial'):
             print(f"Paper accepted with score {score}.")
             break
+        elif review.get('partial'):
+            print(f"Revision incomplete (estimated score {score}, {len(failing_sections(review))} sections below the bar). Improving...")
         else:
             print(f"Paper rejected (Score {score}). Improving...")
             feedback = review.get('critique', 'General improvements needed.')
-            loop_count += 1
+        # Partial rounds count too: each round checkpoints under its own draft number
+        loop_count += 1
     
     if loop_count >= max_loops:
         print("Max revisions reached. Saving current best effort.")
     
-    # Output
+    return final_paper
+
+def run_batch(batch_file, output_file, concurrency, stream=False):
+    """
+    Runs one pipeline per topic in a JSONL file (one {"topic": ...} object
+    per line, optionally with "stream") on a thread pool. All pipelines
+    share this process's SDK clients, HTTP session, caches, rate limiters
+    and circuit breakers; global LLM/HTTP concurrency caps apply across them.
+    A status line per topic is appended to output_file as each one finishes.
+    """
+    jobs = []
+    with open(batch_file, "r") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"Skipping line {line_no} of {batch_file}: {e}")
+                continue
+            topic = entry.get("topic") if isinstance(entry, dict) else None
+            if not topic:
+                print(f"Skipping line {line_no} of {batch_file}: no 'topic'.")
+                continue
+            jobs.append(entry)
+
+    print(f"Batch: {len(jobs)} topics, {concurrency} concurrent pipelines. Status -> {output_file}")
+    output_lock = threading.Lock()
+
+    def run_job(entry):
+        topic = entry["topic"]
+        job_stream = entry.get("stream", stream)
+        started = time.time()
+        status = {"topic": topic, "run_id": None, "status": "failed", "paper": None, "error": None}
+        try:
+            store = RunStore.create(topic, options={"stream": job_stream})
+            status["run_id"] = store.run_id
+            final_paper = run_pipeline(topic, store, stream=job_stream)
+            if final_paper is None:
+                store.set_status("stopped")
+                status["status"] = "stopped"
+            else:
+                status["paper"] = save_paper(topic, final_paper)
+                store.set_status("completed")
+                status["status"] = "completed"
+        except Exception as e:
+            status["error"] = str(e)
+            print(f"Batch topic '{topic}' failed: {e}")
+        status["elapsed_s"] = round(time.time() - started, 1)
+        with output_lock:
+            with open(output_file, "a") as out:
+                out.write(json.dumps(status) + "\n")
+        return status
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = [executor.submit(run_job, entry) for entry in jobs]
+        results = [future.result() for future in as_completed(futures)]
+
+    completed = sum(1 for r in results if r["status"] == "completed")
+    print(f"\nBatch finished: {completed}/{len(results)} topics completed.")
+
+def main():
+    load_dotenv()
+    
+    # Check for API keys or Offline Mode
+    # ... (existing checks implicitly fine)
+
+    parser = argparse.ArgumentParser(description="Multi-layer research agent")
+    parser.add_argument("topic", nargs="*", help="Research topic")
+    parser.add_argument(
+        "--stream", action="store_true",
+        default=os.getenv("PIPELINE_STREAMING", "False").lower() == "true",
+        help="Overlap discovery, analysis and scoring per document instead of running them as barriers",
+    )
+    parser.add_argument("--resume", metavar="RUN_ID", help="Resume a previous run from its checkpoints in runs/")
+    parser.add_argument("--batch", metavar="TOPICS_JSONL", help='Run every {"topic": ...} line of a JSONL file')
+    parser.add_argument("--batch-output", default="batch_status.jsonl", help="Per-topic status lines for --batch")
+    parser.add_argument(
+        "--concurrency", type=int, default=int(os.getenv("BATCH_CONCURRENCY", "2")),
+        help="Pipelines run concurrently in --batch mode",
+    )
+    parser.add_argument(
+        "--metrics-prom", metavar="PATH", default=os.getenv("METRICS_PROM_PATH"),
+        help="Also write run metrics in Prometheus text format to PATH",
+    )
+    parser.add_argument(
+        "--record", metavar="CASSETTE", default=os.getenv("LLM_RECORD_PATH"),
+        help="Append every LLM answer to a JSONL cassette for later replay",
+    )
+    parser.add_argument(
+        "--replay", metavar="CASSETTE", default=os.getenv("LLM_REPLAY_PATH"),
+        help="Serve all LLM calls from a recorded cassette instead of live providers",
+    )
+    args = parser.parse_args()
+
+    if args.record:
+        cassette.start_recording(args.record)
+    if args.replay:
+        use_replay(args.replay)
+
+    if args.batch:
+        run_batch(args.batch, args.batch_output, args.concurrency, stream=args.stream)
+        print_run_summary()
+        write_run_report(os.path.splitext(args.batch_output)[0] + "_report.json", args.metrics_prom)
+        return
+
+    if args.resume:
+        try:
+            store = RunStore.resume(args.resume)
+        except FileNotFoundError as e:
+            print(e)
+            return
+        topic = store.topic
+        stream = store.manifest.get("options", {}).get("stream", args.stream)
+    else:
+        # Input
+        if args.topic:
+            topic = " ".join(args.topic)
+        else:
+            topic = input("Enter Research Topic: ")
+            
+        if not topic:
+            print("Topic required.")
+            return
+        stream = args.stream
+        store = RunStore.create(topic, options={"stream": stream})
+
+    # Pipeline Execution
+    try:
+        final_paper = run_pipeline(topic, store, stream=stream, echo=True)
+    finally:
+        write_run_report(os.path.join(store.run_dir, "run_report.json"), args.metrics_prom, run_id=store.run_id)
+    if final_paper is None:
+        store.set_status("stopped")
+        print(f"Pipeline stopped early. Resume later with: python main.py --resume {store.run_id}")
+        return
+    
+    save_paper(topic, final_paper)
+    store.set_status("completed")
+
+    print("\nFINAL OUTPUT Preview:\n")
+    print(final_paper[:2000] + "\n...(truncated)...")
+
+    print_run_summary()
+
+def write_run_report(path, prom_path=None, run_id=None):
+    """
+    Writes the tracing report (per-stage wall time, provider latency/tokens,
+    fallbacks, cache hits, bytes downloaded) and optionally Prometheus metrics.
+    """
+    extra = {
+        "run_id": run_id,
+        "caches": {
+            "llm": llm_cache.stats(),
+            "fetch": fetch_cache.stats(),
+            "search": quota_status(),
+        },
+        "provider_status": provider_status(),
+        "concurrency": concurrency_status(),
+    }
+    report = tracing.write_report(path, extra)
+    if prom_path:
+        tracing.write_prometheus(prom_path, report)
+
+def print_run_summary():
+    stats = llm_cache.stats()
+    print(f"\nLLM cache: {stats['hits']} hits, {stats['misses']} misses (hit rate {stats['hit_rate']:.0%})")
+    print_provider_status()
+    print_concurrency_status()
+
+    quota = quota_status()
+    print(f"Google Search: {quota['used']}/{quota['ceiling']} queries used today, "
+          f"{quota['remaining']} remaining ({quota['cache_hits']} served from cache)")
+
+def save_paper(topic, final_paper):
+    """
+    Writes the paper as Markdown and, when the optional libraries are
+    available, as a styled PDF next to it. Returns the Markdown path.
+    """
     # Output
     results_dir = "results"
     if not os.path.exists(results_dir):
@@ -140,8 +371,7 @@ def main():
     except Exception as e:
         print(f"PDF Generation failed: {e}")
 
-    print("\nFINAL OUTPUT Preview:\n")
-    print(final_paper[:2000] + "\n...(truncated)...")
+    return filename
 
 if __name__ == "__main__":
     main()
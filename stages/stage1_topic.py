@@ -1,6 +1,8 @@
 from utils.llm import query_gemini
-import json
+from utils.json_extract import extract_json
+from utils.tracing import traced_stage
 
+@traced_stage("stage1_topic")
 def stage1_topic_decomposition(topic):
     print(f"\n--- STAGE 1: TOPIC DECOMPOSITION for '{topic}' ---")
     
@@ -28,20 +30,21 @@ def stage1_topic_decomposition(topic):
     """
     
     # Logic task, so safe to fall back to Groq/Anthropic
-    response = query_gemini(prompt, fallback_to_others=True)
-    try:
-        # Find the first { and last }
-        start_idx = response.find('{')
-        end_idx = response.rfind('}')
-        
-        if start_idx != -1 and end_idx != -1:
-            json_str = response[start_idx:end_idx+1]
-        else:
-            json_str = response
-
-        data = json.loads(json_str)
-        return data
-    except Exception as e:
-        print(f"Error parsing Stage 1 output: {e}")
+    response = query_gemini(prompt, fallback_to_others=True, json_mode=True)
+    data = extract_json(response, expect=dict)
+    if data is None:
+        print("Error parsing Stage 1 output: no JSON object in response.")
         # print(f"Raw Response: {response}") # verbose
         return None
+    # Stage 2 ranks search results against the topic as well as the subtopics
+    data.setdefault("topic", topic)
+    return data
+
+def decomposition_keywords(decomposition):
+    """
+    Flattens the academic keywords of every subtopic in a Stage 1 result.
+    """
+    keywords = []
+    for subtopic in (decomposition or {}).get('subtopics', []):
+        keywords.extend(subtopic.get('keywords', []))
+    return keywords
@@ -1,22 +1,26 @@
 from utils.search import google_search, download_and_parse
+from utils.dedup import NearDuplicateIndex
+from utils.candidate_rank import rank_candidates, SEARCH_TOP_N, SEARCH_RESERVE
+from utils.concurrency import get_limiter
+from utils.tracing import traced_stage
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-def process_search_item(item):
+def is_candidate_relevant(item):
     """
-    Helper function to process a single search result:
+    Cheap pre-download filter on a search result:
     - Filters domains
-    - Downloads and parses content
+    - Requires a subtopic keyword in the title or snippet
     """
-    url = item.get('link')
-    title = item.get('title')
-    snippet = item.get('snippet')
+    url = item.get('link') or ''
+    title = item.get('title') or ''
+    snippet = item.get('snippet') or ''
     
     # Filter trivial non-academic URLs (heuristic)
     skip_domains = ['youtube.com', 'news.google.com', 'wikipedia.org']
-    if any(x in url for x in skip_domains):
+    if not url or any(x in url for x in skip_domains):
         # Silent skip or log if needed
-        return None
+        return False
 
     # Efficiency: Relevance Check
     # Check if keywords from subtopic exist in title or snippet
@@ -27,33 +31,60 @@ def process_search_item(item):
         text_to_check = (title + " " + snippet).lower()
         if keywords and not any(k in text_to_check for k in keywords):
              # print(f"  [Skip] Irrelevant snippet for {subtopic_name}: {title}")
-             return None
+             return False
+    return True
+
+def process_search_item(item, dedup_index=None):
+    """
+    Helper function to process a single search result:
+    - Downloads and parses content
+    - Drops near-duplicates of documents already in dedup_index; a longer
+      document containing an indexed one is kept instead, and names the
+      one it supersedes under 'replaces'
+    """
+    url = item.get('link')
+    title = item.get('title')
+    snippet = item.get('snippet')
+    subtopic_name = item.get('subtopic', '')
 
     try:
         raw_text = download_and_parse(url)
         if len(raw_text) < 500: # Too short to be a paper
             return None
         
-        return {
+        # Same paper via arXiv abs/PDF/mirror: collapse before any LLM spend
+        replaced = None
+        if dedup_index is not None:
+            original, replaced = dedup_index.check_and_add(url, raw_text)
+            if original:
+                print(f"    = Near-duplicate skipped: {title[:40]}... (same as {original[:60]})")
+                return None
+        
+        doc = {
             "title": title,
             "url": url,
             "snippet": snippet,
+            "subtopic": subtopic_name,
+            "query": item.get('query', ''),
             "raw_text": raw_text
         }
+        if replaced:
+            doc['replaces'] = replaced
+        return doc
     except Exception as e:
         print(f"Error processing {url}: {e}")
         return None
 
-def stage2_document_discovery(decomposition_data):
-    print("\n--- STAGE 2: DOCUMENT DISCOVERY ---")
-    
-    all_documents = []
+def gather_search_candidates(decomposition_data, frontier=None):
+    """
+    Runs every subtopic query concurrently, ranks the de-duplicated results
+    locally (see utils.candidate_rank) and returns (candidates, reserve):
+    the top SEARCH_TOP_N to download, and the next SEARCH_RESERVE to fall
+    back on when a download yields nothing. With a frontier, queries and
+    URLs seen in earlier rounds are skipped and its download budget applies.
+    """
     seen_urls = set()
     search_candidates = []
-    
-    if not decomposition_data or 'subtopics' not in decomposition_data:
-        print("Invalid input for Stage 2")
-        return []
 
     # 1. Gather all candidates concurrently
     def execute_search_query(subtopic, query):
@@ -68,6 +99,7 @@ def stage2_document_discovery(decomposition_data):
             search_res = google_search(academic_query, num_results=6) # Reduced from 8 to 6 for speed
             for item in search_res:
                 item['subtopic'] = subtopic['name']
+                item['query'] = query
                 results.append(item)
         except Exception as e:
             print(f"    Error querying Google for '{query}': {e}")
@@ -79,41 +111,136 @@ def stage2_document_discovery(decomposition_data):
         for query in subtopic['search_queries']:
             all_queries.append((subtopic, query))
 
+    if frontier is not None:
+        fresh = set(frontier.claim_queries([q for _, q in all_queries]))
+        skipped = len(all_queries) - len(fresh)
+        all_queries = [(s, q) for s, q in all_queries if q in fresh]
+        if skipped:
+            print(f"Skipping {skipped} queries already issued in earlier rounds.")
+
     print(f"Executing {len(all_queries)} search queries in parallel...")
     
-    with ThreadPoolExecutor(max_workers=5) as search_executor:
-        future_to_query = {search_executor.submit(execute_search_query, s, q): (s, q) for s, q in all_queries}
+    # In-flight searches adapt between 1 and the pool size (utils/concurrency.py)
+    limiter = get_limiter("search")
+    with ThreadPoolExecutor(max_workers=limiter.maximum) as search_executor:
+        futures = [search_executor.submit(limiter.run, execute_search_query, s, q) for s, q in all_queries]
         
-        for future in as_completed(future_to_query):
+        # Collected in query order so the URL dedup and top-20 cut are reproducible
+        for future in futures:
             results = future.result()
             for item in results:
                 url = item.get('link')
                 if url in seen_urls:
                     continue
                 seen_urls.add(url)
+                # Filtered before ranking so irrelevant hits do not take slots
+                if not is_candidate_relevant(item):
+                    continue
                 # print(f"    Found: {item.get('title')[:40]}...")
                 search_candidates.append(item)
 
-    # Limit to top 20 candidates total (User Constraint)
-    if len(search_candidates) > 20:
-        print(f"Limiting candidates from {len(search_candidates)} to top 20.")
-        search_candidates = search_candidates[:20]
+    # Only the best-ranked candidates are downloaded (User Constraint: 20)
+    ranked = rank_candidates(search_candidates, decomposition_data)
+    if frontier is not None:
+        candidates = frontier.claim_downloads(ranked, limit=SEARCH_TOP_N)
+        cut = ranked.index(candidates[-1]) + 1 if candidates else len(ranked)
+    else:
+        candidates = ranked[:SEARCH_TOP_N]
+        cut = len(candidates)
+    reserve = ranked[cut:cut + SEARCH_RESERVE]
+
+    if len(ranked) > len(candidates):
+        print(f"Ranked {len(ranked)} candidates: downloading top {len(candidates)}, {len(reserve)} held in reserve.")
+
+    return candidates, reserve
+
+def _next_reserve(reserve, frontier=None):
+    """
+    Pops the best remaining reserve candidate the frontier (if any) still
+    allows downloading, or returns None.
+    """
+    while reserve:
+        item = reserve.pop(0)
+        if frontier is None or frontier.claim_downloads([item]):
+            return item
+    return None
+
+def iter_document_discovery(decomposition_data, dedup_index=None, ordered=False, frontier=None):
+    """
+    Generator variant of Stage 2: yields each document as soon as its
+    download finishes, so downstream stages can start before the slowest
+    download completes.
+    Pass a shared dedup_index to collapse near-duplicates across rounds.
+    ordered=True yields in candidate order instead, for reproducible output.
+    Each download that yields no document is replaced by the next reserve
+    candidate, so low-ranked results are only fetched when needed.
+    A ResearchFrontier, if given, supplies the dedup index and filters out
+    queries/URLs already handled in earlier rounds.
+    A document that supersedes a shorter copy (the full PDF of an abstract
+    page) drops that copy if it has not been yielded yet; unordered streams
+    and earlier rounds may already have passed it on, and then keep both.
+    """
+    if dedup_index is None:
+        dedup_index = frontier.dedup_index if frontier is not None else NearDuplicateIndex()
+
+    if not decomposition_data or 'subtopics' not in decomposition_data:
+        print("Invalid input for Stage 2")
+        return
+
+    search_candidates, reserve = gather_search_candidates(decomposition_data, frontier)
 
     print(f"\nDownloading and parsing {len(search_candidates)} candidates in parallel...")
 
     # 2. Process downloads in parallel
-    # max_workers=5 is a safe number to not overwhelm network or get IP blocked
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        future_to_item = {executor.submit(process_search_item, item): item for item in search_candidates}
+    # Starts at 5 in flight (safe against IP blocks), grows while downloads stay
+    # fast and halves on 429s/timeouts; see utils/concurrency.py
+    limiter = get_limiter("downloads")
+    with ThreadPoolExecutor(max_workers=limiter.maximum) as executor:
+        # future -> rank position; reserve replacements rank after every primary
+        pending = {executor.submit(limiter.run, process_search_item, item, dedup_index): i
+                   for i, item in enumerate(search_candidates)}
+        next_position = len(search_candidates)
+        finished = {}
+        superseded = set()
         
-        for future in as_completed(future_to_item):
-            result = future.result()
-            if result:
-                all_documents.append(result)
-                print(f"    + Downloaded: {result['title'][:40]}...")
-            else:
-                # Optional: indicate skip/failure
-                pass
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                position = pending.pop(future)
+                result = future.result()
+                if result:
+                    replaced = result.pop('replaces', None)
+                    if replaced:
+                        superseded.add(replaced)
+                        for other, doc in list(finished.items()):
+                            if doc['url'] == replaced:
+                                print(f"    = Replaced near-duplicate: {doc['title'][:40]}... (contained in {result['url'][:60]})")
+                                del finished[other]
+                    if result['url'] in superseded:
+                        # Its longer copy finished first; no reserve needed
+                        print(f"    = Replaced near-duplicate: {result['title'][:40]}...")
+                        continue
+                    if ordered:
+                        finished[position] = result
+                        continue
+                    print(f"    + Downloaded: {result['title'][:40]}...")
+                    yield result
+                    continue
+                replacement = _next_reserve(reserve, frontier)
+                if replacement:
+                    print(f"    ~ Trying reserve candidate: {(replacement.get('title') or '')[:40]}...")
+                    pending[executor.submit(limiter.run, process_search_item, replacement, dedup_index)] = next_position
+                    next_position += 1
+
+        for position in sorted(finished):
+            print(f"    + Downloaded: {finished[position]['title'][:40]}...")
+            yield finished[position]
+
+@traced_stage("stage2_discovery")
+def stage2_document_discovery(decomposition_data, dedup_index=None, frontier=None):
+    print("\n--- STAGE 2: DOCUMENT DISCOVERY ---")
+    
+    all_documents = list(iter_document_discovery(decomposition_data, dedup_index, ordered=True, frontier=frontier))
     
     print(f"Total documents retrieved: {len(all_documents)}")
     return all_documents
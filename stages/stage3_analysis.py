@@ -1,64 +1,209 @@
-from utils.llm import query_gemini
-import json
+from utils.llm import query_gemini, stage_context_tokens
+from utils.bm25 import BM25
+from utils.tokens import estimate_tokens
+from utils.json_extract import extract_json
+from utils.tracing import traced_stage
+import os
 import re
 import time
 
-def chunk_text(text, chunk_size=12000, overlap=500):
+# Maximum chunk-analysis LLM calls per large document
+ANALYSIS_MAX_CHUNKS = int(os.getenv("ANALYSIS_MAX_CHUNKS", "6"))
+
+# Upper bound on a single chunk regardless of context window; larger chunks
+# mean fewer calls but slower, less focused answers.
+ANALYSIS_CHUNK_TOKENS = int(os.getenv("ANALYSIS_CHUNK_TOKENS", "6000"))
+CHUNK_OVERLAP_TOKENS = 120
+# Tokens reserved per chunk call for the prompt template and the answer
+_CHUNK_PROMPT_RESERVE = 1500
+
+# Markdown headings and common section names, in any case
+_HEADING_RE = re.compile(
+    r"^(#{1,6}\s+\S.*"
+    r"|(abstract|introduction|related work|background|methods?|methodology|experiments?|evaluation"
+    r"|results|discussion|conclusions?|limitations|future work|references|acknowledge?ments)\s*:?)$",
+    re.IGNORECASE,
+)
+# Numbered ("3.2 Results") and ALL CAPS titles. Case-sensitive: ignoring case
+# would make every short wrapped line of a two-column PDF a heading.
+_TITLE_HEADING_RE = re.compile(
+    r"^((\d+(\.\d+)*\.?|[IVX]+\.)\s+[A-Z][^.]{0,80}"
+    r"|[A-Z][A-Z0-9 \-:&]{3,60})$"
+)
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9\"(\[])")
+
+def analysis_chunk_tokens():
+    """
+    Chunk size for Stage 3, derived from the smallest context window in the
+    analysis provider chain and capped at ANALYSIS_CHUNK_TOKENS.
+    """
+    window = stage_context_tokens("analysis")
+    return max(500, min(ANALYSIS_CHUNK_TOKENS, int(window * 0.6) - _CHUNK_PROMPT_RESERVE))
+
+def _is_heading(line):
+    return len(line) < 90 and bool(_HEADING_RE.match(line) or _TITLE_HEADING_RE.match(line))
+
+def _paragraphs(text):
+    """
+    Yields (is_heading, paragraph). Blank lines and heading-like lines
+    (numbered sections, ALL CAPS titles, common paper section names) start a
+    new paragraph; line breaks inside a paragraph are kept so tables survive.
+    """
+    lines = []
+    heading = False
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            if lines:
+                yield heading, "\n".join(lines)
+                lines, heading = [], False
+            continue
+        if _is_heading(stripped):
+            if lines:
+                yield heading, "\n".join(lines)
+            lines, heading = [stripped], True
+            continue
+        lines.append(stripped)
+    if lines:
+        yield heading, "\n".join(lines)
+
+def _split_oversize(paragraph, max_tokens):
+    """
+    Breaks a paragraph that alone exceeds max_tokens on sentence boundaries,
+    hard-slicing only sentences that are themselves too long.
+    """
+    max_chars = max_tokens * 4
+    piece = []
+    piece_tokens = 0
+    for sentence in _SENTENCE_RE.split(paragraph):
+        for start in range(0, len(sentence), max_chars):
+            part = sentence[start:start + max_chars]
+            tokens = estimate_tokens(part)
+            if piece and piece_tokens + tokens > max_tokens:
+                yield " ".join(piece)
+                piece, piece_tokens = [], 0
+            piece.append(part)
+            piece_tokens += tokens
+    if piece:
+        yield " ".join(piece)
+
+def _overlap_tail(paragraphs, overlap_tokens):
+    """
+    Trailing sentences of the previous chunk carried into the next for context.
+    Heading lines are never carried over: they belong to the previous chunk.
+    """
+    if not paragraphs or overlap_tokens <= 0:
+        return ""
+    body = "\n".join(line for line in paragraphs[-1].splitlines() if not _is_heading(line.strip()))
+    if not body.strip():
+        return ""
+    sentences = _SENTENCE_RE.split(body)
+    tail = []
+    tokens = 0
+    for sentence in reversed(sentences):
+        tokens += estimate_tokens(sentence)
+        if tokens > overlap_tokens:
+            break
+        tail.insert(0, sentence)
+    return " ".join(tail)
+
+def iter_chunks(text, max_tokens=None, overlap_tokens=CHUNK_OVERLAP_TOKENS):
     """
-    Splits text into overlapping chunks.
+    Lazily splits text into chunks of at most ~max_tokens estimated tokens,
+    cutting on section headings, then paragraphs, then sentences, so chunks
+    do not end mid-sentence or mid-table. A chunk that is already half full
+    is closed at the next heading to keep sections together.
     """
-    chunks = []
-    start = 0
-    text_len = len(text)
+    max_tokens = max_tokens or analysis_chunk_tokens()
+    current = []
+    current_tokens = 0
     
-    while start < text_len:
-        end = min(start + chunk_size, text_len)
-        chunks.append(text[start:end])
-        # Move forward, but backtrack by overlap amount
-        start += (chunk_size - overlap)
+    for is_heading, paragraph in _paragraphs(text):
+        if estimate_tokens(paragraph) > max_tokens:
+            pieces = list(_split_oversize(paragraph, max_tokens))
+        else:
+            pieces = [paragraph]
         
-        # Avoid infinite loop if overlap >= chunk_size (shouldn't happen with these defaults)
-        if start >= text_len:
-            break
-            
-    return chunks
+        for i, piece in enumerate(pieces):
+            tokens = estimate_tokens(piece)
+            section_break = is_heading and i == 0 and current_tokens >= max_tokens // 2
+            if current and (current_tokens + tokens > max_tokens or section_break):
+                yield "\n\n".join(current)
+                tail = _overlap_tail(current, overlap_tokens)
+                if tail and estimate_tokens(tail) + tokens > max_tokens:
+                    tail = ""
+                current = [tail] if tail else []
+                current_tokens = estimate_tokens(tail)
+            current.append(piece)
+            current_tokens += tokens
+    
+    if current:
+        yield "\n\n".join(current)
 
-def extract_json(text):
+def chunk_text(text, max_tokens=None, overlap_tokens=CHUNK_OVERLAP_TOKENS):
     """
-     robustly extract JSON from text using regex 
+    List form of iter_chunks.
     """
-    try:
-        # Try finding the first { and last }
-        match = re.search(r'\{.*\}', text, re.DOTALL)
-        if match:
-            json_str = match.group(0)
-            # Remove trailing commas before closing braces/brackets
-            json_str = re.sub(r',\s*\}', '}', json_str)
-            json_str = re.sub(r',\s*\]', ']', json_str)
-            return json.loads(json_str)
-        return None
-    except:
-        return None
+    return list(iter_chunks(text, max_tokens, overlap_tokens))
+
+def select_chunks(chunks, query, budget=None):
+    """
+    Picks at most budget chunks to analyze.
+    With a query, the opening chunk (title/abstract) is always kept and the
+    rest of the budget goes to the chunks BM25 ranks most relevant to it
+    (typically methodology/results rather than boilerplate). Chunks with no
+    query term at all are not worth a call and are left out, so the budget
+    is a ceiling, not a quota. Without a query (or without any matching
+    chunk) it falls back to first/middle/last positional sampling.
+    Selected chunks are returned in document order.
+    """
+    budget = budget or ANALYSIS_MAX_CHUNKS
+    if len(chunks) <= budget:
+        return chunks
+    
+    if query and query.strip():
+        scores = BM25(chunks).score(query)
+        ranked = sorted(range(1, len(chunks)), key=lambda i: scores[i], reverse=True)
+        relevant = [i for i in ranked[:budget - 1] if scores[i] > 0]
+        if relevant:
+            picked = sorted([0] + relevant)
+            return [chunks[i] for i in picked]
+    
+    # First, Middle, Last; small budgets drop the last, then the middle part
+    first = max(1, budget // 3)
+    middle = min(first, budget - first)
+    last = budget - first - middle
+    mid = len(chunks) // 2
+    picked = sorted(set(range(first)) | set(range(mid, mid + middle)) | set(range(len(chunks) - last, len(chunks))))
+    return [chunks[i] for i in picked]
+
+def build_relevance_query(doc, topic=None, keywords=None):
+    """
+    Query used to rank a document's chunks: topic, Stage 1 keywords and the
+    subtopic/search query that surfaced the document.
+    """
+    parts = [topic or "", doc.get('subtopic', ""), doc.get('query', "")]
+    parts.extend(keywords or [])
+    return " ".join(p for p in parts if p)
 
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
+from utils.concurrency import get_limiter
 
-def analyze_single_document(doc):
+def analyze_single_document(doc, topic=None, keywords=None):
+    # Every LLM call below holds an adaptive slot shared across documents
+    limiter = get_limiter("analysis")
     try:
         # print(f"Analyzing: {doc['title'][:30]}...")
         full_text = doc['raw_text']
         
         # Strategy Decision: Chunk vs Whole
-        if len(full_text) > 12000:
+        chunk_tokens = analysis_chunk_tokens()
+        if estimate_tokens(full_text) > chunk_tokens:
             # print(f"  - Large Doc ({len(full_text)} chars). Chunking...")
-            all_chunks = chunk_text(full_text, chunk_size=12000, overlap=500)
+            all_chunks = chunk_text(full_text, max_tokens=chunk_tokens)
             
-            # Smart Selection: Limit to max 6 chunks for speed
-            if len(all_chunks) > 6:
-                # First 2, Middle 2, Last 2
-                mid = len(all_chunks) // 2
-                selected_chunks = all_chunks[:2] + all_chunks[mid:mid+2] + all_chunks[-2:]
-            else:
-                selected_chunks = all_chunks
+            # Smart Selection: only the most relevant chunks, within the call budget
+            selected_chunks = select_chunks(all_chunks, build_relevance_query(doc, topic, keywords))
             
             chunk_summaries = []
             
@@ -66,25 +211,26 @@ def analyze_single_document(doc):
             def analyze_chunk(idx, chunk):
                 chunk_prompt = f"""
                 Analyze this segment (Part {idx+1}) of "{doc['title']}".
-                Segment: {chunk[:15000]}
+                Segment: {chunk}
                 Task: Extract Research Problem, Methodology, Findings, Limitations.
                 Output: Concise bullet points.
                 """
                 try:
-                    return query_gemini(chunk_prompt, fallback_to_others=True)
+                    with limiter.slot():
+                        return query_gemini(chunk_prompt, fallback_to_others=True)
                 except:
                     return ""
 
-            with ThreadPoolExecutor(max_workers=3) as chunk_executor:
+            with ThreadPoolExecutor(max_workers=min(len(selected_chunks), limiter.maximum) or 1) as chunk_executor:
                 futures = [chunk_executor.submit(analyze_chunk, i, c) for i, c in enumerate(selected_chunks)]
-                for f in as_completed(futures):
+                # Kept in document order so the merge prompt is reproducible
+                for f in futures:
                     res = f.result()
                     if res: chunk_summaries.append(res)
             
             text_context = "\n".join(chunk_summaries)
         else:
-            text_content = full_text[:20000] 
-            text_context = text_content
+            text_context = full_text
 
         prompt = f"""
         Analyze the following research document content (or extracted summaries of it).
@@ -120,27 +266,24 @@ def analyze_single_document(doc):
         }}
         """
         
-        response = query_gemini(prompt, fallback_to_others=False)
+        with limiter.slot():
+            response = query_gemini(prompt, fallback_to_others=False, json_mode=True)
         
         # Robust Parsing
-        analysis = extract_json(response)
+        analysis = extract_json(response, expect=dict)
         if not analysis:
-            try:
-                cleaned_response = response.replace("```json", "").replace("```", "")
-                analysis = json.loads(cleaned_response)
-            except:
-                # Fallback: If model text isn't JSON, wrap it anyway so we don't lose the data
-                print(f"  ! Warning: Could not parse JSON for {doc['title'][:15]}. Using raw text fallback.")
-                analysis = {
-                    "research_problem": "JSON Parsing Failed",
-                    "methodology": "See findings",
-                    "key_findings": response if response else "No content returned",
-                    "limitations": "N/A",
-                    "research_gaps": "N/A",
-                    "novelty_assessment": "N/A",
-                    "technical_depth_score": 0,
-                    "missing_entities": "Parsing Failed"
-                }
+            # Fallback: If model text isn't JSON, wrap it anyway so we don't lose the data
+            print(f"  ! Warning: Could not parse JSON for {doc['title'][:15]}. Using raw text fallback.")
+            analysis = {
+                "research_problem": "JSON Parsing Failed",
+                "methodology": "See findings",
+                "key_findings": response if response else "No content returned",
+                "limitations": "N/A",
+                "research_gaps": "N/A",
+                "novelty_assessment": "N/A",
+                "technical_depth_score": 0,
+                "missing_entities": "Parsing Failed"
+            }
         
         doc['analysis'] = analysis
         print(f"  + Analysis Complete: {doc['title'][:30]}...")
@@ -150,16 +293,19 @@ def analyze_single_document(doc):
         print(f"  x Error analyzing {doc['title'][:20]}: {e}")
         return None
 
-def stage3_document_analysis(documents):
+@traced_stage("stage3_analysis")
+def stage3_document_analysis(documents, topic=None, keywords=None):
     print("\n--- STAGE 3: DOCUMENT ANALYSIS (Parallel) ---")
     analyzed_documents = []
     
-    # Process documents in parallel
-    # max_workers=2 to reduce Rate Limits and Local LLM load
-    with ThreadPoolExecutor(max_workers=2) as executor:
-        future_to_doc = {executor.submit(analyze_single_document, doc): doc for doc in documents}
+    # Process documents in parallel. Concurrent LLM calls are capped by the
+    # adaptive "analysis" limiter (starts at 3, backs off on 429s/timeouts),
+    # so the pool itself can be as large as that limiter may grow.
+    with ThreadPoolExecutor(max_workers=get_limiter("analysis").maximum) as executor:
+        futures = [executor.submit(analyze_single_document, doc, topic, keywords) for doc in documents]
         
-        for future in as_completed(future_to_doc):
+        # Input order, not completion order: later stages build prompts from this list
+        for future in futures:
             result = future.result()
             if result:
                 analyzed_documents.append(result)
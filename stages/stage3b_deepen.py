@@ -1,19 +1,26 @@
 from utils.llm import query_gemini
 from stages.stage2_discovery import stage2_document_discovery
 from stages.stage3_analysis import stage3_document_analysis
-import json
+from utils.frontier import ResearchFrontier
+from utils.json_extract import extract_json_list
+import os
+from utils.tracing import traced_stage
 
-def stage3b_deepen_research(analyzed_docs, topic):
+# Deepening rounds after the first discovery round; each can stop early on
+# low marginal yield or an exhausted frontier budget.
+DEEPEN_MAX_ROUNDS = int(os.getenv("DEEPEN_MAX_ROUNDS", "2"))
+
+def build_deep_decomposition(analyzed_docs, topic, avoid_queries=None):
     """
-    Analyzes the initial research for gaps and performs a recursive deep dive.
+    Asks the LLM for gap-targeted queries and wraps them in a Stage 2
+    decomposition structure. Returns None when no deep dive is warranted.
+    avoid_queries lists searches already run, so the LLM proposes new ones.
     """
-    print("\n--- STAGE 3b: DEEP KNOWLEDGE RECURSION ---")
-    
     # 1. Assess current depth
     valid_docs = [d for d in analyzed_docs if 'analysis' in d]
     if not valid_docs:
         print("No valid documents to deepen.")
-        return []
+        return None
 
     # Collect gaps and missing entities
     gaps_context = ""
@@ -23,6 +30,10 @@ def stage3b_deepen_research(analyzed_docs, topic):
         gaps_context += f"  Missing: {analysis.get('missing_entities', 'N/A')}\n"
         gaps_context += f"  Gaps: {analysis.get('research_gaps', 'N/A')}\n"
 
+    avoid_block = ""
+    if avoid_queries:
+        avoid_block = "Already searched (do NOT repeat these):\n" + "\n".join(f"- {q}" for q in sorted(avoid_queries)[:30])
+
     # 2. Generate Targeted Queries
     prompt = f"""
     The user wants "Deep Knowledge" on the topic: "{topic}".
@@ -30,58 +41,86 @@ def stage3b_deepen_research(analyzed_docs, topic):
     
     {gaps_context[:8000]}
     
+    {avoid_block}
+    
     Task:
     Identify specific missing technical details, implementation specifics, or data points.
     Generate 3-5 HIGHLY SPECIFIC search queries to find this missing information.
     Focus on getting concrete numbers, algorithms, or comparison data.
     
-    Output Format (JSON string list):
-    ["query 1", "query 2", ...]
+    Output Format (JSON object):
+    {{"queries": ["query 1", "query 2", ...]}}
     """
     
     print("  Identifying knowledge gaps...")
-    response = query_gemini(prompt, fallback_to_others=True)
+    response = query_gemini(prompt, fallback_to_others=True, json_mode=True)
     
-    try:
-        if "[" in response:
-             # loose parsing
-             start = response.find('[')
-             end = response.rfind(']') + 1
-             new_queries_list = json.loads(response[start:end])
-        else:
-             new_queries_list = []
-    except Exception as e:
-        print(f"  Error parsing deep queries: {e}")
-        new_queries_list = []
+    new_queries_list = [q for q in extract_json_list(response, "queries") if isinstance(q, str) and q.strip()]
         
     if not new_queries_list:
         print("  No further deep queries generated.")
-        return []
+        return None
 
     print(f"  Generated {len(new_queries_list)} deep-dive queries:")
     for q in new_queries_list:
         print(f"   > {q}")
 
     # 3. Construct a fake 'decomposition' structure for Stage 2
-    # Stage 2 expects: {'subtopics': [{'name': 'Deep Dive', 'search_queries': [...]}]}
+    # Stage 2 expects: {'topic': ..., 'subtopics': [{'name': ..., 'search_queries': [...]}]}
+    # The subtopic name drives Stage 2's snippet relevance check, so use the
+    # topic itself rather than a label no snippet would contain.
     deep_decomposition = {
+        'topic': topic,
         'subtopics': [
             {
-                'name': 'Deep Dive Refinement',
+                'name': topic,
                 'search_queries': new_queries_list
             }
         ]
     }
+    return deep_decomposition
+
+@traced_stage("stage3b_deepen")
+def stage3b_deepen_research(analyzed_docs, topic, frontier=None):
+    """
+    Runs up to DEEPEN_MAX_ROUNDS gap-driven deep dives. Each round's queries
+    come from the gaps in the previous round's documents; the shared frontier
+    skips repeat queries, already-fetched URLs and near-duplicates, and ends
+    the rounds once marginal yield or the download/analysis budget runs out.
+    Returns the newly analyzed documents from all rounds.
+    """
+    print("\n--- STAGE 3b: DEEP KNOWLEDGE RECURSION ---")
     
-    # 4. Run Stage 2 & 3 recursively
-    print("  Executing Recursive Search...")
-    new_raw_docs = stage2_document_discovery(deep_decomposition)
+    if frontier is None:
+        # Seed with first-round documents so they are never fetched or analyzed again
+        frontier = ResearchFrontier()
+        frontier.seed(analyzed_docs)
     
-    if not new_raw_docs:
-        print("  No new documents found in deep dive.")
-        return []
+    new_analyzed_docs = []
+    latest = analyzed_docs
+    for round_no in range(1, DEEPEN_MAX_ROUNDS + 1):
+        if not frontier.budget_left():
+            print("  [Frontier] Budget exhausted. No further deep dives.")
+            break
+        deep_decomposition = build_deep_decomposition(latest, topic, avoid_queries=frontier.queries)
+        if not deep_decomposition:
+            break
+        
+        # 4. Run Stage 2 & 3 recursively
+        print(f"  Executing Recursive Search (round {round_no}/{DEEPEN_MAX_ROUNDS})...")
+        downloads_before = frontier.downloads
+        new_raw_docs = stage2_document_discovery(deep_decomposition, frontier=frontier)
+        new_raw_docs = [doc for doc in new_raw_docs if frontier.claim_analysis(doc)]
+        
+        if new_raw_docs:
+            print("  Analyzing Deep Dive Documents...")
+            latest = stage3_document_analysis(new_raw_docs, topic)
+        else:
+            print("  No new documents found in deep dive.")
+            latest = []
+        new_analyzed_docs.extend(latest)
         
-    print("  Analyzing Deep Dive Documents...")
-    new_analyzed_docs = stage3_document_analysis(new_raw_docs)
+        if not frontier.record_round(frontier.downloads - downloads_before, len(latest)):
+            break
     
     return new_analyzed_docs
@@ -1,63 +1,161 @@
 from utils.llm import query_groq
-import json
-import re
+import os
+from concurrent.futures import ThreadPoolExecutor
+from utils.json_extract import extract_json, extract_json_list
+from utils.tracing import traced_stage
 
-def stage4_academic_scoring(analyzed_documents, topic):
-    print("\n--- STAGE 4: ACADEMIC SCORING (Groq) ---")
-    scored_documents = []
-    
-    for doc in analyzed_documents:
-        analysis = doc.get('analysis', {})
-        if not analysis:
-            continue
-            
-        print(f"Scoring: {doc['title'][:50]}...")
-        
-        prompt = f"""
-        Role: Strict Academic Reviewer.
-        Target Research Topic: "{topic}"
-        
-        Document Title: {doc['title']}
-        Analysis Summary:
-        - Problem: {analysis.get('research_problem')}
-        - Method: {analysis.get('methodology')}
-        - Findings: {analysis.get('key_findings')}
-        - Novelty: {analysis.get('novelty_assessment')}
+# Documents packed into one scoring prompt (1 = one call per document)
+SCORING_BATCH_SIZE = int(os.getenv("SCORING_BATCH_SIZE", "5"))
+# Concurrent scoring batches
+SCORING_WORKERS = int(os.getenv("SCORING_WORKERS", "3"))
+# Per-field cap inside batched prompts so several summaries fit in one call
+BATCH_FIELD_CHARS = 800
+
+def score_single_document(doc, topic):
+    """
+    Scores one analyzed document. Returns the document with a 'scoring'
+    entry, or None if it has no analysis or the response is unusable.
+    """
+    analysis = doc.get('analysis', {})
+    if not analysis:
+        return None
         
-        Evaluate based on:
-        1. Novelty
-        2. Methodological rigor
-        3. Relevance to the research topic
-        4. Academic clarity
-        5. Suitability for Scopus-indexed journals
+    print(f"Scoring: {doc['title'][:50]}...")
+    
+    prompt = f"""
+    Role: Strict Academic Reviewer.
+    Target Research Topic: "{topic}"
+    
+    Document Title: {doc['title']}
+    Analysis Summary:
+    - Problem: {analysis.get('research_problem')}
+    - Method: {analysis.get('methodology')}
+    - Findings: {analysis.get('key_findings')}
+    - Novelty: {analysis.get('novelty_assessment')}
+    
+    Evaluate based on:
+    1. Novelty
+    2. Methodological rigor
+    3. Relevance to the research topic
+    4. Academic clarity
+    5. Suitability for Scopus-indexed journals
+    
+    Return ONLY valid JSON:
+    {{
+      "score": number (0-10),
+      "strengths": "string",
+      "weaknesses": "string"
+    }}
+    
+    No explanations. No markdown.
+    """
+    
+    try:
+        response = query_groq(prompt, json_mode=True, fallback_to_others=True)
+    except Exception as e:
+        print(f"  Error scoring document: {e}")
+        return None
+    score_data = extract_json(response, expect=dict)
+    if score_data is None:
+        print("  Error scoring document: no JSON object in response.")
+        return None
         
-        Return ONLY valid JSON:
+    doc['scoring'] = score_data
+    print(f"  Score: {score_data.get('score')}")
+    return doc
+
+def score_document_batch(batch, topic):
+    """
+    Scores several analyzed documents with a single LLM call.
+    The model returns a JSON list of scores keyed by document id; documents
+    whose entry is missing or malformed are re-scored individually.
+    """
+    if len(batch) == 1:
+        result = score_single_document(batch[0], topic)
+        return [result] if result else []
+
+    print(f"Scoring batch of {len(batch)}: {', '.join(d['title'][:25] for d in batch)}...")
+    
+    doc_blocks = []
+    for i, doc in enumerate(batch):
+        analysis = doc['analysis']
+        doc_blocks.append(f"""
+    [Document D{i+1}]
+    Title: {doc['title']}
+    - Problem: {str(analysis.get('research_problem'))[:BATCH_FIELD_CHARS]}
+    - Method: {str(analysis.get('methodology'))[:BATCH_FIELD_CHARS]}
+    - Findings: {str(analysis.get('key_findings'))[:BATCH_FIELD_CHARS]}
+    - Novelty: {str(analysis.get('novelty_assessment'))[:BATCH_FIELD_CHARS]}""")
+    
+    prompt = f"""
+    Role: Strict Academic Reviewer.
+    Target Research Topic: "{topic}"
+    
+    Score EACH of the following {len(batch)} documents independently.
+    {"".join(doc_blocks)}
+    
+    Evaluate each based on:
+    1. Novelty
+    2. Methodological rigor
+    3. Relevance to the research topic
+    4. Academic clarity
+    5. Suitability for Scopus-indexed journals
+    
+    Return ONLY a valid JSON object with one entry per document:
+    {{
+      "scores": [
         {{
+          "id": "D1",
           "score": number (0-10),
           "strengths": "string",
           "weaknesses": "string"
         }}
-        
-        No explanations. No markdown.
-        """
-        
+      ]
+    }}
+    
+    No explanations. No markdown.
+    """
+    
+    scores_by_id = {}
+    try:
         response = query_groq(prompt, json_mode=True, fallback_to_others=True)
-        try:
-            # Robust Extraction
-            match = re.search(r'\{.*\}', response, re.DOTALL)
-            if match:
-                json_str = match.group(0)
-                score_data = json.loads(json_str)
-            else:
-                # Fallback to direct load or primitive cleanup
-                cleaned = response.replace("```json", "").replace("```", "").strip()
-                score_data = json.loads(cleaned)
-                
-            doc['scoring'] = score_data
-            scored_documents.append(doc)
-            print(f"  Score: {score_data.get('score')}")
-        except Exception as e:
-            print(f"  Error scoring document: {e}")
+        for entry in extract_json_list(response, "scores"):
+            if isinstance(entry, dict) and 'id' in entry and 'score' in entry:
+                scores_by_id[str(entry['id']).strip().upper()] = entry
+    except Exception as e:
+        print(f"  Error parsing batch scores: {e}")
+    
+    scored = []
+    for i, doc in enumerate(batch):
+        entry = scores_by_id.get(f"D{i+1}")
+        if entry is None:
+            # Fall back to a per-document call only for items that failed to parse
+            result = score_single_document(doc, topic)
+            if result:
+                scored.append(result)
             continue
+        entry.pop('id', None)
+        doc['scoring'] = entry
+        print(f"  Score: {entry.get('score')} ({doc['title'][:40]})")
+        scored.append(doc)
+    return scored
+
+@traced_stage("stage4_scoring")
+def stage4_academic_scoring(analyzed_documents, topic, batch_size=None, max_workers=None):
+    print("\n--- STAGE 4: ACADEMIC SCORING (Groq) ---")
+    batch_size = max(1, batch_size or SCORING_BATCH_SIZE)
+    max_workers = max(1, max_workers or SCORING_WORKERS)
+    
+    candidates = [doc for doc in analyzed_documents if doc.get('analysis')]
+    batches = [candidates[i:i + batch_size] for i in range(0, len(candidates), batch_size)]
+    
+    scored_documents = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(score_document_batch, batch, topic) for batch in batches]
+        for future in futures:
+            try:
+                scored_documents.extend(future.result())
+            except Exception as e:
+                print(f"  Error scoring batch: {e}")
             
     return scored_documents
@@ -1,3 +1,6 @@
+from utils.tracing import traced_stage
+
+@traced_stage("stage5_filtering")
 def stage5_selection_filtering(scored_documents):
     print("\n--- STAGE 5: SELECTION & FILTERING ---")
     
@@ -28,6 +31,7 @@ def stage5_selection_filtering(scored_documents):
         entry = {
             "source_title": doc['title'],
             "url": doc['url'],
+            "score": doc['scoring'].get('score'),
             "analysis": doc['analysis'],
             "strengths": doc['scoring'].get('strengths'),
             "weaknesses": doc['scoring'].get('weaknesses')
@@ -1,7 +1,16 @@
-from utils.llm import query_stage
-import json
-import re
+from utils.llm import query_stage, stage_context_tokens
+import os
+from utils.tracing import traced_stage
+from utils.json_extract import extract_json
+from utils.tokens import estimate_tokens
+from utils.kb_packer import pack_knowledge_base, knowledge_budget
 
+# Tokens kept free for the synthesis JSON itself
+SYNTHESIS_RESPONSE_TOKENS = int(os.getenv("SYNTHESIS_RESPONSE_TOKENS", "1500"))
+# Fields Stage 7 reads from the synthesis
+SYNTHESIS_FIELDS = ("research_gap", "proposed_contribution", "methodology_plan", "simulated_results_description")
+
+@traced_stage("stage6_synthesis")
 def stage6_research_synthesis(knowledge_base, topic):
     print("\n--- STAGE 6: ORIGINAL RESEARCH SYNTHESIS ")
     
@@ -9,14 +18,13 @@ def stage6_research_synthesis(knowledge_base, topic):
         print("No knowledge base available. Cannot synthesize.")
         return None
         
-    kb_text = json.dumps(knowledge_base, indent=2)
-    
-    prompt = f"""
+    prompt_template = """
     You are an expert academic researcher (Author Model).
     Topic: "{topic}"
     
     Based on the following analysis of high-quality matching literature:
     {kb_text}
+    Cite sources by their [S#] id.
     
     Task:
     1. Identify a clear and defensible research gap that is NOT fully addressed by the knowledge base.
@@ -40,20 +48,27 @@ def stage6_research_synthesis(knowledge_base, topic):
     }}
     """
     
+    # Fit the knowledge base into the smallest context window in the synthesis chain
+    overhead = estimate_tokens(prompt_template.format(topic=topic, kb_text=""))
+    budget = knowledge_budget(stage_context_tokens("synthesis"), overhead, SYNTHESIS_RESPONSE_TOKENS)
+    kb_text, pack_stats = pack_knowledge_base(knowledge_base, budget)
+    print(f"  Knowledge base packed to ~{pack_stats['tokens']} tokens: {pack_stats['full']} full, "
+          f"{pack_stats['summarized']} summarized, {pack_stats['dropped']} dropped.")
+    prompt = prompt_template.format(topic=topic, kb_text=kb_text)
+    
     # Heavy synthesis using 'synthesis' stage strategy
-    response = query_stage("synthesis", prompt)
     try:
-        # Robust Regex Extraction
-        match = re.search(r'\{.*\}', response, re.DOTALL)
-        if match:
-            json_str = match.group(0)
-            # Use strict=False to allow control characters (newlines in strings)
-            synthesis = json.loads(json_str, strict=False)
-        else:
-            cleaned = response.replace("```json", "").replace("```", "").strip()
-            synthesis = json.loads(cleaned, strict=False)
-            
-        return synthesis
+        response = query_stage("synthesis", prompt, json_mode=True)
     except Exception as e:
         print(f"Error in synthesis: {e}")
         return None
+    synthesis = extract_json(response, expect=dict)
+    if synthesis is None:
+        print("Error in synthesis: no JSON object in response.")
+        return None
+    # A truncated answer repairs into an object missing its later fields
+    missing = [field for field in SYNTHESIS_FIELDS if field not in synthesis]
+    if missing:
+        print(f"Error in synthesis: response is missing {', '.join(missing)}.")
+        return None
+    return synthesis
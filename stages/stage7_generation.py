@@ -1,7 +1,68 @@
-from utils.llm import query_stage
+from utils.llm import query_stage, query_stage_stream
+import os
 import json
+from concurrent.futures import ThreadPoolExecutor
+from utils.tracing import traced_stage
+from utils.sections import split_sections, join_sections, find_section, outline
+from utils.kb_packer import reference_block
 
-def stage7_paper_generation(synthesis, knowledge_base, topic, feedback=""):
+# Parallel section rewrites per revision round
+SECTION_REVISION_WORKERS = int(os.getenv("SECTION_REVISION_WORKERS", "3"))
+# Stream drafts as they are written. Off by default: streamed calls are not
+# hedged, and the blocking call keeps the generation hedge (STAGE_HEDGING).
+GENERATION_STREAMING = os.getenv("GENERATION_STREAMING", "False").lower() == "true"
+# Stop a draft that runs past this many estimated tokens (e.g. a model stuck repeating itself)
+GENERATION_MAX_TOKENS = int(os.getenv("GENERATION_MAX_TOKENS", "12000"))
+
+def _stream_generation(prompt, output_path=None, echo=False):
+    """
+    Streams a generation answer, appending it to output_path and/or the
+    console as it arrives, and stops once it passes GENERATION_MAX_TOKENS.
+    If the provider fails mid-stream, the partial draft is discarded and the
+    draft is regenerated with a blocking query_stage call, so the rest of
+    the fallback chain still applies.
+    """
+    parts = []
+    chars = 0
+    # Same 4-chars-per-token ratio as utils.tokens.estimate_tokens
+    budget_chars = GENERATION_MAX_TOKENS * 4
+    out = open(output_path, "w") if output_path else None
+    stream = query_stage_stream("generation", prompt)
+    try:
+        for chunk in stream:
+            parts.append(chunk)
+            chars += len(chunk)
+            if out:
+                out.write(chunk)
+                out.flush()
+            if echo:
+                print(chunk, end="", flush=True)
+            if chars > budget_chars:
+                print(f"\n  [Budget] Draft passed ~{GENERATION_MAX_TOKENS} tokens. Stopping generation early.")
+                break
+    except Exception as e:
+        print(f"\n  [Stream] Generation failed mid-stream: {str(e)[:80]}. Discarding partial draft and retrying without streaming...")
+        parts = [query_stage("generation", prompt)]
+        if out:
+            out.seek(0)
+            out.truncate()
+            out.write(parts[0])
+        if echo:
+            print(parts[0], end="")
+    finally:
+        stream.close()
+        if out:
+            out.close()
+    if echo:
+        print()
+    return "".join(parts)
+
+@traced_stage("stage7_generation")
+def stage7_paper_generation(synthesis, knowledge_base, topic, feedback="", output_path=None, echo=False):
+    """
+    Writes the full paper. With GENERATION_STREAMING the draft is written to
+    output_path (and echoed to the console if echo) as it is generated.
+    """
     print("\n--- STAGE 7: SCOPUS-STYLE PAPER GENERATION ---")
     
     if not synthesis:
@@ -11,11 +72,7 @@ def stage7_paper_generation(synthesis, knowledge_base, topic, feedback=""):
     if feedback:
         print(f"  > Regenerating paper with feedback: {feedback}")
     
-    references_list = []
-    for entry in knowledge_base:
-        references_list.append(f"{entry['source_title']} ({entry['url']})")
-    
-    ref_block = "\n".join(references_list)
+    ref_block = reference_block(knowledge_base)
     
     prompt = f"""
     You are an expert academic author. Write a complete Scopus-journal-quality research paper.
@@ -58,5 +115,97 @@ def stage7_paper_generation(synthesis, knowledge_base, topic, feedback=""):
     """
     
     # Heavy content generation using 'generation' stage strategy
+    if GENERATION_STREAMING:
+        return _stream_generation(prompt, output_path, echo)
     paper = query_stage("generation", prompt)
     return paper
+
+def _clean_revision(response, sections, idx):
+    """
+    Normalizes a rewritten section: strips code fences, keeps the original
+    heading line and drops anything past the start of another known section.
+    """
+    text = response.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        text = text.rsplit("```", 1)[0]
+    others = sections[:idx] + sections[idx + 1:]
+    kept = []
+    for i, part in enumerate(split_sections(text)):
+        if i > 0 and find_section(others, part["name"]) is not None:
+            break
+        kept.append(part)
+    body = join_sections(kept)
+    if kept and kept[0]["name"] != "preamble":
+        body = body.split("\n", 1)[1] if "\n" in body else ""
+    heading = sections[idx]["text"].split("\n", 1)[0]
+    return f"{heading}\n\n{body.strip()}\n\n"
+
+@traced_stage("stage7_revision")
+def stage7_revise_sections(paper, section_reviews, synthesis, knowledge_base, topic):
+    """
+    Rewrites only the sections named in section_reviews (the reviewer's
+    failing sections, with their critique) and splices them into paper.
+    Sections that cannot be located, or whose rewrite fails, are left as is.
+    """
+    print("\n--- STAGE 7: SECTION REVISION ---")
+    sections = split_sections(paper)
+    ref_block = reference_block(knowledge_base)
+    paper_outline = outline(sections)
+
+    targets = {}
+    for review in section_reviews:
+        idx = find_section(sections, review["section"])
+        if idx is not None:
+            targets[idx] = review.get("critique", "")
+    print(f"  > Rewriting {len(targets)} of {len(sections)} sections: "
+          + ", ".join(sections[i]["name"] for i in sorted(targets)))
+
+    def revise(idx):
+        section = sections[idx]
+        prompt = f"""
+        You are an expert academic author revising one section of your research paper.
+        
+        Topic: {topic}
+        
+        CORE RESEARCH PLAN:
+        Gap: {synthesis['research_gap']}
+        Contribution: {synthesis['proposed_contribution']}
+        Methodology: {synthesis['methodology_plan']}
+        Results (Simulated): {synthesis['simulated_results_description']}
+        
+        PAPER OUTLINE:
+        {paper_outline}
+        
+        CURRENT TEXT OF THE SECTION "{section['name']}":
+        {section['text'].strip()}
+        
+        EDITOR CRITIQUE FOR THIS SECTION (Must address this):
+        {targets[idx] or "General improvements needed."}
+        
+        AVAILABLE REFERENCES (Use these as the primary citations):
+        {ref_block}
+        
+        Writing Constraints:
+        - Formal academic tone only (Third-person).
+        - Stay consistent with the rest of the paper as outlined above.
+        - Revise this section only; do not write any other section.
+        
+        OUTPUT:
+        Return ONLY the revised section in Markdown, starting with its heading.
+        """
+        try:
+            response = query_stage("generation", prompt)
+        except Exception as e:
+            print(f"  x Revision of '{section['name']}' failed: {e}")
+            return idx, None
+        if not response or response.startswith("Error:"):
+            return idx, None
+        return idx, _clean_revision(response, sections, idx)
+
+    with ThreadPoolExecutor(max_workers=max(1, SECTION_REVISION_WORKERS)) as executor:
+        for idx, text in executor.map(revise, sorted(targets)):
+            if text:
+                sections[idx] = {"name": sections[idx]["name"], "text": text}
+
+    return join_sections(sections)
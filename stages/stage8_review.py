@@ -1,51 +1,161 @@
 from utils.llm import query_groq
-import json
+import os
+from utils.tracing import traced_stage
+from utils.json_extract import extract_json
+from utils.sections import split_sections, find_section, outline
 
-def stage8_review_paper(paper_content, topic):
-    print("\n--- STAGE 8: FINAL PAPER REVIEW (Groq Judge) ---")
-    
+# Sections scoring below this are rewritten by the next revision round
+SECTION_PASS_SCORE = float(os.getenv("SECTION_PASS_SCORE", "7"))
+
+def _parse_review(response):
+    # Tolerates prose/code fences around the JSON and truncated answers
+    review = extract_json(response, expect=dict)
+    if review is None:
+        raise ValueError("no JSON object in response")
+    return review
+
+def _section_reviews(raw_sections, sections):
+    """
+    Maps the reviewer's per-section entries onto the draft's actual headings,
+    dropping names that match no section.
+    """
+    reviews = []
+    for entry in raw_sections or []:
+        if not isinstance(entry, dict):
+            continue
+        idx = find_section(sections, str(entry.get("section", "")))
+        if idx is None:
+            continue
+        try:
+            score = float(entry.get("score", 0))
+        except (TypeError, ValueError):
+            continue
+        reviews.append({"section": sections[idx]["name"], "score": score, "critique": entry.get("critique", "")})
+    return reviews
+
+def failing_sections(review):
+    """
+    Per-section reviews below SECTION_PASS_SCORE, i.e. what the next
+    revision round should rewrite.
+    """
+    return [s for s in review.get("sections", []) if s.get("score", 0) < SECTION_PASS_SCORE]
+
+def _merge_review(previous_review, revised):
+    """
+    Folds a partial review of the revised sections into the previous one.
+    The overall score moves by the revised sections' score changes averaged
+    over all sections, so fixing one section of ten moves it by a tenth.
+    The result is marked partial: it is an estimate, and acceptance needs a
+    full review.
+    """
+    old = {s["section"]: s for s in previous_review.get("sections", [])}
+    deltas = [s["score"] - old[s["section"]]["score"] for s in revised if s["section"] in old]
+    merged = dict(old)
+    for s in revised:
+        merged[s["section"]] = s
+    score = previous_review.get("score", 0) + sum(deltas) / max(1, len(merged))
+    score = round(min(10.0, max(1.0, score)), 1)
+    still_failing = [s for s in merged.values() if s["score"] < SECTION_PASS_SCORE]
+    critique = " ".join(f"[{s['section']}] {s['critique']}" for s in still_failing) or previous_review.get("critique", "")
+    return {"score": score, "critique": critique, "sections": list(merged.values()), "partial": True}
+
+def _review_full(paper_content, topic, sections):
     prompt = f"""
     You are a strict Senior Editor at a Scopus-indexed journal.
-    
+
     Research Topic: "{topic}"
-    
+
     Review the following draft research paper content (Markdown):
     {paper_content[:25000]}  # Truncate to fit context if needed
-    
+
     Task:
     Rate this paper on a scale of 1-10 (10 being perfect for publication).
     Provide structural critique and specific actionable feedback for improvement if score < 10.
-    
+    Also rate EACH section (by its heading) on the same scale, with section-specific critique.
+
     Evaluation Criteria:
     1. Novelty & Contribution (Does it add value?)
     2. Clarity & Structure (Is it well-organized?)
     3. Rigor (Is the methodology sound?)
     4. Compliance (Does it look like a real academic paper?)
-    
+
     Output Format (JSON strictly):
     {{
         "score": number,
-        "critique": "string"
+        "critique": "string",
+        "sections": [
+            {{"section": "heading text", "score": number, "critique": "string"}}
+        ]
     }}
     """
-    
+
     response = query_groq(prompt, json_mode=True, fallback_to_others=True)
     try:
-        # Robust extraction for offline models that might header/footer text
-        start_idx = response.find('{')
-        end_idx = response.rfind('}')
-        
-        if start_idx != -1 and end_idx != -1:
-            cleaned = response[start_idx:end_idx+1]
-        else:
-            cleaned = response.replace("```json", "").replace("```", "").strip()
-            
-        review = json.loads(cleaned)
-        print(f"  Paper Score: {review.get('score')}/10")
+        review = _parse_review(response)
+        review["sections"] = _section_reviews(review.get("sections"), sections)
+        print(f"  Paper Score: {review.get('score')}/10 ({len(failing_sections(review))} sections below {SECTION_PASS_SCORE:g})")
         return review
     except Exception as e:
         print(f"  Error parsing review: {e}")
         print(f"  Raw response: {response}")
         # Return a low score to trigger regeneration if parsing fails, assuming bad generation.
-        return {"score": 4, "critique": "JSON parsing failed. Automatic integrity penalty."}  
-        # Previously was returning 0 and "Error ...", which works too.
+        return {"score": 4, "critique": "JSON parsing failed. Automatic integrity penalty.", "sections": []}
+
+def _review_sections(topic, sections, names, previous_review):
+    revised = [sections[i] for i in sorted({find_section(sections, n) for n in names} - {None})]
+    if not revised:
+        return previous_review
+    revised_block = "\n\n".join(s["text"].strip() for s in revised)
+
+    prompt = f"""
+    You are a strict Senior Editor at a Scopus-indexed journal.
+
+    Research Topic: "{topic}"
+
+    You previously reviewed this paper (overall score {previous_review.get('score')}/10) and requested revisions.
+    The sections below have been rewritten; the rest of the paper is unchanged.
+
+    Paper Outline:
+    {outline(sections)}
+
+    Revised Sections (Markdown):
+    {revised_block[:25000]}
+
+    Task:
+    Re-rate EACH revised section on a scale of 1-10 (10 being perfect for publication),
+    with specific actionable critique if its score < 10.
+
+    Output Format (JSON strictly):
+    {{
+        "sections": [
+            {{"section": "heading text", "score": number, "critique": "string"}}
+        ]
+    }}
+    """
+
+    response = query_groq(prompt, json_mode=True, fallback_to_others=True)
+    try:
+        section_reviews = _section_reviews(_parse_review(response).get("sections"), sections)
+    except Exception as e:
+        print(f"  Error parsing section review: {e}")
+        section_reviews = []
+    review = _merge_review(previous_review, section_reviews)
+    print(f"  Paper Score: {review['score']}/10 after re-reviewing {len(revised)} sections "
+          f"({len(failing_sections(review))} still below {SECTION_PASS_SCORE:g})")
+    return review
+
+@traced_stage("stage8_review")
+def stage8_review_paper(paper_content, topic, only_sections=None, previous_review=None):
+    """
+    Reviews the whole paper, returning an overall score/critique plus a
+    score/critique per section. With only_sections and previous_review,
+    re-reviews just those (revised) sections and merges the result into
+    previous_review instead; that review has "partial": True and must not
+    be used to accept the paper.
+    """
+    print("\n--- STAGE 8: FINAL PAPER REVIEW (Groq Judge) ---")
+    sections = split_sections(paper_content)
+
+    if only_sections and previous_review:
+        return _review_sections(topic, sections, only_sections, previous_review)
+    return _review_full(paper_content, topic, sections)
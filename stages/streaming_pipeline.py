@@ -0,0 +1,93 @@
+import os
+from utils.streaming import stream_map
+from stages.stage2_discovery import iter_document_discovery
+from stages.stage3_analysis import analyze_single_document
+from stages.stage3b_deepen import build_deep_decomposition, DEEPEN_MAX_ROUNDS
+from stages.stage4_scoring import score_single_document
+from utils.frontier import ResearchFrontier
+from utils.tracing import traced_stage
+
+# Worker/buffer sizes for the streaming executor
+STREAM_ANALYSIS_WORKERS = int(os.getenv("STREAM_ANALYSIS_WORKERS", "2"))
+STREAM_SCORING_WORKERS = int(os.getenv("STREAM_SCORING_WORKERS", "2"))
+STREAM_BUFFER_SIZE = int(os.getenv("STREAM_BUFFER_SIZE", "4"))
+
+def _stream_round(decomposition, topic, keywords, analyzed_sink, frontier):
+    """
+    One discovery round as a chain of bounded streams:
+    download -> analyze_single_document -> score_single_document.
+    """
+    docs = (doc for doc in iter_document_discovery(decomposition, frontier=frontier)
+            if frontier.claim_analysis(doc))
+
+    analyzed = stream_map(
+        lambda doc: analyze_single_document(doc, topic, keywords), docs,
+        max_workers=STREAM_ANALYSIS_WORKERS, buffer_size=STREAM_BUFFER_SIZE, label="analysis",
+    )
+
+    def track(stream):
+        for doc in stream:
+            analyzed_sink.append(doc)
+            yield doc
+
+    return stream_map(
+        lambda doc: score_single_document(doc, topic), track(analyzed),
+        max_workers=STREAM_SCORING_WORKERS, buffer_size=STREAM_BUFFER_SIZE, label="scoring",
+    )
+
+def _resumed_round(analyzed_sink, scored_urls, topic):
+    """
+    Scores the documents a resumed run analyzed but never scored.
+    """
+    unscored = [doc for doc in analyzed_sink if doc['url'] not in scored_urls]
+    if unscored:
+        print(f"  [Resume] Scoring {len(unscored)} documents analyzed before the interruption.")
+    return stream_map(
+        lambda doc: score_single_document(doc, topic), iter(unscored),
+        max_workers=STREAM_SCORING_WORKERS, buffer_size=STREAM_BUFFER_SIZE, label="scoring",
+    )
+
+@traced_stage("stages2_4_streaming")
+def stream_scored_documents(decomposition, topic, keywords=None, analyzed_sink=None, deepen=True, scored_urls=None):
+    """
+    Streaming replacement for Stages 2 -> 3 -> 3b -> 4.
+
+    Yields scored documents as soon as each one has been downloaded,
+    analyzed and scored, instead of waiting for every document at each stage
+    barrier. Stage 3b needs the complete first-round analysis to find gaps,
+    so each deep-dive round starts once the previous round has drained and
+    then streams through the same chain, until marginal yield or the
+    frontier budget runs out.
+
+    analyzed_sink, if given, collects every analyzed document. Documents
+    already in it (from a resumed run) are not fetched or analyzed again;
+    those whose URL is not in scored_urls are scored first.
+    """
+    print("\n--- STAGES 2-4: STREAMING DISCOVERY / ANALYSIS / SCORING ---")
+    if analyzed_sink is None:
+        analyzed_sink = []
+    # Shared across rounds so deep dives never re-fetch or re-analyze earlier papers
+    frontier = ResearchFrontier()
+    if analyzed_sink:
+        frontier.seed(analyzed_sink, queries=False)
+        yield from _resumed_round(analyzed_sink, scored_urls or set(), topic)
+
+    yield from _stream_round(decomposition, topic, keywords, analyzed_sink, frontier)
+
+    if not deepen:
+        return
+
+    print("\n--- STAGE 3b: DEEP KNOWLEDGE RECURSION (Streaming) ---")
+    latest = list(analyzed_sink)
+    for round_no in range(1, DEEPEN_MAX_ROUNDS + 1):
+        if not frontier.budget_left():
+            print("  [Frontier] Budget exhausted. No further deep dives.")
+            break
+        deep_decomposition = build_deep_decomposition(latest, topic, avoid_queries=frontier.queries)
+        if not deep_decomposition:
+            break
+        docs_before, downloads_before = len(analyzed_sink), frontier.downloads
+        yield from _stream_round(deep_decomposition, topic, None, analyzed_sink, frontier)
+        latest = analyzed_sink[docs_before:]
+        if not frontier.record_round(frontier.downloads - downloads_before, len(latest)):
+            break
@@ -0,0 +1,48 @@
+import re
+import math
+from collections import Counter
+
+# Common English function words; dropped so they do not dominate short queries
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have in is it its of on or that the
+this to was were will with we our their these those which using based via
+""".split())
+
+def tokenize(text):
+    return [t for t in re.findall(r"[a-z0-9]+", (text or "").lower()) if t not in STOPWORDS and len(t) > 1]
+
+class BM25:
+    """
+    Minimal in-process Okapi BM25 over a fixed list of texts.
+    """
+
+    def __init__(self, texts, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs = [Counter(tokenize(t)) for t in texts]
+        self.lengths = [sum(d.values()) for d in self.docs]
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.docs else 0.0
+        doc_freq = Counter()
+        for d in self.docs:
+            doc_freq.update(d.keys())
+        n = len(self.docs)
+        self.idf = {
+            term: math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for term, df in doc_freq.items()
+        }
+
+    def score(self, query):
+        """
+        Returns one BM25 score per indexed text for the query string.
+        """
+        terms = set(tokenize(query))
+        scores = []
+        for counts, length in zip(self.docs, self.lengths):
+            total = 0.0
+            norm = self.k1 * (1 - self.b + self.b * length / self.avg_length) if self.avg_length else self.k1
+            for term in terms:
+                tf = counts.get(term)
+                if tf:
+                    total += self.idf[term] * tf * (self.k1 + 1) / (tf + norm)
+            scores.append(total)
+        return scores
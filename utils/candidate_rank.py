@@ -0,0 +1,98 @@
+import os
+from urllib.parse import urlparse
+from dotenv import load_dotenv
+from utils.bm25 import BM25
+
+load_dotenv()
+
+# --- Configuration ---
+# Candidates downloaded per discovery round, best-ranked first
+SEARCH_TOP_N = int(os.getenv("SEARCH_TOP_N", "20"))
+# Next-best candidates held back to replace downloads that fail, are too
+# short or turn out to be near-duplicates
+SEARCH_RESERVE = int(os.getenv("SEARCH_RESERVE", "10"))
+# Weight of the domain prior against the (max-normalized) BM25 score
+DOMAIN_PRIOR_WEIGHT = float(os.getenv("DOMAIN_PRIOR_WEIGHT", "0.3"))
+
+# Host (or host suffix, with a leading dot) -> credibility prior in [0, 1].
+# First match wins, so specific hosts come before generic suffixes.
+DOMAIN_PRIORS = [
+    ("arxiv.org", 1.0),
+    ("doi.org", 1.0),
+    ("openreview.net", 1.0),
+    ("aclanthology.org", 1.0),
+    ("acm.org", 0.9),
+    ("ieee.org", 0.9),
+    ("springer.com", 0.9),
+    ("sciencedirect.com", 0.9),
+    ("nature.com", 0.9),
+    ("ncbi.nlm.nih.gov", 0.9),
+    ("semanticscholar.org", 0.8),
+    ("researchgate.net", 0.6),
+    (".edu", 0.8),
+    (".ac.uk", 0.8),
+    (".gov", 0.6),
+    (".org", 0.3),
+]
+# Direct PDF links are usually the paper itself rather than a landing page
+PDF_PRIOR = 0.5
+
+def domain_prior(url):
+    """
+    Credibility prior for a result URL: 0 for unknown hosts.
+    """
+    parsed = urlparse(url or "")
+    host = parsed.netloc.lower().split(":")[0]
+    if host.startswith("www."):
+        host = host[4:]
+    prior = 0.0
+    for pattern, value in DOMAIN_PRIORS:
+        if pattern.startswith("."):
+            matched = host.endswith(pattern)
+        else:
+            matched = host == pattern or host.endswith("." + pattern)
+        if matched:
+            prior = value
+            break
+    if parsed.path.lower().endswith(".pdf"):
+        prior = max(prior, PDF_PRIOR)
+    return prior
+
+def _ranking_queries(items, decomposition):
+    """
+    The text each result is ranked against: topic, its subtopic's name and
+    keywords, and the query that found it.
+    """
+    topic = decomposition.get("topic", "")
+    keywords = {
+        s.get("name", ""): " ".join(s.get("keywords") or [])
+        for s in decomposition.get("subtopics", [])
+    }
+    return [
+        " ".join([topic, item.get("subtopic", ""), keywords.get(item.get("subtopic", ""), ""), item.get("query", "")])
+        for item in items
+    ]
+
+def rank_candidates(items, decomposition):
+    """
+    Orders search results by local relevance before anything is downloaded:
+    BM25 of title + snippet against the result's ranking query, normalized
+    to [0, 1], plus DOMAIN_PRIOR_WEIGHT x domain_prior. Each item gets its
+    'rank_score'; ties keep search order.
+    """
+    if not items:
+        return []
+    index = BM25([f"{item.get('title') or ''} {item.get('snippet') or ''}" for item in items])
+
+    # One BM25 pass per distinct ranking query, not per result
+    scores_by_query = {}
+    relevance = []
+    for i, query in enumerate(_ranking_queries(items, decomposition)):
+        if query not in scores_by_query:
+            scores_by_query[query] = index.score(query)
+        relevance.append(scores_by_query[query][i])
+
+    top = max(relevance) or 1.0
+    for item, score in zip(items, relevance):
+        item['rank_score'] = round(score / top + DOMAIN_PRIOR_WEIGHT * domain_prior(item.get('link')), 4)
+    return sorted(items, key=lambda item: item['rank_score'], reverse=True)
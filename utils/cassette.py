@@ -0,0 +1,104 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Configuration ---
+# Default cassette for bare 'replay' model ids ('replay:<path>' picks another file)
+LLM_CASSETTE_PATH = os.getenv("LLM_CASSETTE_PATH", "cassettes/llm.jsonl")
+# When set, every answer returned by query_stage is appended to this cassette
+LLM_RECORD_PATH = os.getenv("LLM_RECORD_PATH")
+# Replay at recorded speed instead of instantly, to reproduce a run's timing
+LLM_REPLAY_REALTIME = os.getenv("LLM_REPLAY_REALTIME", "False").lower() == "true"
+
+_lock = threading.Lock()
+_cassettes = {}
+_record_path = LLM_RECORD_PATH
+
+def prompt_hash(prompt):
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+def start_recording(path):
+    """
+    Switches record mode on (path) or off (None) for the rest of the process.
+    """
+    global _record_path
+    _record_path = path
+
+def record(stage, prompt, response, latency_s=0.0, cache_hit=False):
+    """
+    Appends one exchange to the recording cassette. Failed answers are not
+    recorded, mirroring llm_cache.put.
+    """
+    path = _record_path
+    if not path or not response or response.startswith("Error:"):
+        return
+    entry = {
+        "prompt_hash": prompt_hash(prompt),
+        "stage": stage,
+        "response": response,
+        "latency_s": round(latency_s, 3),
+        "cache_hit": cache_hit,
+        "recorded_at": time.time(),
+    }
+    with _lock:
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+class Cassette:
+    """
+    Recorded responses from one cassette file, keyed by prompt hash. A prompt
+    recorded several times (e.g. repeated drafts) is answered in recorded
+    order; once exhausted, the last answer is repeated.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._served = {}
+        self._lock = threading.Lock()
+        with open(path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    entry = json.loads(line)
+                    self.entries.setdefault(entry["prompt_hash"], []).append(entry)
+
+    def lookup(self, prompt):
+        key = prompt_hash(prompt)
+        with self._lock:
+            recorded = self.entries.get(key)
+            if not recorded:
+                return None
+            index = self._served.get(key, 0)
+            self._served[key] = index + 1
+            return recorded[min(index, len(recorded) - 1)]
+
+def load_cassette(path):
+    with _lock:
+        if path not in _cassettes:
+            _cassettes[path] = Cassette(path)
+        return _cassettes[path]
+
+def replay_strategy(model_id):
+    """
+    Provider factory for 'replay' / 'replay:<path>' model ids.
+    """
+    path = model_id.split(":", 1)[1] if ":" in model_id else LLM_CASSETTE_PATH
+    cassette = load_cassette(path)
+
+    def call(prompt):
+        entry = cassette.lookup(prompt)
+        if entry is None:
+            raise LookupError(f"replay: no recorded response for prompt {prompt_hash(prompt)[:12]} in {path}")
+        if LLM_REPLAY_REALTIME and not entry.get("cache_hit"):
+            time.sleep(entry.get("latency_s", 0.0))
+        return entry["response"]
+    return call
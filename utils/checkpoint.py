@@ -0,0 +1,186 @@
+import os
+import re
+import json
+import time
+import uuid
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+RUNS_DIR = os.getenv("RUNS_DIR", "runs")
+MANIFEST_NAME = "manifest.json"
+
+def is_empty_result(result):
+    """
+    None or an empty list/dict/string: what a stage returns when it found
+    nothing or failed, and what a resumed run must recompute, not replay.
+    """
+    return result is None or (isinstance(result, (list, dict, str)) and len(result) == 0)
+
+def _slugify(text, max_len=40):
+    slug = re.sub(r"[^a-z0-9]+", "-", (text or "").lower()).strip("-")
+    return slug[:max_len].strip("-") or "run"
+
+class RunStore:
+    """
+    Persists each stage's output under runs/<run-id>/ with a manifest, so a
+    crashed or interrupted run can be resumed without redoing paid LLM work.
+
+    JSON-serializable artifacts are stored as <name>.json; strings (paper
+    drafts) as <name>.md; items appended one at a time as <name>.jsonl.
+    """
+
+    def __init__(self, run_dir, manifest):
+        self.run_dir = run_dir
+        self.manifest = manifest
+        self._lock = threading.Lock()
+
+    @property
+    def run_id(self):
+        return self.manifest["run_id"]
+
+    @property
+    def topic(self):
+        return self.manifest["topic"]
+
+    @classmethod
+    def create(cls, topic, options=None):
+        # Random suffix keeps ids unique when batch mode starts several runs per second
+        run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{_slugify(topic)}-{uuid.uuid4().hex[:4]}"
+        run_dir = os.path.join(RUNS_DIR, run_id)
+        os.makedirs(run_dir, exist_ok=True)
+        manifest = {
+            "run_id": run_id,
+            "topic": topic,
+            "options": options or {},
+            "created_at": time.time(),
+            "updated_at": time.time(),
+            "status": "running",
+            "artifacts": {},
+        }
+        store = cls(run_dir, manifest)
+        store._write_manifest()
+        print(f"Run ID: {run_id} (checkpoints in {run_dir})")
+        return store
+
+    @classmethod
+    def resume(cls, run_id):
+        run_dir = os.path.join(RUNS_DIR, run_id)
+        manifest_path = os.path.join(run_dir, MANIFEST_NAME)
+        if not os.path.exists(manifest_path):
+            raise FileNotFoundError(f"No run manifest found at {manifest_path}")
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+        print(f"Resuming run {run_id}: {len(manifest['artifacts'])} checkpointed artifacts.")
+        return cls(run_dir, manifest)
+
+    def _write_manifest(self):
+        self.manifest["updated_at"] = time.time()
+        tmp_path = os.path.join(self.run_dir, MANIFEST_NAME + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.manifest, f, indent=2)
+        # Atomic swap so a crash never leaves a half-written manifest
+        os.replace(tmp_path, os.path.join(self.run_dir, MANIFEST_NAME))
+
+    def has(self, name):
+        return name in self.manifest["artifacts"]
+
+    def save(self, name, data):
+        is_text = isinstance(data, str)
+        filename = f"{name}.md" if is_text else f"{name}.json"
+        path = os.path.join(self.run_dir, filename)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            if is_text:
+                f.write(data)
+            else:
+                json.dump(data, f)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self.manifest["artifacts"][name] = {"file": filename, "saved_at": time.time()}
+            self._write_manifest()
+
+    def append(self, name, item):
+        """
+        Appends one JSON item to the <name>.jsonl artifact, for outputs that
+        arrive one at a time (streamed documents). load() returns the list.
+        """
+        filename = f"{name}.jsonl"
+        with self._lock:
+            with open(os.path.join(self.run_dir, filename), "a") as f:
+                f.write(json.dumps(item) + "\n")
+            if name not in self.manifest["artifacts"]:
+                self.manifest["artifacts"][name] = {"file": filename, "saved_at": time.time()}
+                self._write_manifest()
+
+    def artifact_path(self, name):
+        """
+        Where a text artifact is saved, e.g. for writing a draft incrementally
+        before it is checkpointed. Not in the manifest until save().
+        """
+        return os.path.join(self.run_dir, f"{name}.md")
+
+    def load(self, name):
+        entry = self.manifest["artifacts"][name]
+        path = os.path.join(self.run_dir, entry["file"])
+        if entry["file"].endswith(".jsonl"):
+            return self._load_items(path)
+        with open(path, "r") as f:
+            if entry["file"].endswith(".md"):
+                return f.read()
+            return json.load(f)
+
+    def _load_items(self, path):
+        items = []
+        torn = False
+        with open(path, "r") as f:
+            for line in f:
+                try:
+                    items.append(json.loads(line))
+                except ValueError:
+                    torn = True
+        if torn:
+            # A line cut short by a crash mid-append: rewrite without it so
+            # later appends start on a clean line
+            with self._lock:
+                tmp_path = path + ".tmp"
+                with open(tmp_path, "w") as f:
+                    f.writelines(json.dumps(item) + "\n" for item in items)
+                os.replace(tmp_path, path)
+        return items
+
+    def stage(self, name, compute):
+        """
+        Returns the checkpointed artifact if present, otherwise computes,
+        saves and returns it. Empty or failed results are not saved, so a
+        resumed run retries the stage instead of replaying the failure.
+        """
+        if self.has(name):
+            print(f"  [Resume] Loaded '{name}' from checkpoint.")
+            return self.load(name)
+        result = compute()
+        if not is_empty_result(result):
+            self.save(name, result)
+        return result
+
+    def set_status(self, status):
+        with self._lock:
+            self.manifest["status"] = status
+            self._write_manifest()
+
+class CheckpointList(list):
+    """
+    List that also appends each added item to a JSONL artifact of store, so
+    items produced one at a time survive a crash. Starts from the items
+    checkpointed so far.
+    """
+
+    def __init__(self, store, name):
+        super().__init__(store.load(name) if store.has(name) else [])
+        self.store = store
+        self.name = name
+
+    def append(self, item):
+        super().append(item)
+        self.store.append(self.name, item)
@@ -0,0 +1,180 @@
+import os
+import re
+import time
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Configuration ---
+# Consecutive generic failures before a provider is taken out of rotation
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "3"))
+# Default cool-down (seconds) when a 429 carries no Retry-After hint
+CIRCUIT_COOLDOWN = float(os.getenv("CIRCUIT_COOLDOWN", "60"))
+# Cool-down for configuration errors (missing key / unknown model); effectively the whole run
+CIRCUIT_CONFIG_COOLDOWN = float(os.getenv("CIRCUIT_CONFIG_COOLDOWN", "3600"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+def is_rate_limit_error(error):
+    msg = str(error)
+    return "429" in msg or "rate limit" in msg.lower() or "ResourceExhausted" in msg or "QuotaExceeded" in msg
+
+def is_config_error(error):
+    msg = str(error).lower()
+    return "api_key" in msg or "not found" in msg or "client init failed" in msg
+
+def is_request_error(error):
+    """
+    Failures tied to one request rather than to provider health (e.g. a
+    replay cassette with no answer for this prompt). These never trip the breaker.
+    """
+    return isinstance(error, LookupError)
+
+def retry_after_seconds(error):
+    """
+    Best-effort extraction of a server-provided retry delay from an SDK exception.
+    Looks at a Retry-After header first, then at the hints Groq/Gemini put in messages.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers:
+        value = headers.get("retry-after") or headers.get("Retry-After")
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                pass
+
+    msg = str(error)
+    # Groq: "Please try again in 7m12.5s" / "try again in 950ms"
+    match = re.search(r"try again in (?:(\d+)h)?(?:(\d+)m(?!s))?(?:([\d.]+)s)?(?:([\d.]+)ms)?", msg)
+    if match and any(match.groups()):
+        hours, minutes, seconds, millis = match.groups()
+        return (int(hours or 0) * 3600 + int(minutes or 0) * 60
+                + float(seconds or 0) + float(millis or 0) / 1000)
+    # Gemini: "retry_delay { seconds: 30 }"
+    match = re.search(r"retry_delay\s*\{\s*seconds:\s*(\d+)", msg)
+    if match:
+        return float(match.group(1))
+    return None
+
+class CircuitBreaker:
+    """
+    Thread-safe closed/open/half-open breaker for a single provider.
+
+    closed    -> calls flow; failures are counted.
+    open      -> calls are skipped until the cool-down expires.
+    half-open -> one probe call is let through; success closes, failure re-opens.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.state = CLOSED
+        self.failures = 0
+        self.open_until = 0.0
+        self.probe_in_flight = False
+        self.last_error = ""
+        self.successes = 0
+        self.skipped = 0
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.time() >= self.open_until:
+                self.state = HALF_OPEN
+                self.probe_in_flight = False
+            if self.state == HALF_OPEN and not self.probe_in_flight:
+                self.probe_in_flight = True
+                return True
+            self.skipped += 1
+            return False
+
+    def is_open(self):
+        """
+        True while the provider is in its cool-down. Unlike allow(), never
+        claims the half-open probe.
+        """
+        with self._lock:
+            return self.state == OPEN and time.time() < self.open_until
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.probe_in_flight = False
+            self.successes += 1
+
+    def record_failure(self, error):
+        with self._lock:
+            self.probe_in_flight = False
+            self.last_error = str(error)[:120]
+            if is_request_error(error):
+                return
+            self.failures += 1
+
+            if is_rate_limit_error(error):
+                cooldown = retry_after_seconds(error) or CIRCUIT_COOLDOWN
+            elif is_config_error(error):
+                cooldown = CIRCUIT_CONFIG_COOLDOWN
+            elif self.state == HALF_OPEN or self.failures >= CIRCUIT_FAILURE_THRESHOLD:
+                cooldown = CIRCUIT_COOLDOWN
+            else:
+                return
+
+            self.state = OPEN
+            self.open_until = time.time() + cooldown
+            self.trips += 1
+
+    def snapshot(self):
+        with self._lock:
+            remaining = max(0.0, self.open_until - time.time()) if self.state == OPEN else 0.0
+            return {
+                "provider": self.name,
+                "state": self.state,
+                "successes": self.successes,
+                "consecutive_failures": self.failures,
+                "trips": self.trips,
+                "skipped_calls": self.skipped,
+                "cooldown_remaining": round(remaining, 1),
+                "last_error": self.last_error,
+            }
+
+_breakers = {}
+_registry_lock = threading.Lock()
+
+def get_breaker(provider):
+    with _registry_lock:
+        if provider not in _breakers:
+            _breakers[provider] = CircuitBreaker(provider)
+        return _breakers[provider]
+
+def provider_status():
+    with _registry_lock:
+        breakers = list(_breakers.values())
+    return [b.snapshot() for b in breakers]
+
+def print_provider_status():
+    """
+    Dumps the breaker state of every provider used during this run.
+    """
+    from termcolor import colored
+
+    status = provider_status()
+    if not status:
+        return
+    print("\nProvider status:")
+    for s in status:
+        color = "green" if s["state"] == CLOSED else "yellow" if s["state"] == HALF_OPEN else "red"
+        line = (f"  {s['provider']:<12} {s['state']:<9} ok={s['successes']} trips={s['trips']} "
+                f"skipped={s['skipped_calls']}")
+        if s["state"] == OPEN:
+            line += f" (cool-down {s['cooldown_remaining']}s)"
+        if s["last_error"] and s["state"] != CLOSED:
+            line += f" last error: {s['last_error'][:60]}"
+        print(colored(line, color))
@@ -0,0 +1,209 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from utils.circuit_breaker import is_rate_limit_error
+
+load_dotenv()
+
+# --- Configuration ---
+# False pins every pool at its initial size
+CONCURRENCY_ADAPTIVE = os.getenv("CONCURRENCY_ADAPTIVE", "True").lower() == "true"
+# Multiplicative decrease applied once per burst of 429s/timeouts
+AIMD_DECREASE = float(os.getenv("AIMD_DECREASE", "0.5"))
+# Growth pauses while smoothed task latency exceeds this multiple of the best seen
+AIMD_LATENCY_TOLERANCE = float(os.getenv("AIMD_LATENCY_TOLERANCE", "2.0"))
+# Decisions kept per pool for the run report
+_HISTORY_LIMIT = 200
+
+# Pool -> (initial, maximum in-flight tasks, congestion source). Initial
+# sizes are the previous hard-coded worker counts.
+_DEFAULT_LIMITS = {
+    "search": (5, 10, "http"),
+    "downloads": (5, 16, "http"),
+    "analysis": (3, 12, "llm"),
+}
+
+def _limits_for(name):
+    initial, maximum, source = _DEFAULT_LIMITS.get(name, (2, 8, "llm"))
+    prefix = name.upper()
+    initial = int(os.getenv(f"{prefix}_CONCURRENCY", initial))
+    maximum = int(os.getenv(f"{prefix}_MAX_CONCURRENCY", maximum))
+    return initial, max(initial, maximum), source
+
+# Congestion signals (429s, timeouts) per source, bumped wherever they are caught
+_congestion = {}
+_congestion_lock = threading.Lock()
+
+def is_congestion_error(error):
+    """
+    Errors that mean "slow down" rather than "this request is bad",
+    including calls refused because every provider's circuit is open.
+    """
+    if is_rate_limit_error(error) or isinstance(error, TimeoutError):
+        return True
+    msg = str(error).lower()
+    return "timeout" in type(error).__name__.lower() or "timed out" in msg or "circuit open" in msg
+
+def note_congestion(source):
+    with _congestion_lock:
+        _congestion[source] = _congestion.get(source, 0) + 1
+
+def congestion_count(source):
+    with _congestion_lock:
+        return _congestion.get(source, 0)
+
+class AdaptiveLimiter:
+    """
+    AIMD cap on in-flight tasks for one worker pool, thread-safe.
+
+    Each task that succeeds at the full limit grows it by 1/limit (about +1
+    per limit's worth of tasks) while smoothed latency stays within
+    AIMD_LATENCY_TOLERANCE of the best seen. Any congestion signal on the
+    pool's source since the last decision cuts it by AIMD_DECREASE instead,
+    at most once per window: completions of tasks started before the last
+    cut were sent at the old level and do not cut again.
+    Tasks that raise never grow it: a fast failure (e.g. an open circuit)
+    is not evidence of spare capacity.
+    Pools are sized at the maximum; tasks wait in slot() for the limit.
+    """
+
+    def __init__(self, name, initial, maximum, source, minimum=1):
+        self.name = name
+        self.source = source
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(initial)
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.increases = 0
+        self.decreases = 0
+        self.latency_ewma = None
+        self.best_latency = None
+        self.history = []
+        self._seen_congestion = congestion_count(source)
+        self._last_decrease = float("-inf")
+        self._started = time.monotonic()
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def slot(self):
+        """
+        Holds one in-flight slot for the duration of the block.
+        """
+        with self._cond:
+            if self.in_flight == 0:
+                # Signals from while the pool sat idle say nothing about its load
+                self._seen_congestion = congestion_count(self.source)
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+        start = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            if is_congestion_error(e):
+                note_congestion(self.source)
+            self._complete(start, failed=True)
+            raise
+        self._complete(start)
+
+    def run(self, func, *args, **kwargs):
+        """
+        func(*args, **kwargs) inside a slot; convenient for executor.submit.
+        """
+        with self.slot():
+            return func(*args, **kwargs)
+
+    def _complete(self, start, failed=False):
+        decision = None
+        now = time.monotonic()
+        latency = now - start
+        with self._cond:
+            saturated = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            self.completed += 1
+            if failed:
+                self.failed += 1
+            else:
+                self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+                self.best_latency = self.latency_ewma if self.best_latency is None else min(self.best_latency, self.latency_ewma)
+
+            old = int(self.limit)
+            events = congestion_count(self.source)
+            if not CONCURRENCY_ADAPTIVE:
+                pass
+            elif events > self._seen_congestion:
+                self._seen_congestion = events
+                if start >= self._last_decrease:
+                    self._last_decrease = now
+                    self.limit = max(float(self.minimum), self.limit * AIMD_DECREASE)
+                reason = "429/timeout"
+            elif not failed and saturated and self.latency_ewma <= AIMD_LATENCY_TOLERANCE * self.best_latency:
+                # Only grow a limit that is actually being used
+                self.limit = min(float(self.maximum), self.limit + 1.0 / max(1, old))
+                reason = "healthy"
+
+            new = int(self.limit)
+            if new != old:
+                if new > old:
+                    self.increases += 1
+                else:
+                    self.decreases += 1
+                decision = {"t_s": round(now - self._started, 2), "from": old, "to": new,
+                            "reason": reason, "latency_ewma_s": round(self.latency_ewma or 0.0, 3)}
+                self.history = (self.history + [decision])[-_HISTORY_LIMIT:]
+            self._cond.notify_all()
+
+        if decision:
+            print(f"  [Concurrency] {self.name}: {decision['from']} -> {decision['to']} in flight "
+                  f"({decision['reason']}, latency {decision['latency_ewma_s']:.2f}s)")
+
+    def snapshot(self):
+        with self._cond:
+            return {
+                "pool": self.name,
+                "limit": int(self.limit),
+                "minimum": self.minimum,
+                "maximum": self.maximum,
+                "completed": self.completed,
+                "failed": self.failed,
+                "increases": self.increases,
+                "decreases": self.decreases,
+                "latency_ewma_s": round(self.latency_ewma or 0.0, 3),
+                "best_latency_s": round(self.best_latency or 0.0, 3),
+                "history": list(self.history),
+            }
+
+_limiters = {}
+_registry_lock = threading.Lock()
+
+def get_limiter(name):
+    """
+    Process-wide limiter for a pool, so later rounds and batch runs start
+    from the level earlier ones converged to.
+    """
+    with _registry_lock:
+        if name not in _limiters:
+            initial, maximum, source = _limits_for(name)
+            _limiters[name] = AdaptiveLimiter(name, initial, maximum, source)
+        return _limiters[name]
+
+def concurrency_status():
+    with _registry_lock:
+        limiters = list(_limiters.values())
+    return [limiter.snapshot() for limiter in limiters]
+
+def print_concurrency_status():
+    """
+    One line per pool used during this run: where its limit ended up.
+    """
+    status = concurrency_status()
+    if not status:
+        return
+    print("\nConcurrency:")
+    for s in status:
+        print(f"  {s['pool']:<12} limit={s['limit']} (max {s['maximum']}) +{s['increases']}/-{s['decreases']} "
+              f"tasks={s['completed']} failed={s['failed']} latency={s['latency_ewma_s']}s")
@@ -0,0 +1,164 @@
+import os
+import re
+import hashlib
+import threading
+
+# --- Configuration ---
+# Estimated Jaccard similarity above which two documents are the same work
+NEAR_DUP_THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD", "0.7"))
+NUM_PERM = 64
+LSH_BANDS = 16  # 16 bands x 4 rows: candidate pairs start appearing around 0.5 similarity
+SHINGLE_WORDS = 5
+# Fingerprint only the leading part of each document; copies of the same
+# paper agree there and hashing 300 pages buys nothing.
+FINGERPRINT_CHARS = 40000
+# Share of the smaller document's shingles found in the larger one above
+# which it is treated as part of the same work (an abstract page next to the
+# full PDF). Below Jaccard's bar because landing pages carry boilerplate.
+NEAR_DUP_CONTAINMENT = float(os.getenv("NEAR_DUP_CONTAINMENT", "0.5"))
+# Containment is estimated on a consistent 1-in-N sample of shingle hashes...
+CONTAINMENT_SAMPLE = 8
+# ...and only when the smaller sample is large enough to be meaningful
+CONTAINMENT_MIN_SAMPLE = 8
+
+_EMPTY_BIN = (1 << 64) - 1
+
+def _shingle_hashes(text):
+    words = re.findall(r"[a-z0-9]+", text[:FINGERPRINT_CHARS].lower())
+    if len(words) < SHINGLE_WORDS:
+        words = words + [""] * (SHINGLE_WORDS - len(words))
+    hashes = set()
+    for i in range(len(words) - SHINGLE_WORDS + 1):
+        shingle = " ".join(words[i:i + SHINGLE_WORDS])
+        digest = hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest()
+        hashes.add(int.from_bytes(digest, "big"))
+    return hashes
+
+def minhash_signature(text):
+    """
+    64-slot one-permutation MinHash signature over word 5-gram shingles.
+    Each shingle hash is routed to a bin by its low bits and the bin keeps
+    the minimum of the remaining bits, so the signature costs a single pass
+    instead of one pass per permutation.
+    """
+    return _signature(_shingle_hashes(text))
+
+def _signature(hashes):
+    signature = [_EMPTY_BIN] * NUM_PERM
+    for h in hashes:
+        slot = h % NUM_PERM
+        value = h // NUM_PERM
+        if value < signature[slot]:
+            signature[slot] = value
+    return signature
+
+def containment_sample(hashes):
+    """
+    The shingle hashes whose high bits fall in the 1-in-CONTAINMENT_SAMPLE
+    class. The same shingle is sampled in every document, so the overlap of
+    two samples estimates the overlap of the full shingle sets.
+    """
+    return {h for h in hashes if (h >> 32) % CONTAINMENT_SAMPLE == 0}
+
+def estimated_similarity(sig_a, sig_b):
+    # Bins left empty in both signatures (very short texts) carry no evidence
+    used = [(x, y) for x, y in zip(sig_a, sig_b) if x != _EMPTY_BIN or y != _EMPTY_BIN]
+    if not used:
+        return 0.0
+    return sum(1 for x, y in used if x == y) / len(used)
+
+class NearDuplicateIndex:
+    """
+    MinHash + LSH index over document text. Documents are bucketed by band
+    hashes; only documents sharing a bucket are compared, so each lookup is
+    roughly constant time regardless of how many documents were seen.
+
+    Jaccard misses a short document contained in a long one (an arXiv
+    abstract page vs. the full PDF), so a sampled inverted index of shingles
+    also checks containment of the smaller document in the larger. The
+    longer of such a pair is the one kept, whichever arrives first.
+    """
+
+    def __init__(self, threshold=None):
+        self.threshold = threshold if threshold is not None else NEAR_DUP_THRESHOLD
+        self.rows = NUM_PERM // LSH_BANDS
+        self.signatures = {}
+        self.buckets = [{} for _ in range(LSH_BANDS)]
+        self.samples = {}
+        self.postings = {}
+        self.lengths = {}
+        self._lock = threading.Lock()
+
+    def _band_keys(self, signature):
+        for band in range(LSH_BANDS):
+            start = band * self.rows
+            yield band, tuple(signature[start:start + self.rows])
+
+    def check_and_add(self, doc_id, text):
+        """
+        Returns (duplicate_of, replaced). duplicate_of is the id of an
+        already indexed near-duplicate of text, which is then not added.
+        Otherwise text is indexed under doc_id; if it contains a shorter
+        indexed document (the abstract page of this PDF), that one is
+        removed from the index and its id returned as replaced.
+        """
+        hashes = _shingle_hashes(text)
+        signature = _signature(hashes)
+        sample = containment_sample(hashes)
+        with self._lock:
+            candidates = set()
+            for band, key in self._band_keys(signature):
+                candidates.update(self.buckets[band].get(key, ()))
+
+            for other_id in candidates:
+                if estimated_similarity(signature, self.signatures[other_id]) >= self.threshold:
+                    return other_id, None
+
+            replaced = self._contained_match(sample)
+            if replaced is not None:
+                if len(text) <= self.lengths[replaced]:
+                    return replaced, None
+                self._remove(replaced)
+
+            self.signatures[doc_id] = signature
+            for band, key in self._band_keys(signature):
+                self.buckets[band].setdefault(key, []).append(doc_id)
+            self.samples[doc_id] = sample
+            for h in sample:
+                self.postings.setdefault(h, []).append(doc_id)
+            self.lengths[doc_id] = len(text)
+            return None, replaced
+
+    def _remove(self, doc_id):
+        signature = self.signatures.pop(doc_id)
+        for band, key in self._band_keys(signature):
+            self.buckets[band][key].remove(doc_id)
+        for h in self.samples.pop(doc_id):
+            self.postings[h].remove(doc_id)
+        del self.lengths[doc_id]
+
+    def _contained_match(self, sample):
+        """
+        Id of an indexed document that contains, or is contained in, the
+        document with this shingle sample; None if there is none.
+        """
+        shared = {}
+        for h in sample:
+            for other_id in self.postings.get(h, ()):
+                shared[other_id] = shared.get(other_id, 0) + 1
+        for other_id, count in shared.items():
+            smaller = min(len(sample), len(self.samples[other_id]))
+            if smaller >= CONTAINMENT_MIN_SAMPLE and count / smaller >= NEAR_DUP_CONTAINMENT:
+                return other_id
+        return None
+
+    def add_documents(self, documents):
+        """
+        Seeds the index with documents already processed elsewhere (e.g. Stage 2 output).
+        """
+        for doc in documents:
+            if doc.get('raw_text'):
+                self.check_and_add(doc.get('url') or doc.get('title'), doc['raw_text'])
+
+    def __len__(self):
+        return len(self.signatures)
@@ -0,0 +1,161 @@
+import os
+import time
+import sqlite3
+import threading
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Configuration ---
+FETCH_CACHE_PATH = os.getenv("FETCH_CACHE_PATH", ".cache/fetch_cache.sqlite")
+FETCH_CACHE_MAX_MB = float(os.getenv("FETCH_CACHE_MAX_MB", "1024"))
+# Entries younger than this are served without revalidating against the origin.
+FETCH_CACHE_MAX_AGE = int(os.getenv("FETCH_CACHE_MAX_AGE", str(24 * 3600)))
+# Serve exclusively from the cache; misses return empty text instead of hitting the network.
+FETCH_CACHE_OFFLINE = os.getenv("FETCH_CACHE_OFFLINE", "False").lower() == "true"
+FETCH_CACHE_DISABLED = os.getenv("FETCH_CACHE_DISABLED", "False").lower() == "true"
+
+# Query parameters that never change the document being served
+_TRACKING_PARAMS = ("utm_", "fbclid", "gclid", "mc_cid", "mc_eid")
+
+_lock = threading.Lock()
+_conn = None
+_stats = {"hits": 0, "revalidated": 0, "misses": 0, "evictions": 0}
+
+def canonical_url(url):
+    """
+    Normalizes a URL so trivially different spellings share one cache entry:
+    lowercased scheme/host, default ports and fragments dropped, tracking
+    parameters removed and the remaining query sorted.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if (scheme == "http" and netloc.endswith(":80")) or (scheme == "https" and netloc.endswith(":443")):
+        netloc = netloc.rsplit(":", 1)[0]
+    path = parts.path or "/"
+    query = [
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not k.lower().startswith(_TRACKING_PARAMS)
+    ]
+    return urlunsplit((scheme, netloc, path, urlencode(sorted(query)), ""))
+
+def _get_conn():
+    global _conn
+    if _conn is None:
+        cache_dir = os.path.dirname(FETCH_CACHE_PATH)
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+        # Shared across Stage 2 download threads; access is serialized by _lock.
+        _conn = sqlite3.connect(FETCH_CACHE_PATH, check_same_thread=False)
+        _conn.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                content_type TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                body BLOB,
+                text TEXT,
+                size INTEGER,
+                fetched_at REAL,
+                accessed_at REAL
+            )
+        """)
+        _conn.execute("CREATE INDEX IF NOT EXISTS idx_pages_accessed ON pages(accessed_at)")
+        _conn.commit()
+    return _conn
+
+def is_enabled():
+    return not FETCH_CACHE_DISABLED
+
+def lookup(url):
+    """
+    Returns the cached entry for url as a dict (without the raw body), or None.
+    """
+    key = canonical_url(url)
+    with _lock:
+        row = _get_conn().execute(
+            "SELECT content_type, etag, last_modified, text, fetched_at FROM pages WHERE url = ?",
+            (key,),
+        ).fetchone()
+    if row is None:
+        return None
+    content_type, etag, last_modified, text, fetched_at = row
+    return {
+        "content_type": content_type,
+        "etag": etag,
+        "last_modified": last_modified,
+        "text": text,
+        "fetched_at": fetched_at,
+        "fresh": time.time() - fetched_at < FETCH_CACHE_MAX_AGE,
+    }
+
+def conditional_headers(entry):
+    """
+    Builds If-None-Match / If-Modified-Since headers for revalidating entry.
+    """
+    headers = {}
+    if entry and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry and entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+def record_hit(url, revalidated=False):
+    """
+    Marks a cached entry as used. A successful revalidation (304) also resets its age.
+    """
+    now = time.time()
+    key = canonical_url(url)
+    with _lock:
+        conn = _get_conn()
+        if revalidated:
+            conn.execute("UPDATE pages SET accessed_at = ?, fetched_at = ? WHERE url = ?", (now, now, key))
+            _stats["revalidated"] += 1
+        else:
+            conn.execute("UPDATE pages SET accessed_at = ? WHERE url = ?", (now, key))
+            _stats["hits"] += 1
+        conn.commit()
+
+def record_miss():
+    with _lock:
+        _stats["misses"] += 1
+
+def store(url, body, text, content_type="", etag=None, last_modified=None):
+    """
+    Persists raw bytes plus extracted text, then evicts LRU entries over the size cap.
+    """
+    now = time.time()
+    body = body or b""
+    text = text or ""
+    size = len(body) + len(text.encode("utf-8"))
+    with _lock:
+        conn = _get_conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (canonical_url(url), content_type, etag, last_modified, sqlite3.Binary(body), text, size, now, now),
+        )
+        _evict(conn)
+        conn.commit()
+
+def _evict(conn):
+    max_bytes = int(FETCH_CACHE_MAX_MB * 1024 * 1024)
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+    if total <= max_bytes:
+        return
+
+    rows = conn.execute("SELECT url, size FROM pages ORDER BY accessed_at ASC").fetchall()
+    for url, size in rows:
+        if total <= max_bytes:
+            break
+        conn.execute("DELETE FROM pages WHERE url = ?", (url,))
+        total -= size
+        _stats["evictions"] += 1
+
+def stats():
+    """
+    Returns a snapshot of the fetch cache counters for this process.
+    """
+    with _lock:
+        return dict(_stats)
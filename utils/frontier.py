@@ -0,0 +1,132 @@
+import os
+import threading
+from dotenv import load_dotenv
+from utils.dedup import NearDuplicateIndex
+from utils.fetch_cache import canonical_url
+from utils.search_cache import normalize_query
+
+load_dotenv()
+
+# --- Configuration ---
+# Totals across every discovery round of one run (first round included)
+FRONTIER_MAX_DOWNLOADS = int(os.getenv("FRONTIER_MAX_DOWNLOADS", "60"))
+FRONTIER_MAX_ANALYSES = int(os.getenv("FRONTIER_MAX_ANALYSES", "40"))
+# Deepening stops once a round adds fewer new documents than this...
+DEEPEN_MIN_NEW_DOCS = int(os.getenv("DEEPEN_MIN_NEW_DOCS", "2"))
+# ...or once fewer than this share of its downloads turned into new documents
+DEEPEN_MIN_YIELD = float(os.getenv("DEEPEN_MIN_YIELD", "0.25"))
+
+class ResearchFrontier:
+    """
+    Shared state for all discovery rounds of one run: queries already
+    issued, canonical URLs already fetched, documents already analyzed, the
+    near-duplicate index, and the remaining download/analysis budget.
+
+    Stage 2 consults it to skip repeat queries and URLs, Stage 3b to decide
+    whether another deepening round is worth its cost. Thread-safe.
+    """
+
+    def __init__(self, max_downloads=None, max_analyses=None):
+        self.max_downloads = FRONTIER_MAX_DOWNLOADS if max_downloads is None else max_downloads
+        self.max_analyses = FRONTIER_MAX_ANALYSES if max_analyses is None else max_analyses
+        self.dedup_index = NearDuplicateIndex()
+        self.queries = set()
+        self.urls = set()
+        self.analyzed_urls = set()
+        self.downloads = 0
+        self.analyses = 0
+        self.rounds = []
+        self._lock = threading.Lock()
+
+    def seed(self, documents, queries=True):
+        """
+        Registers documents processed before this frontier existed (e.g. the
+        checkpointed first round), charging them against the budget.
+        queries=False leaves their queries unclaimed, so a resumed round
+        still issues them for the results it had not reached yet.
+        """
+        self.dedup_index.add_documents(documents)
+        with self._lock:
+            for doc in documents:
+                url = canonical_url(doc['url']) if doc.get('url') else None
+                if url and url not in self.urls:
+                    self.urls.add(url)
+                    self.downloads += 1
+                if url and url not in self.analyzed_urls:
+                    self.analyzed_urls.add(url)
+                    self.analyses += 1
+                if queries and doc.get('query'):
+                    self.queries.add(normalize_query(doc['query']))
+
+    def claim_queries(self, queries):
+        """
+        Returns the queries not issued in an earlier round and marks them issued.
+        """
+        fresh = []
+        with self._lock:
+            for query in queries:
+                key = normalize_query(query)
+                if key not in self.queries:
+                    self.queries.add(key)
+                    fresh.append(query)
+        return fresh
+
+    def claim_downloads(self, items, limit=None):
+        """
+        Filters search results to unseen canonical URLs, within the remaining
+        download budget, and marks the survivors as fetched. Downloads that
+        could never be analyzed (analysis budget spent) are not claimed.
+        At most limit items are claimed, if given.
+        """
+        claimed = []
+        with self._lock:
+            analyses_left = self.max_analyses - self.analyses
+            for item in items:
+                url = canonical_url(item.get('link', ''))
+                if url in self.urls:
+                    continue
+                if self.downloads >= self.max_downloads or len(claimed) >= analyses_left:
+                    break
+                if limit is not None and len(claimed) >= limit:
+                    break
+                self.urls.add(url)
+                self.downloads += 1
+                claimed.append(item)
+        return claimed
+
+    def claim_analysis(self, doc):
+        """
+        True if doc may be sent to Stage 3: not analyzed before and within budget.
+        """
+        url = canonical_url(doc['url'])
+        with self._lock:
+            if url in self.analyzed_urls or self.analyses >= self.max_analyses:
+                return False
+            self.analyzed_urls.add(url)
+            self.analyses += 1
+            return True
+
+    def budget_left(self):
+        with self._lock:
+            return self.downloads < self.max_downloads and self.analyses < self.max_analyses
+
+    def record_round(self, downloads, new_docs):
+        """
+        Logs one round's marginal yield (new analyzed documents per download
+        attempted) and returns whether another round is worthwhile.
+        """
+        share = new_docs / downloads if downloads else 0.0
+        with self._lock:
+            self.rounds.append({"round": len(self.rounds) + 1, "downloads": downloads,
+                                "new_documents": new_docs, "yield": round(share, 2)})
+            summary = (f"  [Frontier] Round {len(self.rounds)}: {new_docs} new documents from {downloads} downloads "
+                       f"(yield {share:.0%}); budget used {self.downloads}/{self.max_downloads} downloads, "
+                       f"{self.analyses}/{self.max_analyses} analyses.")
+        print(summary)
+        if new_docs < DEEPEN_MIN_NEW_DOCS or share < DEEPEN_MIN_YIELD:
+            print("  [Frontier] Marginal yield too low. Stopping deepening.")
+            return False
+        if not self.budget_left():
+            print("  [Frontier] Budget exhausted. Stopping deepening.")
+            return False
+        return True
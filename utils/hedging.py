@@ -0,0 +1,129 @@
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import time
+
+# Successful-call latencies kept per (stage, model id) for deadline
+# estimation: short scoring calls must not set a generation call's deadline
+LATENCY_WINDOW = 50
+
+_latencies = {}
+_latency_lock = threading.Lock()
+
+# Shared pool for hedged calls. Losers keep running to completion in the
+# background (provider SDKs cannot be interrupted) but their result is ignored.
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hedge")
+
+def record_latency(stage, model_id, seconds):
+    key = (stage, model_id)
+    with _latency_lock:
+        if key not in _latencies:
+            _latencies[key] = deque(maxlen=LATENCY_WINDOW)
+        _latencies[key].append(seconds)
+
+def latency_quantile(stage, model_id, quantile, min_samples=5):
+    """
+    Returns the observed latency quantile for model_id's calls in stage, or
+    None when there are too few samples to trust it.
+    """
+    with _latency_lock:
+        samples = sorted(_latencies.get((stage, model_id), ()))
+    if len(samples) < min_samples:
+        return None
+    index = min(len(samples) - 1, int(round(quantile * (len(samples) - 1))))
+    return samples[index]
+
+def hedge_deadline(stage, model_id, policy):
+    """
+    Seconds to wait on model_id in stage before firing the next provider.
+    """
+    observed = latency_quantile(stage, model_id, policy.get("quantile", 0.9), policy.get("min_samples", 5))
+    deadline = observed if observed is not None else policy.get("default_deadline", 60)
+    return max(policy.get("min_deadline", 5), deadline)
+
+def is_valid_response(response):
+    # The offline caller reports failures as "Error: ..." strings instead of raising
+    return bool(response) and not response.startswith("Error:")
+
+def execute_hedged(strategies, prompt, model_ids, policy, breakers, stats=None, stage=None):
+    """
+    Runs the provider chain with hedging: the next provider is fired
+    concurrently when the current one fails or misses its p-quantile
+    deadline, and the first valid response wins.
+
+    breakers[i] may be None. Deadlines come from latencies observed in
+    stage. Returns (response, errors); response is None when every provider
+    failed. If a stats dict is passed, stats['model'] is
+    set to the model id that won.
+    """
+    errors = []
+    in_flight = {}
+    next_index = 0
+    deadline_at = None
+
+    def launch_next():
+        nonlocal next_index, deadline_at
+        while next_index < len(strategies):
+            i = next_index
+            next_index += 1
+            breaker = breakers[i]
+            if breaker and not breaker.allow():
+                errors.append(f"{breaker.name}: circuit open")
+                continue
+            started = time.time()
+            future = _executor.submit(strategies[i], prompt)
+            # Outcome is recorded even for losers that finish after we return,
+            # so a half-open breaker probe is never left dangling.
+            future.add_done_callback(lambda f, i=i, started=started: _settle(f, i, started))
+            in_flight[future] = (i, started)
+            deadline_at = started + hedge_deadline(stage, model_ids[i], policy)
+            return True
+        deadline_at = None
+        return False
+
+    def _settle(future, i, started):
+        if future.cancelled():
+            return
+        breaker = breakers[i]
+        error = future.exception()
+        if error is not None:
+            if breaker:
+                breaker.record_failure(error)
+            return
+        if breaker:
+            breaker.record_success()
+        record_latency(stage, model_ids[i], time.time() - started)
+
+    launch_next()
+    while in_flight:
+        timeout = max(0.0, deadline_at - time.time()) if deadline_at else None
+        done, _ = wait(list(in_flight), timeout=timeout, return_when=FIRST_COMPLETED)
+
+        if not done:
+            # Primary is slow: hedge with the next provider, keep waiting on both
+            i, _ = in_flight[next(iter(in_flight))]
+            if launch_next():
+                print(f"  [Hedge] {model_ids[i]} past deadline, racing {model_ids[next_index - 1]}...")
+            continue
+
+        for future in done:
+            i, _ = in_flight.pop(future)
+            try:
+                response = future.result()
+            except Exception as e:
+                errors.append(str(e))
+                continue
+
+            if is_valid_response(response):
+                for loser in in_flight:
+                    loser.cancel()
+                if stats is not None:
+                    stats['model'] = model_ids[i]
+                return response, errors
+            errors.append(f"{model_ids[i]}: invalid response")
+
+        if not in_flight:
+            # Everything in flight failed outright: move on without waiting for a deadline
+            launch_next()
+
+    return None, errors
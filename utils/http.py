@@ -0,0 +1,82 @@
+import os
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Configuration ---
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))
+# Simultaneous requests to a single host (fairness towards repositories/mirrors)
+HTTP_PER_HOST_LIMIT = int(os.getenv("HTTP_PER_HOST_LIMIT", "2"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "10"))
+# Simultaneous requests across all hosts, shared by every pipeline in the process
+HTTP_MAX_CONCURRENCY = int(os.getenv("HTTP_MAX_CONCURRENCY", "16"))
+# Retries on connection errors only; HTTP error statuses are returned as-is
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+
+DEFAULT_TIMEOUT = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+
+_session = None
+_session_lock = threading.Lock()
+_host_slots = {}
+_host_lock = threading.Lock()
+_global_slots = threading.BoundedSemaphore(HTTP_MAX_CONCURRENCY)
+
+def get_session():
+    """
+    Process-wide keep-alive session shared by search and fetch, so repeated
+    requests to the same host reuse TCP/TLS connections.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=HTTP_RETRIES,
+                connect=HTTP_RETRIES,
+                read=0,
+                status=0,
+                backoff_factor=0.5,
+            )
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+def _host_semaphore(url):
+    host = urlsplit(url).netloc.lower()
+    with _host_lock:
+        if host not in _host_slots:
+            _host_slots[host] = threading.BoundedSemaphore(HTTP_PER_HOST_LIMIT)
+        return _host_slots[host]
+
+@contextmanager
+def host_slot(url):
+    """
+    Holds one of the HTTP_PER_HOST_LIMIT slots for url's host (and one of the
+    global HTTP_MAX_CONCURRENCY slots) for the duration of the block,
+    including streamed body reads. The host slot is taken first, so threads
+    queued behind a busy host do not hold global slots other hosts could use.
+    """
+    with _host_semaphore(url), _global_slots:
+        yield
+
+def get(url, timeout=None, per_host_limit=True, **kwargs):
+    """
+    GET through the pooled session. Callers streaming the body should wrap
+    the read in host_slot(url) themselves; this helper only covers the request.
+    API endpoints with their own quota (e.g. Custom Search) can opt out of
+    the per-host limit with per_host_limit=False; they still take a global slot.
+    """
+    if not per_host_limit:
+        with _global_slots:
+            return get_session().get(url, timeout=timeout or DEFAULT_TIMEOUT, **kwargs)
+    with host_slot(url):
+        return get_session().get(url, timeout=timeout or DEFAULT_TIMEOUT, **kwargs)
@@ -0,0 +1,124 @@
+import re
+import json
+
+# Complete candidates tried per response before giving up
+MAX_CANDIDATES = 20
+
+_CLOSERS = {"{": "}", "[": "]"}
+
+def _scan(text, start):
+    """
+    Walks a JSON value opening at text[start] and returns (end, stack): the
+    index of its matching close bracket (stack empty), or (None, stack) with
+    the brackets still open if text ends first. Brackets inside strings are
+    ignored.
+    """
+    stack = []
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append(ch)
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+            if not stack:
+                return i, []
+    if in_string:
+        stack.append('"')
+    return None, stack
+
+def _candidates(text):
+    """
+    Yields every top-level balanced {...} / [...] fragment in text, left to
+    right. A fragment cut off by the end of the text (a truncated response)
+    is yielded last, with its open strings and brackets closed.
+    """
+    i = 0
+    tried = 0
+    while i < len(text) and tried < MAX_CANDIDATES:
+        if text[i] not in "{[":
+            i += 1
+            continue
+        end, stack = _scan(text, i)
+        if end is None:
+            closing = "".join('"' if c == '"' else _CLOSERS[c] for c in reversed(stack))
+            yield text[i:].rstrip().rstrip(",") + closing
+            return
+        tried += 1
+        yield text[i:end + 1]
+        # Never descend into a fragment that failed: a nested object parsed
+        # on its own (e.g. one section review) would pass for the whole answer
+        i = end + 1
+
+def repair_json(fragment):
+    """
+    Tolerant fixes for the usual LLM slips: smart quotes, trailing commas,
+    missing commas between objects, Python literals and single-quoted JSON.
+    """
+    text = fragment.replace("“", '"').replace("”", '"')
+    text = re.sub(r",\s*([}\]])", r"\1", text)
+    text = re.sub(r"}\s*{", "},{", text)
+    text = re.sub(r"([:\[,]\s*)True\b", r"\1true", text)
+    text = re.sub(r"([:\[,]\s*)False\b", r"\1false", text)
+    text = re.sub(r"([:\[,]\s*)None\b", r"\1null", text)
+    if '"' not in text:
+        text = text.replace("'", '"')
+    return text
+
+def _loads(fragment):
+    for attempt in (fragment, repair_json(fragment)):
+        try:
+            # strict=False allows raw newlines/control characters inside strings
+            return json.loads(attempt, strict=False)
+        except ValueError:
+            continue
+    raise ValueError("unparsable")
+
+def _values(text):
+    """
+    Every parsable top-level JSON value in text, left to right.
+    """
+    if not text:
+        return
+    for fragment in _candidates(text):
+        try:
+            yield _loads(fragment)
+        except ValueError:
+            continue
+
+def extract_json(text, expect=None):
+    """
+    Returns the first JSON value embedded in an LLM response (prose, code
+    fences and truncation tolerated), or None. expect=dict / list skips
+    values of the other type.
+    """
+    for value in _values(text):
+        if expect is None or isinstance(value, expect):
+            return value
+    return None
+
+def extract_json_list(text, key):
+    """
+    A JSON list wrapped in an object under key (JSON mode only allows
+    objects at the top level), or else the first bare list. An object
+    with the key wins over an earlier bare list, which is more likely a
+    stray "[1]" in the prose. Returns [] if absent.
+    """
+    bare = None
+    for value in _values(text):
+        if isinstance(value, dict) and isinstance(value.get(key), list):
+            return value[key]
+        if bare is None and isinstance(value, list):
+            bare = value
+    return bare if bare is not None else []
@@ -0,0 +1,121 @@
+import os
+from dotenv import load_dotenv
+from utils.tokens import estimate_tokens
+
+load_dotenv()
+
+# --- Configuration ---
+# Upper bound on the packed knowledge base, even for large-context providers:
+# beyond this, extra sources slow synthesis more than they improve it.
+KB_MAX_TOKENS = int(os.getenv("KB_MAX_TOKENS", "6000"))
+# Per-field character cap, so one verbose analysis cannot crowd out the rest
+KB_FIELD_CHARS = int(os.getenv("KB_FIELD_CHARS", "600"))
+
+# Analysis fields kept in the packed form, with their abbreviations.
+# technical_depth_score / missing_entities are scoring aids, not synthesis input.
+FIELDS = [
+    ("research_problem", "P"),
+    ("methodology", "M"),
+    ("key_findings", "F"),
+    ("limitations", "L"),
+    ("research_gaps", "G"),
+    ("novelty_assessment", "N"),
+]
+LEGEND = ("Sources are ranked by quality score. Fields: P=problem, M=methodology, F=findings, "
+          "L=limitations, G=gaps, N=novelty, +=strengths, -=weaknesses.")
+
+def _score(entry):
+    try:
+        return float(entry.get("score") or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+def rank_entries(knowledge_base):
+    """
+    Knowledge-base entries ordered by Stage 4 score (stable for ties), each
+    paired with its citation id: [("S1", entry), ...].
+    """
+    ranked = sorted(knowledge_base, key=_score, reverse=True)
+    return [(f"S{i}", entry) for i, entry in enumerate(ranked, 1)]
+
+def _clip(value, limit=None):
+    limit = limit or KB_FIELD_CHARS
+    text = " ".join(str(value).split())
+    return text if len(text) <= limit else text[:limit - 3].rstrip() + "..."
+
+def _header(sid, entry):
+    score = entry.get("score")
+    score_part = f" (score {score:g})" if isinstance(score, (int, float)) else ""
+    return f"[{sid}] {_clip(entry.get('source_title', 'Untitled'), 200)}{score_part}"
+
+def _full_form(sid, entry):
+    analysis = entry.get("analysis")
+    lines = [_header(sid, entry)]
+    if isinstance(analysis, dict):
+        for key, abbrev in FIELDS:
+            value = analysis.get(key)
+            if value and str(value).strip().upper() not in ("N/A", "NONE"):
+                lines.append(f"{abbrev}: {_clip(value)}")
+    elif analysis:
+        lines.append(f"F: {_clip(analysis)}")
+    if entry.get("strengths"):
+        lines.append(f"+: {_clip(entry['strengths'], 300)}")
+    if entry.get("weaknesses"):
+        lines.append(f"-: {_clip(entry['weaknesses'], 300)}")
+    return "\n".join(lines)
+
+def _short_form(sid, entry):
+    """
+    One-line summary used for the tail once full entries no longer fit.
+    """
+    analysis = entry.get("analysis")
+    findings = analysis.get("key_findings") if isinstance(analysis, dict) else analysis
+    line = _header(sid, entry)
+    return f"{line} F: {_clip(findings, 200)}" if findings else line
+
+def pack_knowledge_base(knowledge_base, budget_tokens):
+    """
+    Serializes the knowledge base for a prompt within budget_tokens. Sources
+    are added best-first in full form; once the next one does not fit, the
+    remainder is summarized to one line each, and whatever still does not
+    fit is dropped. Returns (text, stats).
+    """
+    blocks = [LEGEND]
+    used = estimate_tokens(LEGEND)
+    stats = {"full": 0, "summarized": 0, "dropped": 0}
+    summarizing = False
+    for sid, entry in rank_entries(knowledge_base):
+        if not summarizing:
+            block = _full_form(sid, entry)
+            cost = estimate_tokens(block)
+            if used + cost <= budget_tokens:
+                blocks.append(block)
+                used += cost
+                stats["full"] += 1
+                continue
+            summarizing = True
+        block = _short_form(sid, entry)
+        cost = estimate_tokens(block)
+        if used + cost <= budget_tokens:
+            blocks.append(block)
+            used += cost
+            stats["summarized"] += 1
+        else:
+            stats["dropped"] += 1
+    stats["tokens"] = used
+    return "\n\n".join(blocks), stats
+
+def reference_block(knowledge_base):
+    """
+    '[S#] Title (url)' lines with the same ids as pack_knowledge_base, so
+    citations in the synthesis carry over to the paper.
+    """
+    return "\n".join(f"[{sid}] {entry['source_title']} ({entry['url']})" for sid, entry in rank_entries(knowledge_base))
+
+def knowledge_budget(context_tokens, prompt_overhead, reserve_tokens):
+    """
+    Tokens available for the packed knowledge base: the stage's context
+    window minus the rest of the prompt and room for the answer, capped at
+    KB_MAX_TOKENS.
+    """
+    return max(0, min(KB_MAX_TOKENS, context_tokens - prompt_overhead - reserve_tokens))
@@ -5,7 +5,14 @@ import google.generativeai as genai
 from groq import Groq
 from anthropic import Anthropic, NotFoundError
 from dotenv import load_dotenv
-from utils.llm_offline import query_offline_llm
+from utils.llm_offline import query_offline_llm, stream_offline_llm
+from utils import llm_cache
+from utils import cassette
+from utils.circuit_breaker import get_breaker
+from utils.concurrency import is_congestion_error, note_congestion
+from utils import rate_limit
+from utils.hedging import execute_hedged, record_latency
+from utils.tracing import traced_provider, record_llm_request
 
 load_dotenv()
 
@@ -23,12 +30,14 @@ anthropic_client = Anthropic(api_key=ANTHROPIC_API_KEY) if ANTHROPIC_API_KEY els
 
 # --- Internal Callers ---
 
-def _call_gemini(prompt):
+@traced_provider("gemini")
+def _call_gemini(prompt, json_mode=False):
     if not GEMINI_API_KEY:
         raise ValueError("GEMINI_API_KEY not found.")
     
     # Updated to gemini-2.0-flash based on available models
-    model = genai.GenerativeModel('gemini-2.0-flash')
+    generation_config = {"response_mime_type": "application/json"} if json_mode else None
+    model = genai.GenerativeModel('gemini-2.0-flash', generation_config=generation_config)
     
     # Simple retry logic for ResourceExhausted or other transient errors
     # Reduced retries for faster failover to other models/offline
@@ -37,9 +46,12 @@ def _call_gemini(prompt):
     
     for attempt in range(max_retries):
         try:
-            response = model.generate_content(prompt)
+            rate_limit.acquire("gemini", prompt)
+            with rate_limit.call_slot():
+                response = model.generate_content(prompt)
             if not response.text:
                 raise ValueError("Gemini returned empty response.")
+            rate_limit.record_completion("gemini", response.text)
             return response.text
         except Exception as e:
             # Check if it's a quota error (429/ResourceExhausted)
@@ -51,51 +63,137 @@ def _call_gemini(prompt):
                     continue
             raise e  # smooth failover to next model if retries exhausted or other error
 
-def _call_groq(prompt):
+@traced_provider("groq")
+def _call_groq(prompt, json_mode=False):
     if not groq_client:
         raise ValueError("GROQ_API_KEY not found or client init failed.")
     
     # Updated to llama-3.3-70b-versatile
-    try:
+    # Pacing happens up front via the shared limiter; a 429 that still slips
+    # through fails over immediately and opens the circuit breaker.
+    rate_limit.acquire("groq", prompt)
+    # JSON mode guarantees a parsable top-level object (the prompt must mention JSON)
+    extra = {"response_format": {"type": "json_object"}} if json_mode else {}
+    with rate_limit.call_slot():
         chat_completion = groq_client.chat.completions.create(
             messages=[{"role": "user", "content": prompt}],
             model="llama-3.3-70b-versatile",
+            **extra,
         )
-        return chat_completion.choices[0].message.content
-    except Exception as e:
-        if "429" in str(e): # Rate limit
-             # For Groq free tier, limits can be long (minutes). 
-             # Better to failover immediately unless it's very short, 
-             # but we can try a short sleep just in case.
-             time.sleep(2) 
-        raise e
-
-def _call_anthropic(prompt):
+    content = chat_completion.choices[0].message.content
+    rate_limit.record_completion("groq", content)
+    return content
+
+@traced_provider("anthropic")
+def _call_anthropic(prompt, json_mode=False):
     if not anthropic_client:
         raise ValueError("ANTHROPIC_API_KEY not found or client init failed.")
     
+    messages = [{"role": "user", "content": prompt}]
+    # No native JSON mode: prefill the answer with "{" so it starts as an object
+    prefill = "{" if json_mode else ""
+    if prefill:
+        messages.append({"role": "assistant", "content": prefill})
+    
     # Updated: Try Claude 3.5 Sonnet (June version) then Haiku (most widely available)
     model_id = "claude-3-5-sonnet-20240620" 
     
     try:
-        message = anthropic_client.messages.create(
-            max_tokens=4096,
-            messages=[{"role": "user", "content": prompt}],
-            model=model_id, 
-        )
-        return message.content[0].text
-    except NotFoundError:
-        # Fallback to Haiku which is usually available to all tiers
-        try:
+        rate_limit.acquire("anthropic", prompt)
+        with rate_limit.call_slot():
             message = anthropic_client.messages.create(
                 max_tokens=4096,
-                messages=[{"role": "user", "content": prompt}],
-                model="claude-3-haiku-20240307", 
+                messages=messages,
+                model=model_id, 
             )
-            return message.content[0].text
+        rate_limit.record_completion("anthropic", message.content[0].text)
+        return prefill + message.content[0].text
+    except NotFoundError:
+        # Fallback to Haiku which is usually available to all tiers
+        try:
+            rate_limit.acquire("anthropic", prompt)
+            with rate_limit.call_slot():
+                message = anthropic_client.messages.create(
+                    max_tokens=4096,
+                    messages=messages,
+                    model="claude-3-haiku-20240307", 
+                )
+            rate_limit.record_completion("anthropic", message.content[0].text)
+            return prefill + message.content[0].text
         except Exception as e:
             raise e
 
+# --- Streaming Callers ---
+# Generators yielding the answer chunk by chunk. Closing one early (e.g. a
+# length budget was hit) closes the underlying HTTP stream.
+
+@traced_provider("gemini")
+def _stream_gemini(prompt):
+    if not GEMINI_API_KEY:
+        raise ValueError("GEMINI_API_KEY not found.")
+
+    model = genai.GenerativeModel('gemini-2.0-flash')
+    rate_limit.acquire("gemini", prompt)
+    parts = []
+    try:
+        with rate_limit.call_slot():
+            for chunk in model.generate_content(prompt, stream=True):
+                text = chunk.text if chunk.parts else ""
+                if text:
+                    parts.append(text)
+                    yield text
+    finally:
+        rate_limit.record_completion("gemini", "".join(parts))
+
+@traced_provider("groq")
+def _stream_groq(prompt):
+    if not groq_client:
+        raise ValueError("GROQ_API_KEY not found or client init failed.")
+
+    rate_limit.acquire("groq", prompt)
+    parts = []
+    with rate_limit.call_slot():
+        stream = groq_client.chat.completions.create(
+            messages=[{"role": "user", "content": prompt}],
+            model="llama-3.3-70b-versatile",
+            stream=True,
+        )
+        try:
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    yield delta
+        finally:
+            stream.close()
+            rate_limit.record_completion("groq", "".join(parts))
+
+@traced_provider("anthropic")
+def _stream_anthropic(prompt):
+    if not anthropic_client:
+        raise ValueError("ANTHROPIC_API_KEY not found or client init failed.")
+
+    # Same model preference as _call_anthropic: Sonnet, then Haiku if unavailable
+    models = ["claude-3-5-sonnet-20240620", "claude-3-haiku-20240307"]
+    for i, model_id in enumerate(models):
+        rate_limit.acquire("anthropic", prompt)
+        parts = []
+        try:
+            with rate_limit.call_slot(), anthropic_client.messages.stream(
+                max_tokens=4096,
+                messages=[{"role": "user", "content": prompt}],
+                model=model_id,
+            ) as stream:
+                for text in stream.text_stream:
+                    parts.append(text)
+                    yield text
+            return
+        except NotFoundError:
+            if parts or i == len(models) - 1:
+                raise
+        finally:
+            rate_limit.record_completion("anthropic", "".join(parts))
+
 # --- Main Logic ---
 
 # --- Stage Configuration ---
@@ -126,35 +224,161 @@ STAGE_CONFIG = {
     "generation": ["anthropic", "groq", "ollama:llama3.2"]
 }
 
-def _resolve_strategy(model_id):
+# Optional hedging policy per STAGE_CONFIG entry. If the current provider has
+# not answered within its observed latency quantile (or default_deadline until
+# enough samples exist), the next provider in the chain is fired concurrently
+# and the first valid response wins. Stages not listed run strictly in order.
+STAGE_HEDGING = {
+    "synthesis": {"quantile": 0.9, "default_deadline": 90, "min_deadline": 20},
+    "generation": {"quantile": 0.9, "default_deadline": 120, "min_deadline": 30},
+}
+
+# Approximate usable context window (tokens) per provider. Ollama's depends on
+# the num_ctx the local model was started with, so it is configurable.
+CONTEXT_WINDOWS = {
+    "groq": 128000,
+    "anthropic": 200000,
+    "gemini": 1000000,
+    "ollama": int(os.getenv("OLLAMA_CONTEXT_TOKENS", "8192")),
+}
+
+def stage_context_tokens(stage):
+    """
+    Smallest context window across a stage's provider chain: a prompt has to
+    fit whichever provider ends up answering it, including the fallbacks.
+    """
+    model_chain = STAGE_CONFIG.get(stage, STAGE_CONFIG['default'])
+    windows = [CONTEXT_WINDOWS.get(_provider_name(m), CONTEXT_WINDOWS["ollama"]) for m in model_chain]
+    return min(windows) if windows else CONTEXT_WINDOWS["ollama"]
+
+# Extra providers registered at runtime (e.g. the benchmark's fake provider).
+# Maps a model-id prefix to a factory: factory(model_id) -> callable(prompt).
+PROVIDER_REGISTRY = {}
+# Set by use_replay(): a cassette miss must not fall through to a live model
+_replay_only = False
+
+def register_provider(prefix, factory):
+    """
+    Makes model ids of the form '<prefix>' or '<prefix>:<arg>' resolvable in
+    STAGE_CONFIG without touching the built-in callers.
+    """
+    PROVIDER_REGISTRY[prefix] = factory
+
+# 'replay' / 'replay:<path>' serve recorded answers from a cassette file
+register_provider("replay", cassette.replay_strategy)
+
+def use_replay(path=None):
+    """
+    Routes every stage to the replay provider, so a recorded run can be
+    re-executed without network access. The offline (Ollama) fallback is
+    disabled, so a cassette miss raises instead of querying a live model.
+    """
+    global _replay_only
+    _replay_only = True
+    model_id = f"replay:{path}" if path else "replay"
+    for stage in STAGE_CONFIG:
+        STAGE_CONFIG[stage] = [model_id]
+
+def _resolve_strategy(model_id, json_mode=False):
     """
     Returns a callable (function) for a given model_id string.
+    json_mode asks the provider for its native JSON output mode; registered
+    providers do not receive it.
     """
+    prefix = model_id.split(':', 1)[0]
+    if prefix in PROVIDER_REGISTRY:
+        return traced_provider(prefix)(PROVIDER_REGISTRY[prefix](model_id))
     if model_id == 'groq':
-        return lambda p: _call_groq(p)
+        return lambda p: _call_groq(p, json_mode=json_mode)
     elif model_id == 'anthropic':
-        return lambda p: _call_anthropic(p)
+        return lambda p: _call_anthropic(p, json_mode=json_mode)
     elif model_id == 'gemini':
-         return lambda p: _call_gemini(p)
+         return lambda p: _call_gemini(p, json_mode=json_mode)
     elif model_id.startswith('ollama:'):
         # Specific offline/cloud model
         model_name = model_id.split(':', 1)[1]
-        return lambda p: query_offline_llm(p, model_name=model_name)
+        return lambda p: query_offline_llm(p, model_name=model_name, json_mode=json_mode)
     else:
         # Default to offline if unknown
-        return lambda p: query_offline_llm(p)
+        return lambda p: query_offline_llm(p, json_mode=json_mode)
 
-def execute_strategies(strategies, prompt):
+def _resolve_stream_strategy(model_id):
+    """
+    Streaming counterpart of _resolve_strategy: returns a callable yielding
+    text chunks. Registered providers have no streaming API and yield their
+    whole answer at once.
+    """
+    prefix = model_id.split(':', 1)[0]
+    if prefix in PROVIDER_REGISTRY:
+        strategy = _resolve_strategy(model_id)
+        return lambda p: iter([strategy(p)])
+    if model_id == 'groq':
+        return _stream_groq
+    elif model_id == 'anthropic':
+        return _stream_anthropic
+    elif model_id == 'gemini':
+        return _stream_gemini
+    elif model_id.startswith('ollama:'):
+        model_name = model_id.split(':', 1)[1]
+        return lambda p: stream_offline_llm(p, model_name=model_name)
+    else:
+        return lambda p: stream_offline_llm(p)
+
+def _with_llm_slot(model_id, func):
+    """
+    Built-in providers take rate_limit.call_slot() themselves, after any
+    budget wait; registered providers (fake, replay) are wrapped here.
+    """
+    if model_id.split(':', 1)[0] not in PROVIDER_REGISTRY:
+        return func
+    def call(prompt):
+        with rate_limit.call_slot():
+            return func(prompt)
+    return call
+
+def _provider_name(model_id):
+    """
+    Circuit-breaker key for a model id ('ollama:llama3.2' -> 'ollama').
+    """
+    return model_id.split(':', 1)[0]
+
+def execute_strategies(strategies, prompt, model_ids=None, stats=None, json_mode=False, stage=None):
     """
     Executes a list of strategy functions in order.
+    When model_ids is given, providers whose circuit breaker is open are
+    skipped instantly instead of being retried on every call.
+    If a stats dict is passed, stats['fallbacks'] is set to the number of
+    providers that failed or were skipped before one answered, and
+    stats['model'] to the model id that answered (OFFLINE_MODEL_ID for the
+    offline fallback). Latencies are recorded under stage for hedging.
     """
     errors = []
+    if stats is not None:
+        stats['fallbacks'] = 0
     for i, func in enumerate(strategies):
+        breaker = get_breaker(_provider_name(model_ids[i])) if model_ids else None
+        if stats is not None:
+            stats['fallbacks'] = i
+        if breaker and not breaker.allow():
+            errors.append(f"{breaker.name}: circuit open")
+            continue
         try:
              # print(f"  [Strategy {i+1}] Executing...") 
-             return func(prompt)
+             started = time.time()
+             response = func(prompt)
+             if breaker:
+                 breaker.record_success()
+             if model_ids:
+                 record_latency(stage, model_ids[i], time.time() - started)
+                 if stats is not None:
+                     stats['model'] = model_ids[i]
+             return response
         except Exception as e:
             errors.append(str(e))
+            if breaker:
+                breaker.record_failure(e)
+            if is_congestion_error(e):
+                note_congestion("llm")
             from termcolor import colored
             
             error_msg = str(e)
@@ -168,27 +392,162 @@ def execute_strategies(strategies, prompt):
             # print(colored(f"  [Fallback] Transferring context...", "yellow"))
             continue
             
+    if stats is not None:
+        stats['model'] = OFFLINE_MODEL_ID
+    return _offline_fallback(prompt, errors, json_mode)
+
+# Cache/model id recorded for answers from the generic offline fallback
+OFFLINE_MODEL_ID = "offline"
+
+def _offline_fallback(prompt, errors, json_mode=False):
+    if _replay_only:
+        raise LookupError(f"Cassette miss in replay mode (no live fallback). Errors: {errors}")
     # Fallback to generic offline if enabled and not already tried
     enable_offline = os.getenv("ENABLE_OFFLINE_FALLBACK", "True").lower() == "true"
     if enable_offline:
         try:
-            return query_offline_llm(prompt)
+            return query_offline_llm(prompt, json_mode=json_mode)
         except Exception as e:
             errors.append(f"Offline Default: {e}")
             
     raise Exception(f"All strategies failed. Errors: {errors}")
 
-def query_stage(stage, prompt):
+def _cache_key(stage, model_id, prompt, prompt_version, json_mode=False):
+    return llm_cache.make_key(stage, model_id + (";json" if json_mode else ""), prompt, prompt_version)
+
+def _cache_lookup(stage, model_chain, prompt, prompt_version, json_mode=False):
+    """
+    Answers are cached under the model that produced them. Returns the
+    cached answer of the first model in the chain that has one, but never
+    looks past a model that is currently available: once the primary
+    recovers, answers cached from its fallbacks stop being served.
+    """
+    for model_id in model_chain:
+        cached = llm_cache.get(_cache_key(stage, model_id, prompt, prompt_version, json_mode))
+        if cached is not None:
+            return cached
+        if not get_breaker(_provider_name(model_id)).is_open():
+            return None
+    return llm_cache.get(_cache_key(stage, OFFLINE_MODEL_ID, prompt, prompt_version, json_mode))
+
+def query_stage(stage, prompt, use_cache=True, prompt_version=None, json_mode=False):
     """
     Primary Entry Point for Stage-based LLM routing.
+    Responses are served from / written to the on-disk cache unless
+    use_cache=False or LLM_CACHE_DISABLED is set, keyed by the model that
+    answered (see _cache_lookup).
+    json_mode requests each provider's native JSON output (the prompt must
+    ask for a JSON object); it is part of the cache key.
     """
     # Get config for stage, or default
     model_chain = STAGE_CONFIG.get(stage, STAGE_CONFIG['default'])
     
+    use_cache = use_cache and llm_cache.is_enabled()
+    if use_cache:
+        cached = _cache_lookup(stage, model_chain, prompt, prompt_version, json_mode)
+        if cached is not None:
+            record_llm_request(stage, cache_hit=True)
+            cassette.record(stage, prompt, cached, cache_hit=True)
+            return cached
+    
     # Resolve to functions
-    strategies = [_resolve_strategy(m) for m in model_chain]
+    strategies = [_with_llm_slot(m, _resolve_strategy(m, json_mode)) for m in model_chain]
+    
+    started = time.time()
+    hedging = STAGE_HEDGING.get(stage)
+    stats = {}
+    if hedging and os.getenv("LLM_HEDGING_DISABLED", "False").lower() != "true":
+        breakers = [get_breaker(_provider_name(m)) for m in model_chain]
+        response, errors = execute_hedged(strategies, prompt, model_chain, hedging, breakers, stats=stats, stage=stage)
+        fallbacks = len(errors)
+        if response is None:
+            stats['model'] = OFFLINE_MODEL_ID
+            response = _offline_fallback(prompt, errors, json_mode)
+    else:
+        response = execute_strategies(strategies, prompt, model_ids=model_chain, stats=stats, json_mode=json_mode, stage=stage)
+        fallbacks = stats.get('fallbacks', 0)
+    record_llm_request(stage, fallbacks=fallbacks)
+    cassette.record(stage, prompt, response, latency_s=time.time() - started)
     
-    return execute_strategies(strategies, prompt)
+    if use_cache:
+        answered_by = stats.get('model', OFFLINE_MODEL_ID)
+        llm_cache.put(_cache_key(stage, answered_by, prompt, prompt_version, json_mode), stage, answered_by, response)
+    return response
+
+def query_stage_stream(stage, prompt, use_cache=True, prompt_version=None):
+    """
+    Streaming variant of query_stage: yields the answer in chunks as the
+    provider produces them, so callers can show output immediately or stop
+    early by closing the generator (which aborts the provider call).
+
+    Providers are tried in STAGE_CONFIG order until one starts producing
+    output. A failure after output has started is raised, since the caller
+    has already consumed part of the answer. Only complete answers are
+    cached. Hedging does not apply to streamed calls.
+    """
+    model_chain = STAGE_CONFIG.get(stage, STAGE_CONFIG['default'])
+
+    use_cache = use_cache and llm_cache.is_enabled()
+    if use_cache:
+        cached = _cache_lookup(stage, model_chain, prompt, prompt_version)
+        if cached is not None:
+            record_llm_request(stage, cache_hit=True)
+            cassette.record(stage, prompt, cached, cache_hit=True)
+            yield cached
+            return
+
+    started = time.time()
+    errors = []
+    for i, model_id in enumerate(model_chain):
+        breaker = get_breaker(_provider_name(model_id))
+        if not breaker.allow():
+            errors.append(f"{breaker.name}: circuit open")
+            continue
+        parts = []
+        call_started = time.time()
+        try:
+            # Built-in streams hold a call slot while open; registered
+            # providers answer in one piece, so a slot around the call suffices
+            chunks = _with_llm_slot(model_id, _resolve_stream_strategy(model_id))(prompt)
+            try:
+                for chunk in chunks:
+                    if chunk:
+                        parts.append(chunk)
+                        yield chunk
+            finally:
+                if hasattr(chunks, "close"):
+                    chunks.close()
+            if not parts:
+                raise ValueError(f"{model_id} returned an empty stream.")
+        except GeneratorExit:
+            # Closed by the caller: the provider was healthy, the answer is just partial
+            breaker.record_success()
+            raise
+        except Exception as e:
+            breaker.record_failure(e)
+            if is_congestion_error(e):
+                note_congestion("llm")
+            if parts:
+                raise
+            errors.append(str(e))
+            print(f"  [Stream] {model_id} failed before any output: {str(e)[:80]}. Switching...")
+            continue
+
+        breaker.record_success()
+        record_latency(stage, model_id, time.time() - call_started)
+        record_llm_request(stage, fallbacks=i)
+        response = "".join(parts)
+        cassette.record(stage, prompt, response, latency_s=time.time() - started)
+        if use_cache:
+            llm_cache.put(_cache_key(stage, model_id, prompt, prompt_version), stage, model_id, response)
+        return
+
+    response = _offline_fallback(prompt, errors)
+    record_llm_request(stage, fallbacks=len(model_chain))
+    cassette.record(stage, prompt, response, latency_s=time.time() - started)
+    if use_cache:
+        llm_cache.put(_cache_key(stage, OFFLINE_MODEL_ID, prompt, prompt_version), stage, OFFLINE_MODEL_ID, response)
+    yield response
 
 # --- Deprecated / Compatibility ---
 
@@ -198,12 +557,12 @@ def query_llm_robust(prompt, primary_preference=None, use_heavy_fallback=True):
     """
     return query_stage("default", prompt)
 
-def query_gemini(prompt, retries=1, delay=0, fallback_to_others=False):
+def query_gemini(prompt, retries=1, delay=0, fallback_to_others=False, json_mode=False):
     # Map legacy calls to appropriate stages based on fallback flag
     # If fallback_to_others is False (usually analysis), use 'analysis' stage
     if not fallback_to_others:
-        return query_stage("analysis", prompt)
-    return query_stage("default", prompt)
+        return query_stage("analysis", prompt, json_mode=json_mode)
+    return query_stage("default", prompt, json_mode=json_mode)
 
 def query_groq(prompt, json_mode=False, fallback_to_others=True):
-    return query_stage("scoring", prompt)
+    return query_stage("scoring", prompt, json_mode=json_mode)
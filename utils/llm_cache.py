@@ -0,0 +1,129 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Configuration ---
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", ".cache/llm_cache.sqlite")
+LLM_CACHE_MAX_MB = float(os.getenv("LLM_CACHE_MAX_MB", "200"))
+# Seconds before an entry is considered stale. 0 disables expiry.
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_DISABLED = os.getenv("LLM_CACHE_DISABLED", "False").lower() == "true"
+
+# Bump when prompt templates or response post-processing change meaning,
+# so stale answers from older templates are never served.
+PROMPT_TEMPLATE_VERSION = "1"
+
+_lock = threading.Lock()
+_conn = None
+_stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+def _get_conn():
+    global _conn
+    if _conn is None:
+        cache_dir = os.path.dirname(LLM_CACHE_PATH)
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+        # Shared across Stage 2/3 worker threads; access is serialized by _lock.
+        _conn = sqlite3.connect(LLM_CACHE_PATH, check_same_thread=False)
+        _conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                stage TEXT,
+                model_id TEXT,
+                response TEXT,
+                size INTEGER,
+                created_at REAL,
+                accessed_at REAL
+            )
+        """)
+        _conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON responses(accessed_at)")
+        _conn.commit()
+    return _conn
+
+def make_key(stage, model_id, prompt, prompt_version=None):
+    """
+    Content-addressed key over (stage, model id, prompt hash, template version).
+    """
+    version = prompt_version or PROMPT_TEMPLATE_VERSION
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    raw = f"{stage}\x00{model_id}\x00{prompt_hash}\x00{version}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def is_enabled():
+    return not LLM_CACHE_DISABLED
+
+def get(key):
+    """
+    Returns the cached response for key, or None on miss/expiry.
+    """
+    now = time.time()
+    with _lock:
+        conn = _get_conn()
+        row = conn.execute(
+            "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            _stats["misses"] += 1
+            return None
+
+        response, created_at = row
+        if LLM_CACHE_TTL > 0 and now - created_at > LLM_CACHE_TTL:
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            conn.commit()
+            _stats["misses"] += 1
+            return None
+
+        # Touch for LRU ordering
+        conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        conn.commit()
+        _stats["hits"] += 1
+        return response
+
+def put(key, stage, model_id, response):
+    """
+    Stores a response and evicts least-recently-used entries over the size cap.
+    """
+    if not response or response.startswith("Error:"):
+        # Offline caller reports failures as "Error: ..." strings; never persist those.
+        return
+
+    now = time.time()
+    size = len(response.encode("utf-8"))
+    with _lock:
+        conn = _get_conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, stage, model_id, response, size, now, now),
+        )
+        _stats["stores"] += 1
+        _evict(conn)
+        conn.commit()
+
+def _evict(conn):
+    max_bytes = int(LLM_CACHE_MAX_MB * 1024 * 1024)
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+    if total <= max_bytes:
+        return
+
+    rows = conn.execute("SELECT key, size FROM responses ORDER BY accessed_at ASC").fetchall()
+    for key, size in rows:
+        if total <= max_bytes:
+            break
+        conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+        total -= size
+        _stats["evictions"] += 1
+
+def stats():
+    """
+    Returns a snapshot of the hit/miss counters for this process.
+    """
+    with _lock:
+        snapshot = dict(_stats)
+    lookups = snapshot["hits"] + snapshot["misses"]
+    snapshot["hit_rate"] = round(snapshot["hits"] / lookups, 3) if lookups else 0.0
+    return snapshot
@@ -2,6 +2,8 @@ import os
 import ollama
 from ollama import Client
 from dotenv import load_dotenv
+from utils import rate_limit
+from utils.tracing import traced_provider
 
 load_dotenv()
 
@@ -23,9 +25,11 @@ def get_client():
         )
     return None # Use default ollama.chat
 
-def query_offline_llm(prompt, model_name=None):
+@traced_provider("ollama")
+def query_offline_llm(prompt, model_name=None, json_mode=False):
     """
     Queries Ollama (Cloud if API Key present, else local).
+    json_mode constrains the output to valid JSON (format='json').
     """
     client = get_client()
     target_model = model_name if model_name else OLLAMA_MODEL
@@ -36,11 +40,15 @@ def query_offline_llm(prompt, model_name=None):
             {'role': 'user', 'content': prompt}
         ]
         
-        if client:
-            response = client.chat(model=target_model, messages=messages)
-        else:
-            response = ollama.chat(model=target_model, messages=messages)
+        rate_limit.acquire("ollama", prompt)
+        options = {"format": "json"} if json_mode else {}
+        with rate_limit.call_slot():
+            if client:
+                response = client.chat(model=target_model, messages=messages, **options)
+            else:
+                response = ollama.chat(model=target_model, messages=messages, **options)
             
+        rate_limit.record_completion("ollama", response['message']['content'])
         return response['message']['content']
     except Exception as e:
         error_str = str(e).lower()
@@ -51,6 +59,33 @@ def query_offline_llm(prompt, model_name=None):
         print(f"Error querying Ollama: {e}")
         return f"Error: {str(e)}"
 
+@traced_provider("ollama")
+def stream_offline_llm(prompt, model_name=None):
+    """
+    Streaming variant of query_offline_llm: yields the answer in chunks.
+    Errors are raised rather than returned as "Error: ..." text, so the
+    caller can still fail over before any output has been produced.
+    """
+    client = get_client()
+    target_model = model_name if model_name else OLLAMA_MODEL
+    messages = [
+        {'role': 'system', 'content': 'You are a helpful research assistant.'},
+        {'role': 'user', 'content': prompt}
+    ]
+
+    rate_limit.acquire("ollama", prompt)
+    chat = client.chat if client else ollama.chat
+    parts = []
+    try:
+        with rate_limit.call_slot():
+            for chunk in chat(model=target_model, messages=messages, stream=True):
+                content = chunk['message']['content']
+                if content:
+                    parts.append(content)
+                    yield content
+    finally:
+        rate_limit.record_completion("ollama", "".join(parts))
+
 if __name__ == "__main__":
     # Test Ollama
     mode = "Cloud" if OLLAMA_API_KEY else "Local"
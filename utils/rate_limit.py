@@ -0,0 +1,128 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from utils.tokens import estimate_tokens
+
+load_dotenv()
+
+# --- Configuration ---
+# Requests/min and tokens/min per provider. 0 disables that budget.
+# Defaults sit just under the free-tier ceilings of each provider.
+_DEFAULT_LIMITS = {
+    "groq": (30, 12000),
+    "anthropic": (50, 40000),
+    "gemini": (15, 1000000),
+    "ollama": (0, 0),
+}
+
+# Process-wide cap on in-flight provider calls, shared by every pipeline
+# running in this process (e.g. concurrent topics in batch mode).
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+_call_slots = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+
+def _limits_for(provider):
+    rpm, tpm = _DEFAULT_LIMITS.get(provider, (0, 0))
+    prefix = provider.upper()
+    rpm = float(os.getenv(f"{prefix}_RPM", rpm))
+    tpm = float(os.getenv(f"{prefix}_TPM", tpm))
+    return rpm, tpm
+
+class TokenBucket:
+    """
+    Classic token bucket refilled continuously at rate_per_min / 60 per second.
+    The level may go negative to account for usage discovered after the fact
+    (e.g. completion tokens), which delays later callers accordingly.
+    """
+
+    def __init__(self, rate_per_min):
+        self.capacity = rate_per_min
+        self.rate = rate_per_min / 60.0
+        self.level = rate_per_min
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount=1):
+        """
+        Blocks until amount units are available, then takes them.
+        Returns the time spent waiting in seconds.
+        """
+        # A single request larger than the bucket would otherwise wait forever
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self.level >= amount:
+                    self.level -= amount
+                    return waited
+                wait = (amount - self.level) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def debit(self, amount):
+        with self._lock:
+            self._refill()
+            self.level -= amount
+
+class ProviderLimiter:
+    def __init__(self, provider):
+        self.provider = provider
+        rpm, tpm = _limits_for(provider)
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.waited = 0.0
+
+    def acquire(self, prompt_tokens):
+        waited = 0.0
+        if self.requests:
+            waited += self.requests.acquire(1)
+        if self.tokens:
+            waited += self.tokens.acquire(prompt_tokens)
+        self.waited += waited
+        return waited
+
+    def record_completion(self, completion_tokens):
+        if self.tokens and completion_tokens:
+            self.tokens.debit(completion_tokens)
+
+_limiters = {}
+_registry_lock = threading.Lock()
+
+def get_limiter(provider):
+    with _registry_lock:
+        if provider not in _limiters:
+            _limiters[provider] = ProviderLimiter(provider)
+        return _limiters[provider]
+
+def acquire(provider, prompt):
+    """
+    Blocks until provider has request and token budget for prompt.
+    Every _call_* invokes this before sending so we stay under the
+    provider's real ceiling instead of reacting to 429s.
+    """
+    waited = get_limiter(provider).acquire(estimate_tokens(prompt))
+    if waited > 1:
+        print(f"  [RateLimit] {provider}: waited {waited:.1f}s for budget")
+
+def record_completion(provider, response_text):
+    """
+    Charges completion tokens against the provider's tokens/min budget.
+    """
+    get_limiter(provider).record_completion(estimate_tokens(response_text))
+
+@contextmanager
+def call_slot():
+    """
+    Holds one of the LLM_MAX_CONCURRENCY in-flight call slots. Providers
+    take it after acquire() and around the request only, so threads waiting
+    for budget or backing off do not occupy a slot.
+    """
+    with _call_slots:
+        yield
@@ -1,20 +1,50 @@
 import os
-import requests
 from bs4 import BeautifulSoup
 import io
 import PyPDF2
 from dotenv import load_dotenv
+from utils import fetch_cache
+from utils import http
+from utils import search_cache
+from utils.concurrency import is_congestion_error, note_congestion
+from utils.tracing import record_download
 
 load_dotenv()
 
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 GOOGLE_CSE_ID = os.getenv("GOOGLE_CSE_ID")
+# Overridable so benchmarks can point search at a local fake server
+GOOGLE_SEARCH_URL = os.getenv("GOOGLE_SEARCH_URL", "https://www.googleapis.com/customsearch/v1")
+
+# Download / extraction limits
+FETCH_MAX_BYTES = int(float(os.getenv("FETCH_MAX_MB", "25")) * 1024 * 1024)
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "60"))
+# Stage 3 analyzes at most ANALYSIS_MAX_CHUNKS chunks of ANALYSIS_CHUNK_TOKENS
+# (by default 6 x 6000 tokens, roughly 150k chars), so collecting far beyond
+# this only costs time and memory.
+FETCH_MAX_CHARS = int(os.getenv("FETCH_MAX_CHARS", "150000"))
+
+_quota_warned = False
 
 def google_search(query, num_results=5):
     """
     Performs a Google Custom Search.
+    Results are cached per normalized query, and live calls are refused once
+    today's CSE quota ceiling is reached.
     """
-    url = "https://www.googleapis.com/customsearch/v1"
+    global _quota_warned
+    cached = search_cache.lookup(query, num_results)
+    if cached is not None:
+        return cached
+    
+    if not search_cache.try_consume_quota():
+        if not _quota_warned:
+            _quota_warned = True
+            status = search_cache.quota_status()
+            print(f"Google Search quota ceiling reached ({status['used']}/{status['ceiling']} today). Skipping live queries.")
+        return []
+    
+    url = GOOGLE_SEARCH_URL
     params = {
         'key': GOOGLE_API_KEY,
         'cx': GOOGLE_CSE_ID,
@@ -22,51 +52,128 @@ def google_search(query, num_results=5):
         'num': num_results
     }
     try:
-        response = requests.get(url, params=params)
+        response = http.get(url, params=params, per_host_limit=False)
         response.raise_for_status()
-        return response.json().get('items', [])
+        items = response.json().get('items', [])
+        search_cache.store(query, num_results, items)
+        return items
     except Exception as e:
+        if is_congestion_error(e):
+            note_congestion("http")
         print(f"Error performing Google Search: {e}")
         return []
 
+def _extract_text(content, content_type, url):
+    """
+    Extracts plain text from a downloaded PDF or HTML payload.
+    """
+    if 'application/pdf' in content_type or url.endswith('.pdf'):
+        try:
+            with io.BytesIO(content) as open_pdf_file:
+                reader = PyPDF2.PdfReader(open_pdf_file)
+                pages = []
+                collected = 0
+                for i, page in enumerate(reader.pages):
+                    # Page-limited extraction with early exit once Stage 3 has enough text
+                    if i >= PDF_MAX_PAGES or collected >= FETCH_MAX_CHARS:
+                        break
+                    page_text = page.extract_text() or ""
+                    pages.append(page_text)
+                    collected += len(page_text) + 1
+                return "\n".join(pages)[:FETCH_MAX_CHARS]
+        except Exception as e:
+            print(f"Error parsing PDF {url}: {e}")
+            return ""
+    else:
+        # Assume HTML
+        soup = BeautifulSoup(content, 'html.parser')
+        # Kill all script and style elements
+        for script in soup(["script", "style"]):
+            script.decompose()
+        text = soup.get_text()
+        # Break into lines and remove leading and trailing space on each
+        lines = (line.strip() for line in text.splitlines())
+        # Break multi-headlines into a line each
+        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+        # Drop blank lines
+        text = '\n'.join(chunk for chunk in chunks if chunk)
+        return text[:FETCH_MAX_CHARS]
+
+def _read_limited(response, url):
+    """
+    Streams a response body into memory, refusing anything over FETCH_MAX_BYTES.
+    Returns the bytes, or None if the document is oversize.
+    """
+    # Pre-check: headers arrive before the body, so oversize files are skipped
+    # without downloading a byte of them.
+    declared = response.headers.get('Content-Length')
+    if declared and declared.isdigit() and int(declared) > FETCH_MAX_BYTES:
+        print(f"Skipping {url}: {int(declared) // (1024 * 1024)}MB exceeds size cap.")
+        return None
+
+    buffer = io.BytesIO()
+    for block in response.iter_content(chunk_size=64 * 1024):
+        buffer.write(block)
+        if buffer.tell() > FETCH_MAX_BYTES:
+            print(f"Skipping {url}: body exceeds {FETCH_MAX_BYTES // (1024 * 1024)}MB size cap.")
+            return None
+    return buffer.getvalue()
+
 def download_and_parse(url):
     """
     Downloads content from a URL and extracts text.
     Handles HTML and basic PDF parsing.
+    Extracted text is served from the on-disk fetch cache when fresh, and
+    stale entries are revalidated with ETag/Last-Modified before re-downloading.
     """
+    cached = fetch_cache.lookup(url) if fetch_cache.is_enabled() else None
+    
+    if cached and (cached['fresh'] or fetch_cache.FETCH_CACHE_OFFLINE):
+        fetch_cache.record_hit(url)
+        return cached['text']
+    
+    if fetch_cache.FETCH_CACHE_OFFLINE:
+        fetch_cache.record_miss()
+        return ""
+    
     try:
         headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
+        headers.update(fetch_cache.conditional_headers(cached))
+        session = http.get_session()
+        with http.host_slot(url), session.get(url, headers=headers, timeout=http.DEFAULT_TIMEOUT, stream=True) as response:
+            if response.status_code == 304 and cached:
+                fetch_cache.record_hit(url, revalidated=True)
+                return cached['text']
+            
+            response.raise_for_status()
+            
+            content_type = response.headers.get('Content-Type', '').lower()
+            body = _read_limited(response, url)
+            if body is None:
+                return ""
+            record_download(len(body))
         
-        content_type = response.headers.get('Content-Type', '').lower()
+        text = _extract_text(body, content_type, url)
         
-        if 'application/pdf' in content_type or url.endswith('.pdf'):
-            try:
-                with io.BytesIO(response.content) as open_pdf_file:
-                    reader = PyPDF2.PdfReader(open_pdf_file)
-                    text = ""
-                    for page in reader.pages:
-                        text += page.extract_text() + "\n"
-                    return text
-            except Exception as e:
-                print(f"Error parsing PDF {url}: {e}")
-                return ""
-        else:
-            # Assume HTML
-            soup = BeautifulSoup(response.content, 'html.parser')
-            # Kill all script and style elements
-            for script in soup(["script", "style"]):
-                script.decompose()
-            text = soup.get_text()
-            # Break into lines and remove leading and trailing space on each
-            lines = (line.strip() for line in text.splitlines())
-            # Break multi-headlines into a line each
-            chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-            # Drop blank lines
-            text = '\n'.join(chunk for chunk in chunks if chunk)
-            return text
+        if fetch_cache.is_enabled():
+            fetch_cache.record_miss()
+            fetch_cache.store(
+                url,
+                body,
+                text,
+                content_type=content_type,
+                etag=response.headers.get('ETag'),
+                last_modified=response.headers.get('Last-Modified'),
+            )
+        return text
 
     except Exception as e:
+        if is_congestion_error(e):
+            note_congestion("http")
+        if cached:
+            # Origin unreachable: a stale copy beats no copy
+            print(f"Error downloading {url}: {e}. Serving cached copy.")
+            fetch_cache.record_hit(url)
+            return cached['text']
         print(f"Error downloading {url}: {e}")
         return ""
@@ -0,0 +1,125 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Configuration ---
+SEARCH_CACHE_PATH = os.getenv("SEARCH_CACHE_PATH", ".cache/search_cache.sqlite")
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", str(7 * 24 * 3600)))
+SEARCH_CACHE_DISABLED = os.getenv("SEARCH_CACHE_DISABLED", "False").lower() == "true"
+# Custom Search JSON API free tier is 100 queries/day
+CSE_DAILY_QUOTA = int(os.getenv("CSE_DAILY_QUOTA", "100"))
+# Hard stop below the real quota, e.g. to keep headroom for other tools
+CSE_QUOTA_CEILING = int(os.getenv("CSE_QUOTA_CEILING", str(CSE_DAILY_QUOTA)))
+
+# Google resets the CSE quota at midnight Pacific time (fixed offset; DST ignored)
+_QUOTA_TZ = timezone(timedelta(hours=-8))
+
+_lock = threading.Lock()
+_conn = None
+_stats = {"hits": 0, "misses": 0, "refused": 0}
+
+def _get_conn():
+    global _conn
+    if _conn is None:
+        cache_dir = os.path.dirname(SEARCH_CACHE_PATH)
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+        _conn = sqlite3.connect(SEARCH_CACHE_PATH, check_same_thread=False)
+        _conn.execute("""
+            CREATE TABLE IF NOT EXISTS queries (
+                key TEXT PRIMARY KEY,
+                results TEXT,
+                fetched_at REAL
+            )
+        """)
+        _conn.execute("""
+            CREATE TABLE IF NOT EXISTS quota (
+                day TEXT PRIMARY KEY,
+                used INTEGER
+            )
+        """)
+        _conn.commit()
+    return _conn
+
+def normalize_query(query):
+    """
+    Canonical form used for lookup: lowercase, unified quotes, single spaces.
+    """
+    query = query.replace("“", '"').replace("”", '"').replace("’", "'")
+    return re.sub(r"\s+", " ", query.strip().lower())
+
+def _key(query, num_results):
+    return f"{normalize_query(query)}|{num_results}"
+
+def _today():
+    return datetime.now(_QUOTA_TZ).strftime("%Y-%m-%d")
+
+def lookup(query, num_results):
+    """
+    Returns cached result items for query, or None on miss/expiry.
+    """
+    if SEARCH_CACHE_DISABLED:
+        return None
+    with _lock:
+        row = _get_conn().execute(
+            "SELECT results, fetched_at FROM queries WHERE key = ?", (_key(query, num_results),)
+        ).fetchone()
+        if row is None or (SEARCH_CACHE_TTL > 0 and time.time() - row[1] > SEARCH_CACHE_TTL):
+            _stats["misses"] += 1
+            return None
+        _stats["hits"] += 1
+    return json.loads(row[0])
+
+def store(query, num_results, items):
+    if SEARCH_CACHE_DISABLED:
+        return
+    with _lock:
+        conn = _get_conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO queries VALUES (?, ?, ?)",
+            (_key(query, num_results), json.dumps(items), time.time()),
+        )
+        conn.commit()
+
+def try_consume_quota():
+    """
+    Atomically reserves one API query from today's budget.
+    Returns False (and spends nothing) once CSE_QUOTA_CEILING is reached.
+    """
+    day = _today()
+    with _lock:
+        conn = _get_conn()
+        row = conn.execute("SELECT used FROM quota WHERE day = ?", (day,)).fetchone()
+        used = row[0] if row else 0
+        if used >= CSE_QUOTA_CEILING:
+            _stats["refused"] += 1
+            return False
+        conn.execute("INSERT OR REPLACE INTO quota VALUES (?, ?)", (day, used + 1))
+        conn.commit()
+        return True
+
+def quota_status():
+    """
+    Reports today's Custom Search usage against the quota and ceiling.
+    """
+    with _lock:
+        row = _get_conn().execute("SELECT used FROM quota WHERE day = ?", (_today(),)).fetchone()
+        stats = dict(_stats)
+    used = row[0] if row else 0
+    return {
+        "day": _today(),
+        "used": used,
+        "ceiling": CSE_QUOTA_CEILING,
+        "daily_quota": CSE_DAILY_QUOTA,
+        "remaining": max(0, CSE_QUOTA_CEILING - used),
+        "cache_hits": stats["hits"],
+        "cache_misses": stats["misses"],
+        "refused": stats["refused"],
+    }
@@ -0,0 +1,56 @@
+import re
+
+# A Markdown heading at level 1-3, e.g. "## 3. Introduction"
+_HEADING = re.compile(r"^(#{1,3})\s+(.+?)\s*#*\s*$")
+
+def normalize_name(name):
+    """
+    'Section 3. Literature Review:' -> 'literature review', so reviewer
+    section names can be matched against the draft's headings.
+    """
+    name = re.sub(r"[*_`]", "", name or "").lower()
+    name = re.sub(r"^(section\s+)?[\divx]+[.):]?\s+", "", name)
+    return re.sub(r"[^a-z0-9&]+", " ", name).strip()
+
+def split_sections(markdown):
+    """
+    Splits a Markdown paper into [{"name", "text"}] at level 1-3 headings.
+    Each text starts with its heading line; text before the first heading
+    (or a paper with no headings) becomes a section named "preamble".
+    Joining every text back reproduces the paper.
+    """
+    sections = []
+    current = {"name": "preamble", "lines": []}
+    for line in (markdown or "").splitlines(keepends=True):
+        match = _HEADING.match(line.rstrip("\n"))
+        if match:
+            if current["lines"]:
+                sections.append(current)
+            current = {"name": match.group(2), "lines": []}
+        current["lines"].append(line)
+    if current["lines"]:
+        sections.append(current)
+    return [{"name": s["name"], "text": "".join(s["lines"])} for s in sections]
+
+def join_sections(sections):
+    return "".join(s["text"] if s["text"].endswith("\n") else s["text"] + "\n" for s in sections)
+
+def find_section(sections, name):
+    """
+    Index of the section whose heading matches name, or None.
+    """
+    wanted = normalize_name(name)
+    if not wanted:
+        return None
+    for i, section in enumerate(sections):
+        if normalize_name(section["name"]) == wanted:
+            return i
+    # Looser match for abbreviated names ("Conclusion" vs "Conclusion & Future Work")
+    for i, section in enumerate(sections):
+        have = normalize_name(section["name"])
+        if have and (have.startswith(wanted) or wanted.startswith(have)):
+            return i
+    return None
+
+def outline(sections):
+    return "\n".join(f"- {s['name']}" for s in sections if s["name"] != "preamble")
@@ -0,0 +1,78 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+_DONE = object()
+
+def stream_map(func, items, max_workers=2, buffer_size=4, label="stream"):
+    """
+    Lazily applies func to each element of items on a thread pool and yields
+    results in completion order.
+
+    Input is pulled by a background feeder thread, so an upstream generator
+    keeps producing while downstream consumers are busy. At most buffer_size
+    items are in flight or waiting to be consumed, which bounds memory and
+    back-pressures the producer. Items for which func returns None or raises
+    are dropped.
+    """
+    out = queue.Queue()
+    capacity = max(buffer_size, max_workers)
+    slots = threading.Semaphore(capacity)
+    stopped = threading.Event()
+    pending = [0]
+    pending_lock = threading.Lock()
+    feeding_done = threading.Event()
+
+    def finish_one():
+        with pending_lock:
+            pending[0] -= 1
+            last = feeding_done.is_set() and pending[0] == 0
+        if last:
+            out.put(_DONE)
+
+    def run(item):
+        try:
+            out.put(func(item))
+        except Exception as e:
+            print(f"  x [{label}] Worker failed: {e}")
+            out.put(None)
+        finally:
+            finish_one()
+
+    def feed(executor):
+        try:
+            for item in items:
+                slots.acquire()
+                if stopped.is_set():
+                    break
+                with pending_lock:
+                    pending[0] += 1
+                executor.submit(run, item)
+        except Exception as e:
+            print(f"  x [{label}] Producer failed: {e}")
+        finally:
+            with pending_lock:
+                feeding_done.set()
+                empty = pending[0] == 0
+            if empty:
+                out.put(_DONE)
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    feeder = threading.Thread(target=feed, args=(executor,), daemon=True)
+    feeder.start()
+    try:
+        while True:
+            result = out.get()
+            if result is _DONE:
+                break
+            # Slot is released once the consumer has taken the result
+            slots.release()
+            if result is not None:
+                yield result
+    finally:
+        # Unblock the feeder if the consumer stopped early
+        stopped.set()
+        for _ in range(capacity):
+            slots.release()
+        feeder.join()
+        executor.shutdown(wait=True)
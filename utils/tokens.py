@@ -0,0 +1,8 @@
+def estimate_tokens(text):
+    """
+    Cheap token estimate (~4 characters per token for English prose).
+    Good enough for budgeting and rate limiting; not a tokenizer.
+    """
+    if not text:
+        return 0
+    return len(text) // 4 + 1
@@ -0,0 +1,275 @@
+import os
+import json
+import time
+import inspect
+import functools
+import threading
+from collections import deque
+from utils.tokens import estimate_tokens
+
+# Latency samples kept per provider for the report quantiles; a fixed
+# window keeps long --batch processes from growing without bound
+LATENCY_SAMPLES = 1000
+
+# Provider -> USD per million (prompt, response) tokens, at the list price of
+# the model each caller uses. Override with <PROVIDER>_PRICE_IN/_PRICE_OUT.
+_DEFAULT_PRICES = {
+    "groq": (0.59, 0.79),        # llama-3.3-70b-versatile
+    "anthropic": (3.0, 15.0),    # claude-3-5-sonnet
+    "gemini": (0.10, 0.40),      # gemini-2.0-flash
+    "ollama": (0.0, 0.0),
+}
+
+def _prices_for(provider):
+    price_in, price_out = _DEFAULT_PRICES.get(provider, (0.0, 0.0))
+    prefix = provider.upper()
+    price_in = float(os.getenv(f"{prefix}_PRICE_IN", price_in))
+    price_out = float(os.getenv(f"{prefix}_PRICE_OUT", price_out))
+    return price_in, price_out
+
+def estimated_cost(provider, prompt_tokens, response_tokens):
+    """
+    USD cost of the given estimated token counts at provider's prices.
+    """
+    price_in, price_out = _prices_for(provider)
+    return (prompt_tokens * price_in + response_tokens * price_out) / 1_000_000
+
+_lock = threading.Lock()
+_started_at = time.time()
+_stages = {}
+_providers = {}
+_llm_stages = {}
+_counters = {"bytes_downloaded": 0, "documents_downloaded": 0}
+
+def _stage_entry(name):
+    if name not in _stages:
+        _stages[name] = {"calls": 0, "errors": 0, "wall_time_s": 0.0, "max_time_s": 0.0}
+    return _stages[name]
+
+def _record_stage(name, elapsed, failed):
+    with _lock:
+        entry = _stage_entry(name)
+        entry["calls"] += 1
+        entry["wall_time_s"] += elapsed
+        entry["max_time_s"] = max(entry["max_time_s"], elapsed)
+        if failed:
+            entry["errors"] += 1
+
+def traced_stage(name):
+    """
+    Decorator recording wall time, call count and errors for a stage
+    function. Generator functions are timed over their full iteration.
+    """
+    def decorator(func):
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def gen_wrapper(*args, **kwargs):
+                started = time.time()
+                failed = False
+                try:
+                    yield from func(*args, **kwargs)
+                except BaseException:
+                    failed = True
+                    raise
+                finally:
+                    _record_stage(name, time.time() - started, failed)
+            return gen_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.time()
+            failed = False
+            try:
+                return func(*args, **kwargs)
+            except BaseException:
+                failed = True
+                raise
+            finally:
+                _record_stage(name, time.time() - started, failed)
+        return wrapper
+    return decorator
+
+def _record_provider(provider, prompt, response, elapsed, first_token=None):
+    ok = isinstance(response, str) and not response.startswith("Error:")
+    with _lock:
+        entry = _providers.setdefault(provider, {
+            "calls": 0, "errors": 0, "latency_total_s": 0.0, "latency_max_s": 0.0,
+            "prompt_tokens": 0, "response_tokens": 0,
+            "latencies": deque(maxlen=LATENCY_SAMPLES), "first_token_latencies": deque(maxlen=LATENCY_SAMPLES),
+        })
+        entry["calls"] += 1
+        entry["errors"] += 0 if ok else 1
+        entry["latency_total_s"] += elapsed
+        entry["latency_max_s"] = max(entry["latency_max_s"], elapsed)
+        entry["prompt_tokens"] += estimate_tokens(prompt)
+        entry["response_tokens"] += estimate_tokens(response) if ok else 0
+        entry["latencies"].append(elapsed)
+        if first_token is not None:
+            entry["first_token_latencies"].append(first_token)
+
+def traced_provider(provider):
+    """
+    Decorator for the per-provider callers (_call_groq, ...): records latency,
+    success/failure and estimated prompt/response tokens (and so cost). The wrapped
+    function's first argument must be the prompt. Streaming callers
+    (generators) also record time to first chunk; a stream closed early by
+    its consumer still counts as a success.
+    """
+    def decorator(func):
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def gen_wrapper(prompt, *args, **kwargs):
+                started = time.time()
+                first_token = None
+                parts = []
+                ok = False
+                chunks = func(prompt, *args, **kwargs)
+                try:
+                    for chunk in chunks:
+                        if first_token is None:
+                            first_token = time.time() - started
+                        parts.append(chunk)
+                        yield chunk
+                    ok = bool(parts)
+                except GeneratorExit:
+                    ok = bool(parts)
+                    raise
+                finally:
+                    chunks.close()
+                    _record_provider(provider, prompt, "".join(parts) if ok else None,
+                                     time.time() - started, first_token)
+            return gen_wrapper
+
+        @functools.wraps(func)
+        def wrapper(prompt, *args, **kwargs):
+            started = time.time()
+            response = None
+            try:
+                response = func(prompt, *args, **kwargs)
+                return response
+            finally:
+                _record_provider(provider, prompt, response, time.time() - started)
+        return wrapper
+    return decorator
+
+def record_llm_request(stage, cache_hit=False, fallbacks=0):
+    """
+    Stage-level LLM accounting from query_stage: requests, cache hits and
+    how many providers failed before one answered.
+    """
+    with _lock:
+        entry = _llm_stages.setdefault(stage, {"requests": 0, "cache_hits": 0, "fallbacks": 0})
+        entry["requests"] += 1
+        entry["cache_hits"] += 1 if cache_hit else 0
+        entry["fallbacks"] += fallbacks
+
+def record_download(num_bytes):
+    with _lock:
+        _counters["bytes_downloaded"] += num_bytes
+        _counters["documents_downloaded"] += 1
+
+def _quantile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+def build_report(extra=None):
+    """
+    Snapshot of everything recorded so far in this process.
+    """
+    with _lock:
+        providers = {}
+        for name, entry in _providers.items():
+            latencies = entry["latencies"]
+            providers[name] = {
+                "calls": entry["calls"],
+                "errors": entry["errors"],
+                "latency_mean_s": round(entry["latency_total_s"] / entry["calls"], 3) if entry["calls"] else 0.0,
+                "latency_p50_s": round(_quantile(latencies, 0.5), 3),
+                "latency_p95_s": round(_quantile(latencies, 0.95), 3),
+                "latency_max_s": round(entry["latency_max_s"], 3),
+                "first_token_p50_s": round(_quantile(entry["first_token_latencies"], 0.5), 3),
+                "prompt_tokens_est": entry["prompt_tokens"],
+                "response_tokens_est": entry["response_tokens"],
+                "cost_usd_est": round(estimated_cost(name, entry["prompt_tokens"], entry["response_tokens"]), 4),
+            }
+        report = {
+            "started_at": _started_at,
+            "wall_time_s": round(time.time() - _started_at, 2),
+            "stages": {name: {k: round(v, 3) if isinstance(v, float) else v for k, v in e.items()}
+                       for name, e in _stages.items()},
+            "llm_by_stage": {name: dict(e) for name, e in _llm_stages.items()},
+            "providers": providers,
+            "cost_usd_est": round(sum(p["cost_usd_est"] for p in providers.values()), 4),
+            "network": dict(_counters),
+        }
+    if extra:
+        report.update(extra)
+    return report
+
+def write_report(path, extra=None):
+    """
+    Writes the JSON run report and returns it.
+    """
+    report = build_report(extra)
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Run report written to {path}")
+    return report
+
+def write_prometheus(path, report=None):
+    """
+    Writes the run metrics in Prometheus text exposition format, e.g. for the
+    node_exporter textfile collector.
+    """
+    report = report or build_report()
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            label_str = ",".join(f'{k}="{v}"' for k, v in labels.items())
+            lines.append(f"{name}{{{label_str}}} {value}" if label_str else f"{name} {value}")
+
+    stages = report["stages"]
+    metric("research_stage_seconds_total", "counter", "Wall time spent in each pipeline stage.",
+           [({"stage": s}, e["wall_time_s"]) for s, e in stages.items()])
+    metric("research_stage_calls_total", "counter", "Invocations of each pipeline stage.",
+           [({"stage": s}, e["calls"]) for s, e in stages.items()])
+
+    llm = report["llm_by_stage"]
+    metric("research_llm_requests_total", "counter", "LLM requests issued per stage.",
+           [({"stage": s}, e["requests"]) for s, e in llm.items()])
+    metric("research_llm_cache_hits_total", "counter", "LLM requests served from cache per stage.",
+           [({"stage": s}, e["cache_hits"]) for s, e in llm.items()])
+    metric("research_llm_fallbacks_total", "counter", "Provider failovers per stage.",
+           [({"stage": s}, e["fallbacks"]) for s, e in llm.items()])
+
+    providers = report["providers"]
+    metric("research_provider_calls_total", "counter", "Calls sent to each LLM provider.",
+           [({"provider": p}, e["calls"]) for p, e in providers.items()])
+    metric("research_provider_errors_total", "counter", "Failed calls per LLM provider.",
+           [({"provider": p}, e["errors"]) for p, e in providers.items()])
+    metric("research_provider_latency_seconds", "gauge", "Provider latency quantiles.",
+           [({"provider": p, "quantile": q}, e[f"latency_{k}_s"])
+            for p, e in providers.items() for q, k in (("0.5", "p50"), ("0.95", "p95"))])
+    metric("research_provider_tokens_total", "counter", "Estimated tokens per provider and direction.",
+           [({"provider": p, "direction": d}, e[f"{d}_tokens_est"])
+            for p, e in providers.items() for d in ("prompt", "response")])
+    metric("research_provider_cost_usd_total", "counter", "Estimated cost per LLM provider at list prices.",
+           [({"provider": p}, e["cost_usd_est"]) for p, e in providers.items()])
+
+    metric("research_bytes_downloaded_total", "counter", "Bytes downloaded by the fetcher.",
+           [({}, report["network"]["bytes_downloaded"])])
+
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    print(f"Prometheus metrics written to {path}")